@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+'''
+Adaptive MJPEG quality per viewer
+
+Each viewer has a RateController that picks a rung of a quality ladder
+(JPEG quality, scale step, frame rate) to keep its end-to-end latency,
+capture to the frame leaving the socket, near a target. A congested link
+steps down until the frames fit; a clear one steps back up.
+
+Frames are encoded once per rung that somebody watches, not once per
+viewer: a LadderEncoder is the encode function of the FramePipeline and
+returns {rung index: jpeg} for every frame, with only the rungs that are
+in use and due at their frame rate.
+
+    ladder = LadderEncoder(encode)           # encode(frame, quality, step)
+    pipeline = FramePipeline(capture, ladder, workers=3)
+    broadcaster = Broadcaster(pipeline.get)
+
+    def generate_frames():                   # one per viewer
+        with AdaptiveViewer(broadcaster, ladder) as viewer:
+            for jpeg in viewer.frames():
+                yield part(jpeg)             # the controller times the send
+
+The controller looks at, once per interval:
+
+- latency: capture time to the write returning, plus what is still
+  queued in the socket (TIOCOUTQ) at the measured throughput
+- busy: the fraction of the time spent blocked writing; near 1 the link
+  is the bottleneck
+- fps: frames delivered; viewers always take the newest frame, so a slow
+  link shows as lost frame rate more than as latency
+
+Above the target, or busy with less than half the rung's frame rate, it
+steps down, two rungs when far above the target. Well below the
+target and not busy for `hold` seconds, it tries one rung up. Each up-step
+that has to be undone right away doubles the hold.
+'''
+import time
+import struct
+import threading
+from collections import namedtuple
+from picarx.instrument import LatencyHistogram
+
+Rung = namedtuple('Rung', 'quality step fps')
+
+# best first; step 2 is 320x240 from 640x480
+LADDER = (
+    Rung(90, 1, 30),
+    Rung(75, 1, 30),
+    Rung(60, 1, 20),
+    Rung(60, 2, 20),
+    Rung(45, 2, 15),
+    Rung(35, 4, 10),
+    Rung(30, 4, 5),
+)
+
+
+def unsent_bytes(sock):
+    ''' bytes queued in sock's send buffer, None where the OS cannot tell '''
+    try:
+        import fcntl
+        import termios
+        return struct.unpack('i', fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b'\0\0\0\0'))[0]
+    except (ImportError, OSError, AttributeError, ValueError):
+        return None
+
+
+class LadderEncoder(object):
+    ''' encodes each frame once per rung in use
+
+    param encode: encode(frame, quality, step) returns JPEG bytes
+    param ladder: Rungs, best first
+    '''
+
+    def __init__(self, encode, ladder=LADDER):
+        self.encode = encode
+        self.ladder = tuple(ladder)
+        self.viewers = [0] * len(self.ladder)
+        self._last = [0.0] * len(self.ladder) # time of the last frame encoded per rung
+        self._lock = threading.Lock()
+        self.encoded = [0] * len(self.ladder)
+
+    def join(self, rung):
+        with self._lock:
+            self.viewers[rung] += 1
+
+    def leave(self, rung):
+        with self._lock:
+            self.viewers[rung] -= 1
+
+    def move(self, old, new):
+        with self._lock:
+            self.viewers[old] -= 1
+            self.viewers[new] += 1
+
+    def _due(self):
+        # rungs to encode for the frame captured now, none watched encodes the best
+        now = time.monotonic()
+        with self._lock:
+            active = [i for i, n in enumerate(self.viewers) if n > 0] or [0]
+            due = []
+            for i in active:
+                # a frame period minus a little slack, capture jitter must not halve the rate
+                if now - self._last[i] >= 0.9 / self.ladder[i].fps:
+                    self._last[i] = now
+                    due.append(i)
+            return due
+
+    def __call__(self, frame):
+        frames = {}
+        for i in self._due():
+            rung = self.ladder[i]
+            data = self.encode(frame, rung.quality, rung.step)
+            if data is not None:
+                frames[i] = data
+                self.encoded[i] += 1
+        return frames or None
+
+
+class RateController(object):
+    ''' picks the rung of one viewer
+
+    param ladder: Rungs, best first
+    param target: end-to-end latency to hold, seconds
+    param best, worst: bounds, indexes into the ladder
+    param interval: seconds between decisions
+    param hold: seconds of good conditions before stepping up, doubles on failed steps
+    '''
+
+    def __init__(self, ladder=LADDER, target=0.25, best=0, worst=None, interval=0.5, hold=2.0):
+        self.ladder = tuple(ladder)
+        self.target = target
+        self.best = best
+        self.worst = len(self.ladder) - 1 if worst is None else worst
+        self.interval = interval
+        self.base_hold = hold
+        self.hold = hold
+        self.rung = best
+        self.latency = LatencyHistogram() # ns capture to sent
+        self.throughput = 0.0  # bytes/s while writing, smoothed
+        self.switches = 0
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_frames = 0
+        self._window_busy = 0.0
+        self._window_worst = 0.0
+        self._good_since = None
+        self._last_up = None
+        self.last_latency = 0.0
+        self.last_busy = 0.0
+        self.last_fps = 0.0
+
+    def sent(self, size, write_time, captured, backlog=None):
+        ''' a frame of size bytes, captured at time.monotonic() captured, took
+        write_time seconds to write; backlog: bytes still in the socket
+
+        return: the rung to use next
+        '''
+        now = time.monotonic()
+        if write_time > 0.001:
+            sample = size / write_time
+            self.throughput = sample if not self.throughput else 0.8 * self.throughput + 0.2 * sample
+        latency = now - captured
+        if backlog and self.throughput:
+            latency += backlog / self.throughput
+        self.latency.record(int(latency * 1e9))
+        self._window_bytes += size
+        self._window_frames += 1
+        self._window_busy += write_time
+        self._window_worst = max(self._window_worst, latency)
+        if now - self._window_start >= self.interval:
+            self._decide(now)
+        return self.rung
+
+    def _decide(self, now):
+        elapsed = now - self._window_start
+        busy = self._window_busy / elapsed
+        fps = self._window_frames / elapsed
+        latency = self._window_worst
+        self.last_latency, self.last_busy, self.last_fps = latency, busy, fps
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_frames = 0
+        self._window_busy = 0.0
+        self._window_worst = 0.0
+        starved = busy > 0.8 and fps < 0.5 * self.ladder[self.rung].fps
+        if latency > self.target or starved:
+            steps = 2 if latency > 2 * self.target else 1
+            if self._last_up is not None and now - self._last_up < 2 * self.interval + self.hold:
+                # the last step up did not hold, wait longer before the next
+                self.hold = min(self.hold * 2, 16 * self.base_hold)
+            self._good_since = None
+            self._set(min(self.worst, self.rung + steps))
+            return
+        if latency < 0.5 * self.target and busy < 0.5:
+            if self._good_since is None:
+                self._good_since = now
+            elif now - self._good_since >= self.hold and self.rung > self.best:
+                self._set(self.rung - 1)
+                self._last_up = now
+                self._good_since = None
+        else:
+            self._good_since = None
+
+    def _set(self, rung):
+        if rung != self.rung:
+            self.rung = rung
+            self.switches += 1
+
+    def stats(self):
+        latency = self.latency.summary()
+        return {
+            'rung': self.rung,
+            'quality': self.ladder[self.rung].quality,
+            'step': self.ladder[self.rung].step,
+            'fps': self.ladder[self.rung].fps,
+            'switches': self.switches,
+            'hold_s': self.hold,
+            'throughput_kBps': self.throughput / 1e3,
+            'busy': self.last_busy,
+            'delivered_fps': self.last_fps,
+            'latency_p50_ms': latency['p50_us'] / 1e3,
+            'latency_p99_ms': latency['p99_us'] / 1e3,
+        }
+
+
+class AdaptiveViewer(object):
+    ''' a Broadcaster subscriber that takes its frames from the rung its
+    RateController picks; use it as a context manager
+
+    param socket: the client socket when the server exposes it, for the backlog
+    param controller_kwargs: RateController() arguments, e.g. target=0.2
+    '''
+
+    def __init__(self, broadcaster, ladder, socket=None, **controller_kwargs):
+        self.ladder = ladder
+        self.socket = socket
+        self.controller = RateController(ladder.ladder, **controller_kwargs)
+        self.subscriber = broadcaster.subscribe()
+        self.rung = self.controller.rung
+        ladder.join(self.rung)
+
+    def next(self, timeout=5.0):
+        ''' (jpeg, capture time) for the current rung, None on timeout or close '''
+        # frames without this rung (not due at its frame rate) are skipped
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if self.subscriber.closed:
+                return None
+            newest = self.subscriber.broadcaster.slot.wait(self.subscriber.last_seq, remaining)
+            if newest is None:
+                return None
+            seq, frames, captured = newest
+            if self.rung in frames:
+                self.subscriber.seen(seq)
+                return frames[self.rung], captured
+            self.subscriber.skip(seq)
+
+    def sent(self, size, write_time, captured):
+        ''' report a frame as written, switches rung if the controller says so '''
+        backlog = unsent_bytes(self.socket) if self.socket is not None else None
+        rung = self.controller.sent(size, write_time, captured, backlog)
+        if rung != self.rung:
+            self.ladder.move(self.rung, rung)
+            self.rung = rung
+
+    def frames(self, timeout=5.0):
+        ''' yield JPEGs, timing how long the consumer takes with each one
+
+        The generator resumes once the server wrote the previous frame, so
+        the time between yields is the write time.
+        '''
+        while True:
+            frame = self.next(timeout)
+            if frame is None:
+                return
+            data, captured = frame
+            st = time.monotonic()
+            yield data
+            self.sent(len(data), time.monotonic() - st, captured)
+
+    def close(self):
+        if self.subscriber is not None:
+            self.ladder.leave(self.rung)
+            self.subscriber.close()
+            self.subscriber = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -2,6 +2,12 @@
 import subprocess
 import time
 import sys
+import os
+from picarx.broker import NAME, wait_for_broker
+
+# owns the only Picarx, the services talk to it through shared memory
+BROKER = ["sudo", "python3", "-m", "picarx.broker"]
+BROKER_TIMEOUT = 15 # seconds for the broker to reset the car and start its heartbeat
 
 SCRIPTS = [
     "/home/fahad/picar-x/aqx-bot/motion_server.py",
@@ -9,13 +15,33 @@ SCRIPTS = [
     "/home/fahad/picar-x/aqx-bot/sound.py"
 ]
 
+def broker_ready(timeout=BROKER_TIMEOUT):
+    # services started before the heartbeat would build their own Picarx
+    # and fight the broker over the pins
+    try:
+        return wait_for_broker(NAME, timeout)
+    except PermissionError:
+        # the segment is root's, without sudo we can only see that it is there
+        deadline = time.monotonic() + timeout
+        while not os.path.exists("/dev/shm/" + NAME):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        time.sleep(1)  # its heartbeat starts right after the segment
+        return True
+
 def main():
     print("?? Starting PiCar-X services...")
     processes = []
     
     try:
-        for script in SCRIPTS:
-            cmd = ["sudo", "python3", script]
+        p = subprocess.Popen(BROKER)
+        processes.append(p)
+        print(f"? Launched: {' '.join(BROKER)} (PID: {p.pid})")
+        if not broker_ready():
+            raise RuntimeError("picarx broker did not start within %d s" % BROKER_TIMEOUT)
+
+        for cmd in [["sudo", "python3", script] for script in SCRIPTS]:
             p = subprocess.Popen(cmd)
             processes.append(p)
             print(f"? Launched: {' '.join(cmd)} (PID: {p.pid})")
@@ -30,6 +56,11 @@ def main():
         for p in processes:
             p.terminate()
         sys.exit(0)
+    except RuntimeError as e:
+        print(f"!! {e}, stopping")
+        for p in processes:
+            p.terminate()
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
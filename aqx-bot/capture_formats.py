@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+'''
+Camera formats for the video path, and the cheapest way to JPEG from each
+
+- 'xbgr'    XBGR8888, the create_video_configuration() default: R, G, B, X
+            bytes per pixel. cv2 wants B, G, R, so every frame went through
+            cv2.cvtColor first, a full frame allocated and copied.
+- 'bgr'     RGB888: despite the name Picamera2 lays it out B, G, R, which
+            is what cv2.imencode takes. No conversion, a quarter less to
+            copy out of the camera buffer.
+- 'yuv420'  YUV420 (I420): 1.5 bytes per pixel, half of 'xbgr'. JPEG is
+            YUV inside, so simplejpeg.encode_jpeg_yuv_planes() takes the
+            planes as they are, as views into the captured array, no
+            colour conversion anywhere. simplejpeg comes with Picamera2.
+
+    convert, encode = encoder('yuv420')
+    picam2.configure(video_configuration(picam2, 'yuv420', (640, 480)))
+    jpeg = encode(picam2.capture_array())   # convert is None here
+'''
+FORMATS = {
+    'xbgr': 'XBGR8888',
+    'bgr': 'RGB888',
+    'yuv420': 'YUV420',
+}
+
+
+def video_configuration(picam2, path, size=(640, 480)):
+    ''' Picamera2 video configuration delivering frames for path '''
+    return picam2.create_video_configuration(main={"size": size, "format": FORMATS[path]})
+
+
+def yuv420_planes(frame):
+    ''' Y, U, V views of an I420 frame of shape (height * 3 / 2, width), no copies '''
+    height = frame.shape[0] * 2 // 3
+    width = frame.shape[1]
+    quarter = height // 4 # rows of the full width array each chroma plane takes
+    y = frame[:height]
+    u = frame[height:height + quarter].reshape(height // 2, width // 2)
+    v = frame[height + quarter:height + 2 * quarter].reshape(height // 2, width // 2)
+    return y, u, v
+
+
+def encoder(path, quality=95):
+    ''' (convert, encode) for frames captured in path, quality 95 is cv2's default
+
+    convert(frame) makes what encode() takes, None when nothing is needed;
+    encode(frame) returns the JPEG bytes, None if encoding failed
+    '''
+    if path not in FORMATS:
+        raise ValueError("unknown capture path %r, one of %s" % (path, ', '.join(FORMATS)))
+    if path == 'yuv420':
+        import simplejpeg
+
+        def encode_yuv420(frame):
+            return simplejpeg.encode_jpeg_yuv_planes(*yuv420_planes(frame), quality=quality)
+        return None, encode_yuv420
+
+    import cv2
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+
+    def encode_bgr(frame):
+        ret, jpeg = cv2.imencode('.jpg', frame, params)
+        return jpeg.tobytes() if ret else None
+
+    if path == 'xbgr':
+        def rgb_to_bgr(frame):
+            # Convert RGB (picamera2) to BGR (OpenCV) for correct colors
+            return cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        return rgb_to_bgr, encode_bgr
+    return None, encode_bgr
+
+
+def ladder_encoder(path):
+    ''' (convert, encode) like encoder(), encode(frame, quality, step) also
+    scales the frame down by the integer step (every step-th pixel and row) '''
+    import numpy as np
+    if path not in FORMATS:
+        raise ValueError("unknown capture path %r, one of %s" % (path, ', '.join(FORMATS)))
+    if path == 'yuv420':
+        import simplejpeg
+
+        def encode_yuv420(frame, quality, step=1):
+            planes = yuv420_planes(frame)
+            if step > 1:
+                planes = [np.ascontiguousarray(plane[::step, ::step]) for plane in planes]
+            return simplejpeg.encode_jpeg_yuv_planes(*planes, quality=quality)
+        return None, encode_yuv420
+
+    import cv2
+    convert, _ = encoder(path)
+
+    def encode_bgr(frame, quality, step=1):
+        if step > 1:
+            frame = np.ascontiguousarray(frame[::step, ::step])
+        ret, jpeg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        return jpeg.tobytes() if ret else None
+    return convert, encode_bgr
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+'''
+Encode once, send to every viewer
+
+One producer thread captures and encodes; each JPEG goes into a shared
+latest-frame slot. Every viewer has a Subscriber that waits for the slot
+to change and takes whatever is newest, so a slow viewer skips frames
+instead of queueing them, and the encode cost does not grow with the
+number of viewers. The producer only runs while somebody is watching.
+
+    broadcaster = Broadcaster(capture, encode)    # camera and codec callables
+    broadcaster.start()
+
+    def generate_frames():                        # one per HTTP client
+        with broadcaster.subscribe() as subscriber:
+            for jpeg in subscriber.frames():
+                yield part(jpeg)
+'''
+import time
+import threading
+from picarx.instrument import LatencyHistogram
+
+
+class FrameSlot(object):
+    ''' the newest frame and its sequence number, waitable '''
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.seq = 0
+        self.frame = None
+        self.time = 0.0   # time.monotonic() of the capture
+        self.closed = False
+        self.listeners = [] # called after every publish, e.g. to wake an event loop
+
+    def publish(self, frame, t=None):
+        with self._cond:
+            self.seq += 1
+            self.frame = frame
+            self.time = time.monotonic() if t is None else t
+            self._cond.notify_all()
+        for listener in self.listeners:
+            listener()
+
+    def latest(self):
+        ''' (seq, frame, time) of the newest frame, seq 0 before the first '''
+        with self._cond:
+            return self.seq, self.frame, self.time
+
+    def wait(self, after, timeout=None):
+        ''' (seq, frame, time) of the newest frame with seq > after, None on
+        timeout or when the slot was closed '''
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > after or self.closed, timeout):
+                return None
+            if self.closed:
+                return None
+            return self.seq, self.frame, self.time
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class Subscriber(object):
+    ''' one viewer of a Broadcaster, use it as a context manager '''
+
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.last_seq = broadcaster.slot.seq
+        self.sent = 0
+        self.dropped = 0   # frames published while this viewer was busy, not the ones it skipped
+        self.closed = False
+
+    def next(self, timeout=None):
+        ''' the newest frame not seen yet, None on timeout or close '''
+        newest = self.next_timed(timeout)
+        return newest[0] if newest is not None else None
+
+    def next_timed(self, timeout=None):
+        ''' (frame, capture time) of the newest frame not seen yet, None on timeout or close '''
+        if self.closed:
+            return None
+        newest = self.broadcaster.slot.wait(self.last_seq, timeout)
+        if newest is None:
+            return None
+        seq, frame, t = newest
+        self.seen(seq)
+        return frame, t
+
+    def seen(self, seq):
+        ''' count frame seq as taken, for callers that wait on the slot themselves '''
+        if self.sent:
+            self.dropped += seq - self.last_seq - 1
+        self.last_seq = seq
+        self.sent += 1
+
+    def skip(self, seq):
+        ''' pass over frame seq on purpose (not due at this viewer's frame rate):
+        not sent and not a drop, only the frames missed before it count '''
+        if self.sent:
+            self.dropped += seq - self.last_seq - 1
+        self.last_seq = seq
+
+    def frames(self, timeout=5.0):
+        ''' yield frames until the broadcaster stops or none comes for timeout seconds '''
+        while True:
+            frame = self.next(timeout)
+            if frame is None:
+                return
+            yield frame
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broadcaster._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Broadcaster(object):
+    ''' one capture + encode thread feeding any number of subscribers
+
+    param capture: capture() returns a frame, blocking until one is ready
+    param encode: encode(frame) returns the bytes to send, None to skip it;
+                  None when capture() already returns them (FramePipeline.get)
+    param idle: stop capturing while there are no subscribers
+    param timed: capture() returns (frame, time.monotonic() of the capture)
+    '''
+
+    def __init__(self, capture, encode=None, idle=True, timed=False):
+        self.capture = capture
+        self.timed = timed
+        self.encode = encode
+        self.idle = idle
+        self.slot = FrameSlot()
+        self.subscribers = []
+        self._lock = threading.Lock()
+        self._watched = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.encoded = 0
+        self.errors = 0
+        self.encode_time = LatencyHistogram() # ns per capture + encode, or waiting for a pipeline frame
+        if not idle:
+            self._watched.set()
+
+    def subscribe(self):
+        subscriber = Subscriber(self)
+        with self._lock:
+            self.subscribers.append(subscriber)
+            self._watched.set()
+        return subscriber
+
+    def _unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            if self.idle and not self.subscribers:
+                self._watched.clear()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self._watched.wait(0.5):
+                continue
+            try:
+                st = time.perf_counter()
+                if self.timed:
+                    frame, t = self.capture()
+                else:
+                    frame = self.capture()
+                    t = time.monotonic()
+                data = self.encode(frame) if self.encode is not None else frame
+                self.encode_time.record(int((time.perf_counter() - st) * 1e9))
+            except Exception as e:
+                self.errors += 1
+                print("broadcaster: %s" % e)
+                time.sleep(0.1)
+                continue
+            if data is None:
+                continue
+            self.encoded += 1
+            self.slot.publish(data, t)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='broadcaster', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._watched.set()
+        self.slot.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        encode = self.encode_time.summary()
+        with self._lock:
+            subscribers = [{'sent': s.sent, 'dropped': s.dropped} for s in self.subscribers]
+        return {
+            'encoded': self.encoded,
+            'errors': self.errors,
+            'encode_p50_ms': encode['p50_us'] / 1e3,
+            'encode_p99_ms': encode['p99_us'] / 1e3,
+            'subscribers': subscribers,
+        }
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+'''
+asyncio MJPEG server
+
+Serves a Broadcaster's frames from one thread and one event loop instead
+of a thread and a generator per client. Each frame goes out with
+writer.write() and the client then awaits drain(), so a slow client only
+holds its own coroutine and the transport's small write buffer.
+
+    GET /video_feed    multipart/x-mixed-replace MJPEG stream
+    GET /snapshot      the newest frame as one image/jpeg
+    GET /stats         JSON: clients, the per-client controllers, and the
+                       stats of whatever else was passed in
+
+    server = MJPEGServer(broadcaster, ladder)    # ladder: adaptive_stream
+    server.run('0.0.0.0', 5000)
+
+The broadcaster thread wakes the loop through a FrameSlot listener once
+per frame, no matter how many clients there are. With a LadderEncoder
+every client gets an AdaptiveViewer: its controller is fed the drain time
+and the socket backlog, and the frames come from its rung.
+'''
+import json
+import time
+import asyncio
+from adaptive_stream import AdaptiveViewer
+
+BOUNDARY = b'frame'
+WRITE_BUFFER = 64 * 1024 # bytes a client may have queued in the transport before drain() waits
+
+
+class MJPEGServer(object):
+    ''' MJPEG over HTTP/1.1 from a Broadcaster
+
+    param broadcaster: frame_broadcast.Broadcaster, its frames are JPEG bytes,
+                       or {rung: jpeg} dicts when ladder is given
+    param ladder: adaptive_stream.LadderEncoder for per-client quality, or None
+    param target: end-to-end latency the adaptive controllers aim for, seconds
+    param stats: {name: callable} added to /stats, e.g. the pipeline's stats
+    '''
+
+    def __init__(self, broadcaster, ladder=None, target=0.25, stats=None):
+        self.broadcaster = broadcaster
+        self.ladder = ladder
+        self.target = target
+        self.extra_stats = dict(stats or {})
+        self.clients = {}     # client id: {'addr', 'viewer' or 'subscriber', 'frames', 'bytes'}
+        self._ids = 0
+        self._loop = None
+        self._frame = None    # future resolved on the next published frame
+        self.requests = 0
+        self.errors = 0
+
+    # frame wakeups, from the broadcaster thread into the loop
+
+    def _on_publish(self):
+        self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if self._frame is not None and not self._frame.done():
+            self._frame.set_result(None)
+
+    async def _next_frame(self, after, timeout=5.0):
+        ''' (seq, frame, capture time) newer than after, None on timeout '''
+        deadline = time.monotonic() + timeout
+        while True:
+            seq, frame, t = self.broadcaster.slot.latest()
+            if seq > after:
+                return seq, frame, t
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if self._frame is None or self._frame.done():
+                self._frame = self._loop.create_future()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._frame), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    # HTTP
+
+    async def _handle(self, reader, writer):
+        self.requests += 1
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            method, path, _ = request.split(b'\r\n', 1)[0].decode('latin-1').split(' ', 2)
+            path = path.split('?', 1)[0]
+            if method != 'GET':
+                await self._respond(writer, 405, 'text/plain', b'method not allowed\n')
+            elif path == '/video_feed':
+                await self._stream(writer)
+            elif path == '/snapshot':
+                await self._snapshot(writer)
+            elif path == '/stats':
+                body = json.dumps(self.stats(), indent=1).encode()
+                await self._respond(writer, 200, 'application/json', body)
+            else:
+                await self._respond(writer, 404, 'text/plain', b'not found\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError):
+            self.errors += 1
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, content_type, body):
+        reason = {200: 'OK', 404: 'Not Found', 405: 'Method Not Allowed', 503: 'Service Unavailable'}[status]
+        writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n'
+                     b'Cache-Control: no-cache\r\nConnection: close\r\n\r\n'
+                     % (status, reason.encode(), content_type.encode(), len(body)) + body)
+        await writer.drain()
+
+    async def _snapshot(self, writer):
+        with self.broadcaster.subscribe():
+            # the producer may be idle, a frame older than a second is not a snapshot
+            seq, frame, t = self.broadcaster.slot.latest()
+            if frame is None or time.monotonic() - t > 1.0:
+                newest = await self._next_frame(seq)
+                frame = newest[1] if newest is not None else None
+        if isinstance(frame, dict):
+            frame = frame[min(frame)] if frame else None # best rung there is
+        if frame is None:
+            await self._respond(writer, 503, 'text/plain', b'no frame\n')
+        else:
+            await self._respond(writer, 200, 'image/jpeg', frame)
+
+    async def _stream(self, writer):
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER)
+        sock = writer.get_extra_info('socket')
+        self._ids += 1
+        client_id = self._ids
+        if self.ladder is not None:
+            viewer = AdaptiveViewer(self.broadcaster, self.ladder, socket=sock, target=self.target)
+            subscriber = viewer.subscriber
+        else:
+            viewer = None
+            subscriber = self.broadcaster.subscribe()
+        client = {'addr': '%s:%s' % writer.get_extra_info('peername')[:2], 'viewer': viewer,
+                  'subscriber': subscriber, 'frames': 0, 'bytes': 0, 'since': time.monotonic()}
+        self.clients[client_id] = client
+        try:
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Content-Type: multipart/x-mixed-replace; boundary=' + BOUNDARY + b'\r\n'
+                         b'Cache-Control: no-cache\r\nConnection: close\r\n\r\n')
+            await writer.drain()
+            last_seq = subscriber.last_seq
+            while True:
+                newest = await self._next_frame(last_seq)
+                if newest is None:
+                    return
+                last_seq, frame, captured = newest
+                if viewer is not None:
+                    frame = frame.get(viewer.rung)
+                    if frame is None:
+                        subscriber.skip(last_seq) # not due at this client's frame rate
+                        continue
+                subscriber.seen(last_seq)
+                st = time.monotonic()
+                writer.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n'
+                             b'Content-Length: %d\r\n\r\n' % len(frame))
+                writer.write(frame)
+                writer.write(b'\r\n')
+                await writer.drain()
+                client['frames'] += 1
+                client['bytes'] += len(frame)
+                if viewer is not None:
+                    viewer.sent(len(frame), time.monotonic() - st, captured)
+        finally:
+            del self.clients[client_id]
+            if viewer is not None:
+                viewer.close()
+            else:
+                subscriber.close()
+
+    def stats(self):
+        now = time.monotonic()
+        clients = []
+        for client in list(self.clients.values()):
+            elapsed = max(now - client['since'], 1e-6)
+            entry = {
+                'addr': client['addr'],
+                'fps': client['frames'] / elapsed,
+                'kBps': client['bytes'] / elapsed / 1e3,
+                'dropped': client['subscriber'].dropped,
+            }
+            if client['viewer'] is not None:
+                entry['controller'] = client['viewer'].controller.stats()
+            clients.append(entry)
+        stats = {
+            'requests': self.requests,
+            'errors': self.errors,
+            'clients': clients,
+            'broadcaster': self.broadcaster.stats(),
+        }
+        if self.ladder is not None:
+            stats['encoded_per_rung'] = list(self.ladder.encoded)
+        for name, source in self.extra_stats.items():
+            stats[name] = source()
+        return stats
+
+    async def serve(self, host='0.0.0.0', port=5000):
+        ''' serve until cancelled '''
+        self._loop = asyncio.get_running_loop()
+        self.broadcaster.slot.listeners.append(self._on_publish)
+        try:
+            server = await asyncio.start_server(self._handle, host, port)
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.broadcaster.slot.listeners.remove(self._on_publish)
+
+    def run(self, host='0.0.0.0', port=5000):
+        try:
+            asyncio.run(self.serve(host, port))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+'''
+Motion command protocol
+
+v1 (legacy): 2, 3 or 4 native floats, told apart by the packet length
+    linear, angular[, camera_yaw[, camera_pitch]]
+
+v2: 32 bytes, little endian
+    magic   2s   b'PX'
+    version u8   2
+    flags   u8   HAS_YAW | HAS_PITCH
+    seq     u32  incremented by the sender for every packet
+    sent_ns u64  sender time.monotonic_ns()
+    linear, angular, camera_yaw, camera_pitch   4 x float32
+
+The server accepts both. For v2 it drops packets that are older than the
+newest it has seen (reordered or duplicated) and keeps statistics: loss
+from sequence gaps, reorders, and the one-way latency. Sender and car
+clocks are not synchronised, so the latency is reported relative to the
+fastest packet seen (jitter on top of the base network delay).
+
+A sender that restarts counts from 1 again. The decoder takes that as a
+new stream (resync) when the sequence number jumps back by more than
+RESYNC_GAP, or when nothing was accepted for resync_after seconds, so a
+restarted controller is not ignored until it catches up with the old count.
+
+Sender side, e.g. in the ROS 2 node:
+
+    sender = MotionSender()
+    sock.sendto(sender.encode(linear, angular, yaw, pitch), (car_ip, 9001))
+'''
+import time
+import struct
+from collections import namedtuple
+from picarx.instrument import LatencyHistogram
+
+MAGIC = b'PX'
+VERSION = 2
+HEADER = struct.Struct('<2sBBIQ')
+PAYLOAD = struct.Struct('<4f')
+PACKET_SIZE = HEADER.size + PAYLOAD.size
+HAS_YAW = 0x01
+HAS_PITCH = 0x02
+LEGACY_SIZES = (8, 12, 16)
+MAX_GAP = 256 # missing sequence numbers remembered for reorder detection
+RESYNC_GAP = 1024 # a jump back by more than this is a restarted sender, not a late packet
+
+MotionCommand = namedtuple('MotionCommand', 'linear angular yaw pitch seq sent_ns version')
+
+
+def encode(linear, angular, yaw=None, pitch=None, seq=0, sent_ns=None):
+    ''' a v2 packet '''
+    flags = (HAS_YAW if yaw is not None else 0) | (HAS_PITCH if pitch is not None else 0)
+    if sent_ns is None:
+        sent_ns = time.monotonic_ns()
+    return HEADER.pack(MAGIC, VERSION, flags, seq & 0xffffffff, sent_ns) + \
+        PAYLOAD.pack(linear, angular, yaw or 0.0, pitch or 0.0)
+
+
+def decode(data):
+    ''' MotionCommand from a v2 or legacy packet, ValueError if it is neither '''
+    if len(data) == PACKET_SIZE and data[:2] == MAGIC:
+        _, version, flags, seq, sent_ns = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError("unsupported protocol version %d" % version)
+        linear, angular, yaw, pitch = PAYLOAD.unpack_from(data, HEADER.size)
+        return MotionCommand(linear, angular,
+                             yaw if flags & HAS_YAW else None,
+                             pitch if flags & HAS_PITCH else None,
+                             seq, sent_ns, VERSION)
+    if len(data) in LEGACY_SIZES:
+        linear, angular, *camera = struct.unpack('f' * (len(data) // 4), data)
+        yaw, pitch = (camera + [None, None])[:2]
+        return MotionCommand(linear, angular, yaw, pitch, None, None, 1)
+    raise ValueError("unexpected packet size %d" % len(data))
+
+
+class MotionSender(object):
+    ''' numbers and timestamps v2 packets '''
+
+    def __init__(self):
+        self.seq = 0
+
+    def encode(self, linear, angular, yaw=None, pitch=None):
+        self.seq = (self.seq + 1) & 0xffffffff
+        return encode(linear, angular, yaw, pitch, self.seq)
+
+
+class MotionDecoder(object):
+    ''' decodes packets in arrival order and keeps the protocol statistics
+
+    param resync_after: seconds without an accepted packet after which any
+                        sequence number starts a new stream
+    '''
+
+    def __init__(self, resync_after=0.5):
+        self.resync_after = resync_after
+        self.last_seq = None
+        self._accepted = 0.0 # time.monotonic() of the last accepted v2 packet
+        self.packets = 0
+        self.legacy = 0
+        self.invalid = 0
+        self.reordered = 0  # dropped, arrived after a newer packet
+        self.duplicates = 0
+        self.lost = 0       # sequence numbers never seen
+        self.resyncs = 0    # sender restarts, see RESYNC_GAP
+        self._missing = set() # recent gaps, a late packet filling one is not lost
+        self._offset = None # smallest receive - send seen, ns
+        self.transit = LatencyHistogram()   # ns above the fastest packet
+        self.actuation = LatencyHistogram() # ns from receive to the actuator call returning
+
+    def decode(self, data, received=None):
+        ''' MotionCommand, or None if the packet is invalid or out of order
+
+        param received: receive time in seconds (time.time() clock), for latency
+        '''
+        try:
+            command = decode(data)
+        except (ValueError, struct.error):
+            self.invalid += 1
+            return None
+        self.packets += 1
+        if command.version == 1:
+            self.legacy += 1
+            return command
+        now = time.monotonic()
+        if self.last_seq is not None:
+            # signed distance, survives the 32 bit wrap
+            delta = ((command.seq - self.last_seq + 0x80000000) & 0xffffffff) - 0x80000000
+            if delta < 0 and (delta < -RESYNC_GAP or now - self._accepted > self.resync_after):
+                # the sender restarted, take this packet as the start of a new stream
+                self.resyncs += 1
+                self._missing.clear()
+                self._offset = None
+            elif delta == 0:
+                self.duplicates += 1
+                return None
+            elif delta < 0:
+                if command.seq in self._missing:
+                    self._missing.discard(command.seq)
+                    self.lost -= 1
+                    self.reordered += 1
+                else:
+                    self.duplicates += 1
+                return None
+            else:
+                self.lost += delta - 1
+                if delta - 1 > MAX_GAP:
+                    self._missing.clear()
+                else:
+                    if len(self._missing) > MAX_GAP:
+                        self._missing.clear()
+                    self._missing.update((command.seq - i) & 0xffffffff for i in range(1, delta))
+        self.last_seq = command.seq
+        self._accepted = now
+        if received is not None:
+            offset = int(received * 1e9) - command.sent_ns
+            if self._offset is None or offset < self._offset:
+                self._offset = offset
+            self.transit.record(offset - self._offset)
+        return command
+
+    def record_actuation(self, seconds):
+        self.actuation.record(max(0, int(seconds * 1e9)))
+
+    def stats(self):
+        v2 = self.packets - self.legacy
+        expected = v2 - self.duplicates + self.lost
+        transit = self.transit.summary()
+        actuation = self.actuation.summary()
+        return {
+            'packets': self.packets,
+            'legacy': self.legacy,
+            'invalid': self.invalid,
+            'reordered': self.reordered,
+            'duplicates': self.duplicates,
+            'lost': self.lost,
+            'resyncs': self.resyncs,
+            'loss_rate': self.lost / expected if expected else 0.0,
+            'transit_p50_ms': transit['p50_us'] / 1e3,
+            'transit_p99_ms': transit['p99_us'] / 1e3,
+            'actuation_p50_ms': actuation['p50_us'] / 1e3,
+            'actuation_p99_ms': actuation['p99_us'] / 1e3,
+        }
@@ -3,13 +3,26 @@ import sys
 import io
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')  # Force UTF-8
 
+import os
+import time
 import socket
-import struct
 import signal
-from picarx import Picarx
+from picarx.broker import open_car
+from picarx.watchdog import Deadman
+from udp_drain import DatagramDrain
+from motion_protocol import MotionDecoder
 from time import sleep
 
-px = Picarx()
+# through the broker started by bot.py, else a Picarx of our own; thread_safe
+# because the deadman stops the motors from its own thread
+px = open_car(thread_safe=True)
+
+MAX_PACKET_AGE = 0.2 # seconds, older motion packets are stale joystick states and dropped
+STATS_INTERVAL = 10.0 # seconds between protocol statistics prints
+DEADMAN_LEASE = float(os.environ.get('MOTION_LEASE', 0.15)) # seconds a valid packet keeps the motors running
+drain = None
+decoder = MotionDecoder()
+deadman = Deadman(DEADMAN_LEASE, px.emergency_stop)
 
 # Last known angles
 last_dir_angle = 0.0
@@ -18,6 +31,11 @@ last_camera_pitch = None
 
 def stop_all():
     print("Stopping robot and resetting all angles to zero...")
+    deadman.disarm()
+    print(f"Deadman: {deadman.stats()}")
+    if drain is not None:
+        print(f"Packets: {drain.stats()}")
+    print(f"Protocol: {decoder.stats()}")
     px.stop()
     px.set_dir_servo_angle(0)
     px.set_cam_pan_angle(0)
@@ -32,33 +50,35 @@ signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
 def main():
-    global last_dir_angle, last_camera_yaw, last_camera_pitch
+    global last_dir_angle, last_camera_yaw, last_camera_pitch, drain
 
     UDP_PORT = 9001
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind(('', UDP_PORT))
-    sock.settimeout(1.0)
+    # empties the socket on each wakeup, only the newest command is applied
+    drain = DatagramDrain(sock, max_age=MAX_PACKET_AGE)
 
     print(f"Listening on UDP port {UDP_PORT}...")
+    next_stats = time.monotonic() + STATS_INTERVAL
 
     try:
         while True:
             try:
-                data, addr = sock.recvfrom(1024)
-                data_len = len(data)
-
-                if data_len == 8:
-                    linear, angular = struct.unpack('ff', data)
-                    camera_yaw = None
-                    camera_pitch = None
-                elif data_len == 12:
-                    linear, angular, camera_yaw = struct.unpack('fff', data)
-                    camera_pitch = None
-                elif data_len == 16:
-                    linear, angular, camera_yaw, camera_pitch = struct.unpack('ffff', data)
-                else:
-                    print(f"Unexpected packet size {data_len}, ignoring.")
-                    continue
+                if time.monotonic() >= next_stats:
+                    print(f"Protocol: {decoder.stats()}")
+                    print(f"Deadman: {deadman.stats()}")
+                    next_stats += STATS_INTERVAL
+                # every datagram goes through the decoder, v2 packets older
+                # than one already seen come back as None and are skipped
+                packet = drain.receive(timeout=1.0, accept=decoder.decode)
+                if packet is None:
+                    continue # only stale, invalid or out of order packets
+                command, addr, age = packet
+                received = time.monotonic() - age
+                linear, angular = command.linear, command.angular
+                camera_yaw, camera_pitch = command.yaw, command.pitch
+                # only valid, in order commands keep the motors running
+                deadman.refresh()
 
                 print(f"Received: linear={linear:.2f}, angular={angular:.2f}, cam_yaw={camera_yaw}, cam_pitch={camera_pitch}")
 
@@ -91,6 +111,8 @@ def main():
                         px.set_cam_tilt_angle(pitch_clamped)
                         last_camera_pitch = pitch_clamped
 
+                decoder.record_actuation(time.monotonic() - received)
+
             except socket.timeout:
                 print("Socket timeout: no data received, stopping motion only.")
                 px.stop()
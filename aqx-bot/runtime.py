@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+'''
+All aqx-bot services in one process and one asyncio event loop
+
+Replaces motion_server.py, sound.py and sensor_streamer.py (and the three
+polling threads of test.py): one interpreter, one Picarx, no socket
+timeouts. Every service is a DatagramProtocol; the loop wakes up when a
+datagram arrives or a timer is due, never to poll.
+
+- motion  UDP 9001  motion_protocol packets, newest command wins, deadman
+- sound   UDP 9100  "SAY:<text>" / "HORN", plus the obstacle horn
+- sensors UDP out   ultrasonic (and dummy UWB / IMU) to the ROS 2 PC, JSON at 10 Hz,
+                    or with --binary telemetry.py frames of 10 samples at 100 Hz
+                    (the receiver needs TelemetryDecoder for those)
+
+Bus access runs on the AsyncPicarx executor thread, speech on a thread of
+its own, so no handler blocks the loop. Each service reports its handler
+latency: for motion from the datagram to the actuators being set, for the
+sensors from the tick to the packet being sent.
+
+    sudo python3 runtime.py [--ros-ip 192.168.1.102] [--sim] [--no-sound]
+'''
+import sys
+import io
+sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')  # Force UTF-8
+
+import os
+import json
+import time
+import signal
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from picarx.aio import AsyncPicarx
+from picarx.broker import open_car
+from picarx.instrument import LatencyHistogram
+from picarx.watchdog import Deadman
+from motion_protocol import MotionDecoder
+from telemetry import TelemetryEncoder
+
+MOTION_PORT = 9001
+SOUND_PORT = 9100
+ROS2_UDP_IP = "192.168.1.102"  # Replace with your ROS 2 PC's IP address
+ROS2_UDP_PORT = 5005
+SENSOR_HZ = 100
+SENSOR_BATCH = 10 # samples per telemetry datagram
+DEADMAN_LEASE = float(os.environ.get('MOTION_LEASE', 0.15)) # seconds a valid packet keeps the motors running
+DANGER_DISTANCE = 20 # cm, horn below this
+HORN_INTERVAL = 1.0  # seconds between obstacle horns
+STATS_INTERVAL = 10.0
+
+
+class Service(asyncio.DatagramProtocol):
+    ''' a DatagramProtocol that counts its handlers and times them '''
+
+    name = 'service'
+
+    def __init__(self):
+        self.transport = None
+        self.handled = 0
+        self.errors = 0
+        self.latency = LatencyHistogram() # ns per handler
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def record(self, started):
+        ''' a handler that began at time.monotonic() started is done '''
+        self.handled += 1
+        self.latency.record(int((time.monotonic() - started) * 1e9))
+
+    def error_received(self, exc):
+        self.errors += 1
+        print(f"{self.name}: {exc}")
+
+    def stats(self):
+        latency = self.latency.summary()
+        return {
+            'handled': self.handled,
+            'errors': self.errors,
+            'p50_ms': latency['p50_us'] / 1e3,
+            'p99_ms': latency['p99_us'] / 1e3,
+            'max_ms': latency['max_us'] / 1e3,
+        }
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class MotionService(Service):
+    ''' motion commands, same mapping as motion_server.py
+
+    Datagrams that arrive while the previous command is still being
+    applied replace each other, only the newest is applied next.
+    '''
+
+    name = 'motion'
+
+    def __init__(self, car, lease=DEADMAN_LEASE):
+        super().__init__()
+        self.car = car
+        self.decoder = MotionDecoder()
+        # expiry runs on the wheel thread, straight to the bus
+        self.deadman = Deadman(lease, car.car.emergency_stop)
+        self.coalesced = 0
+        self._pending = None
+        self._task = None
+        self.last_dir_angle = 0.0
+        self.last_camera_yaw = None
+        self.last_camera_pitch = None
+
+    def datagram_received(self, data, addr):
+        received = time.monotonic()
+        command = self.decoder.decode(data, time.time())
+        if command is None:
+            return
+        self.deadman.refresh()
+        if self._pending is not None:
+            self.coalesced += 1
+        self._pending = (command, received)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._apply_pending())
+
+    async def _apply_pending(self):
+        while self._pending is not None:
+            command, received = self._pending
+            self._pending = None
+            try:
+                # one hop to the bus thread for the whole command
+                await self.car.submit(self._actuate, command)
+            except Exception as e:
+                self.errors += 1
+                print(f"{self.name}: {e}")
+                continue
+            self.record(received)
+            self.decoder.record_actuation(time.monotonic() - received)
+
+    def _actuate(self, command):
+        # on the bus thread
+        px = self.car.car
+        new_dir_angle = max(min(command.angular * 10, 35), -35)
+        if abs(new_dir_angle - self.last_dir_angle) > 0.1:
+            px.set_dir_servo_angle(new_dir_angle)
+            self.last_dir_angle = new_dir_angle
+
+        if abs(command.linear) < 0.05:
+            px.stop()
+        elif command.linear > 0:
+            px.forward(20)
+        else:
+            px.backward(20)
+
+        if command.yaw is not None:
+            yaw = max(min(command.yaw, 35), -35)
+            if self.last_camera_yaw is None or abs(yaw - self.last_camera_yaw) >= 0.1:
+                px.set_cam_pan_angle(yaw)
+                self.last_camera_yaw = yaw
+
+        if command.pitch is not None:
+            pitch = max(min(command.pitch, 35), -35)
+            if self.last_camera_pitch is None or abs(pitch - self.last_camera_pitch) >= 0.1:
+                px.set_cam_tilt_angle(pitch)
+                self.last_camera_pitch = pitch
+
+    def stats(self):
+        stats = super().stats()
+        stats['coalesced'] = self.coalesced
+        stats['protocol'] = self.decoder.stats()
+        stats['deadman'] = self.deadman.stats()
+        return stats
+
+    def close(self):
+        self.deadman.disarm()
+        super().close()
+
+
+class SoundService(Service):
+    ''' TTS and horn commands, same messages as sound.py '''
+
+    name = 'sound'
+
+    def __init__(self, horn_file='../sounds/car-double-horn.wav'):
+        super().__init__()
+        from robot_hat import Music, TTS
+        self.music = Music()
+        self.tts = TTS()
+        self.tts.lang("en-US")
+        self.horn_file = horn_file
+        self.last_horn = 0.0
+        # one speaker: sentences are said one after the other
+        self._speech = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tts')
+
+    def datagram_received(self, data, addr):
+        received = time.monotonic()
+        try:
+            msg = data.decode().strip()
+        except UnicodeDecodeError:
+            self.errors += 1
+            return
+        if msg.startswith("SAY:"):
+            self.speak(msg.split(":", 1)[1])
+        elif msg == "HORN":
+            self.horn()
+        else:
+            return
+        self.record(received)
+
+    def speak(self, text):
+        print(f'?? TTS: {text}')
+        asyncio.get_running_loop().run_in_executor(self._speech, self.tts.say, text)
+
+    def horn(self):
+        self.last_horn = time.monotonic()
+        self.music.sound_play_threading(self.horn_file)
+
+    def on_distance(self, distance):
+        ''' honk at obstacles closer than DANGER_DISTANCE, at most once per HORN_INTERVAL '''
+        if 0 < distance < DANGER_DISTANCE and time.monotonic() - self.last_horn >= HORN_INTERVAL:
+            print('?? Obstacle too close! Honking...')
+            self.horn()
+
+    def close(self):
+        super().close()
+        self._speech.shutdown(wait=False)
+
+
+class SensorService(Service):
+    ''' samples the sensors hz times a second and sends telemetry frames
+
+    param batch: samples per frame, None sends the old JSON message per sample
+    param listeners: called with each distance reading, e.g. the obstacle horn
+    '''
+
+    name = 'sensors'
+
+    def __init__(self, car, hz=SENSOR_HZ, batch=SENSOR_BATCH, listeners=()):
+        super().__init__()
+        self.car = car
+        self.hz = hz
+        self.encoder = TelemetryEncoder(batch) if batch else None
+        self.listeners = list(listeners)
+        self.overruns = 0
+        self._task = None
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        # absolute deadlines, a slow tick is counted and skipped, not queued
+        period = 1.0 / self.hz
+        deadline = time.monotonic()
+        while True:
+            started = time.monotonic()
+            try:
+                await self.publish()
+                self.record(started)
+            except Exception as e:
+                self.errors += 1
+                print(f"{self.name}: {e}")
+            deadline += period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.overruns += 1
+                deadline = time.monotonic()
+
+    async def publish(self):
+        distance = await self.car.get_distance()
+        # dummy UWB and IMU, as in sensor_streamer.py
+        uwb, gyro, accel, mag = (1.23, 4.56, 0.78), (0.0, 0.0, 0.0), (0.0, 0.0, 9.8), (0.1, 0.1, 0.1)
+        if self.encoder is not None:
+            frame = self.encoder.add(distance, uwb, gyro, accel, mag)
+            if frame is not None:
+                self.transport.sendto(frame)
+        else:
+            data = {
+                "ultrasonic_distance": distance,
+                "uwb_location": dict(zip('xyz', uwb)),
+                "imu": {"gyro": list(gyro), "accel": list(accel), "mag": list(mag)},
+            }
+            self.transport.sendto(json.dumps(data).encode('utf-8'))
+        for listener in self.listeners:
+            listener(distance)
+
+    def stats(self):
+        stats = super().stats()
+        stats['overruns'] = self.overruns
+        return stats
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        super().close()
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    if args.sim:
+        from picarx import Picarx
+        px = Picarx(backend='sim', thread_safe=True)
+    else:
+        px = open_car(thread_safe=True) # the deadman stops the motors from its own thread
+    if hasattr(px, 'start_distance_sampler'):
+        px.start_distance_sampler() # own Picarx: sensor ticks read the sampler, not a 20 ms echo
+    car = AsyncPicarx(px)
+
+    motion = MotionService(car, args.lease)
+    services = [motion]
+    listeners = []
+    sound = None
+    if not args.no_sound:
+        try:
+            sound = SoundService()
+        except ImportError as e:
+            print(f"Sound disabled: {e}")
+        else:
+            services.append(sound)
+            listeners.append(sound.on_distance)
+    if args.binary and not args.json:
+        sensors = SensorService(car, args.sensor_hz or SENSOR_HZ, args.batch, listeners)
+    else:
+        sensors = SensorService(car, min(args.sensor_hz or 10, 10), None, listeners)
+    services.append(sensors)
+
+    await loop.create_datagram_endpoint(lambda: motion, local_addr=('0.0.0.0', args.motion_port))
+    if sound is not None:
+        await loop.create_datagram_endpoint(lambda: sound, local_addr=('0.0.0.0', args.sound_port))
+    await loop.create_datagram_endpoint(lambda: sensors, remote_addr=(args.ros_ip, args.ros_port))
+    print(f"Motion on UDP {args.motion_port}, sound on UDP {args.sound_port}, "
+          f"sensors to {args.ros_ip}:{args.ros_port}")
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    def print_stats():
+        for service in services:
+            print(f"{service.name}: {service.stats()}")
+
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), STATS_INTERVAL)
+            except asyncio.TimeoutError:
+                print_stats()
+    finally:
+        print("Stopping robot and resetting all angles to zero...")
+        for service in services:
+            service.close()
+        print_stats()
+        await car.stop()
+        await car.set_dir_servo_angle(0)
+        await car.set_cam_pan_angle(0)
+        await car.set_cam_tilt_angle(0)
+        if hasattr(px, 'stop_distance_sampler'):
+            px.stop_distance_sampler()
+        await car.close(reset=False)
+        print("Exiting safely.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--ros-ip', default=ROS2_UDP_IP, help='where the sensor data goes')
+    parser.add_argument('--ros-port', type=int, default=ROS2_UDP_PORT)
+    parser.add_argument('--motion-port', type=int, default=MOTION_PORT)
+    parser.add_argument('--sound-port', type=int, default=SOUND_PORT)
+    parser.add_argument('--sensor-hz', type=float, help='default 10 for JSON, %d with --binary' % SENSOR_HZ)
+    parser.add_argument('--binary', action='store_true', help='telemetry.py frames instead of JSON')
+    parser.add_argument('--batch', type=int, default=SENSOR_BATCH, help='telemetry samples per datagram, with --binary')
+    parser.add_argument('--json', action='store_true', help='JSON sensor messages, at most 10 Hz (the default)')
+    parser.add_argument('--lease', type=float, default=DEADMAN_LEASE, help='deadman lease in seconds')
+    parser.add_argument('--no-sound', action='store_true', help='no TTS / horn service')
+    parser.add_argument('--sim', action='store_true', help='simulated backend, own Picarx')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
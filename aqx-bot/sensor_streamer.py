@@ -1,13 +1,22 @@
 import socket
 import json
-from picarx import Picarx
-import time
+from picarx.broker import open_car
+from picarx.loop import ControlLoop
+from telemetry import TelemetryEncoder
 
 UDP_IP = "192.168.1.102"  # Replace with your ROS 2 PC's IP address
 UDP_PORT = 5005
+# True sends telemetry.py frames, only once the receiver decodes them with
+# TelemetryDecoder; False sends the JSON messages it reads today
+BINARY = False
+SAMPLE_HZ = 100 if BINARY else 10
+BATCH = 10     # samples per datagram, 10 datagrams a second at 100 Hz
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-px = Picarx()
+px = open_car(fast_start=True)  # the broker (or motion_server.py) owns the reset and the servos
+if hasattr(px, 'start_distance_sampler'):
+    px.start_distance_sampler() # own Picarx: reads come from the sampler, no 20 ms echo per sample
+encoder = TelemetryEncoder(batch=BATCH)
 
 def get_dummy_uwb_location():
     # Send fixed dummy UWB data
@@ -21,8 +30,16 @@ def get_dummy_imu_data():
         "mag": [0.1, 0.1, 0.1]
     }
 
-while True:
-    distance = px.ultrasonic.read() if hasattr(px, "ultrasonic") else -1.0
+def send_telemetry():
+    uwb = get_dummy_uwb_location()
+    imu = get_dummy_imu_data()
+    frame = encoder.add(px.get_distance(), (uwb['x'], uwb['y'], uwb['z']),
+                        imu['gyro'], imu['accel'], imu['mag'])
+    if frame is not None:
+        sock.sendto(frame, (UDP_IP, UDP_PORT))
+
+def send_sensor_data():
+    distance = px.get_distance()
     uwb = get_dummy_uwb_location()
     imu_data = get_dummy_imu_data()
 
@@ -34,5 +51,8 @@ while True:
 
     message = json.dumps(data).encode('utf-8')
     sock.sendto(message, (UDP_IP, UDP_PORT))
-    time.sleep(0.1)  # Send at 10 Hz
+
+loop = ControlLoop()
+loop.add(send_telemetry if BINARY else send_sensor_data, hz=SAMPLE_HZ)  # the read time does not add to the period
+loop.run()
 
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 from time import sleep
-from picarx import Picarx
+from picarx.broker import open_car
 from robot_hat import Music, TTS
 import socket
 import threading
@@ -12,7 +12,7 @@ SafeDistance = 40   # cm
 DangerDistance = 20 # cm
 
 # Initialize
-px = Picarx()
+px = open_car(fast_start=True)  # the broker (or motion_server.py) owns the reset and the servos
 music = Music()
 tts = TTS()
 tts.lang("en-US")
@@ -66,7 +66,7 @@ threading.Thread(target=socket_listener, daemon=True).start()
 # Main loop just for horn logic
 def main():
     while True:
-        distance = round(px.ultrasonic.read(), 2)
+        distance = round(px.get_distance(), 2)
         print("?? Distance:", distance, "cm")
 
         if distance < DangerDistance:
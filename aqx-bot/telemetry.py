@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+'''
+Binary sensor telemetry
+
+Fixed layout replacement for the JSON sensor messages. A datagram is one
+frame, a frame carries one or more samples. Little endian:
+
+    frame header, 8 bytes
+        magic   2s   b'PT'
+        version u8   1
+        count   u8   samples in the frame
+        seq     u32  sequence number of the first sample, +1 per sample
+    sample, 60 bytes
+        time     f64      time.time() of the reading
+        distance f32      ultrasonic, cm
+        uwb      3 x f32  x, y, z
+        gyro     3 x f32
+        accel    3 x f32
+        mag      3 x f32
+
+A single sample frame is 68 bytes against ~165 for the JSON message, a
+frame of 10 samples 608 bytes. Only the struct and namedtuple modules are
+needed, so this file can be copied to the ROS 2 side as it is:
+
+    from telemetry import TelemetryDecoder
+    decoder = TelemetryDecoder()
+    for sample in decoder.decode(data):
+        publish(sample.time, sample.distance, sample.gyro, ...)
+    decoder.stats()     # frames, samples, lost, ...
+
+A restarted sender numbers from 0 again. The decoder starts over (resync)
+when seq jumps back by more than RESYNC_GAP samples, or when nothing was
+accepted for resync_after seconds, instead of dropping its frames as late.
+'''
+import time
+import struct
+from collections import namedtuple
+
+MAGIC = b'PT'
+VERSION = 1
+HEADER = struct.Struct('<2sBBI')
+SAMPLE = struct.Struct('<d13f')
+MAX_BATCH = 255
+RESYNC_GAP = 1024 # samples; a jump back by more than this is a restarted sender
+
+TelemetrySample = namedtuple('TelemetrySample', 'time distance uwb gyro accel mag seq')
+TelemetrySample.__new__.__defaults__ = (None,) # seq, set by the decoder
+
+
+def encode(samples, seq=0):
+    ''' a frame of TelemetrySample-like tuples, seq numbers the first one '''
+    if not 0 < len(samples) <= MAX_BATCH:
+        raise ValueError("a frame holds 1 to %d samples" % MAX_BATCH)
+    frame = bytearray(HEADER.size + SAMPLE.size * len(samples))
+    HEADER.pack_into(frame, 0, MAGIC, VERSION, len(samples), seq & 0xffffffff)
+    offset = HEADER.size
+    for t, distance, uwb, gyro, accel, mag, *_ in samples:
+        SAMPLE.pack_into(frame, offset, t, distance, *uwb, *gyro, *accel, *mag)
+        offset += SAMPLE.size
+    return bytes(frame)
+
+
+def decode(data):
+    ''' (seq of the first sample, [TelemetrySample]), ValueError if data is no frame '''
+    if len(data) < HEADER.size:
+        raise ValueError("frame too short")
+    magic, version, count, seq = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a telemetry frame")
+    if version != VERSION:
+        raise ValueError("unsupported telemetry version %d" % version)
+    if len(data) != HEADER.size + count * SAMPLE.size:
+        raise ValueError("frame of %d samples has %d bytes" % (count, len(data)))
+    samples = []
+    for i, values in enumerate(SAMPLE.iter_unpack(memoryview(data)[HEADER.size:])):
+        samples.append(TelemetrySample(values[0], values[1], values[2:5], values[5:8],
+                                       values[8:11], values[11:14], (seq + i) & 0xffffffff))
+    return seq, samples
+
+
+def to_dict(sample):
+    ''' the JSON message sensor_streamer.py used to send, plus time and seq '''
+    x, y, z = sample.uwb
+    return {
+        "ultrasonic_distance": sample.distance,
+        "uwb_location": {'x': x, 'y': y, 'z': z},
+        "imu": {
+            "gyro": list(sample.gyro),
+            "accel": list(sample.accel),
+            "mag": list(sample.mag),
+        },
+        "timestamp": sample.time,
+        "seq": sample.seq,
+    }
+
+
+class TelemetryEncoder(object):
+    ''' numbers samples and packs them into frames of batch samples
+
+    param batch: samples per frame, 1 sends every sample on its own
+    '''
+
+    def __init__(self, batch=1):
+        if not 0 < batch <= MAX_BATCH:
+            raise ValueError("batch must be 1 to %d" % MAX_BATCH)
+        self.batch = batch
+        self.seq = 0
+        self._samples = []
+
+    def add(self, distance, uwb, gyro, accel, mag, t=None):
+        ''' queue a sample, returns a frame when batch samples are queued, else None '''
+        self._samples.append((time.time() if t is None else t, distance, uwb, gyro, accel, mag))
+        if len(self._samples) >= self.batch:
+            return self.flush()
+        return None
+
+    def flush(self):
+        ''' frame of the queued samples, None if there are none '''
+        if not self._samples:
+            return None
+        frame = encode(self._samples, self.seq)
+        self.seq = (self.seq + len(self._samples)) & 0xffffffff
+        self._samples = []
+        return frame
+
+
+class TelemetryDecoder(object):
+    ''' decodes frames in arrival order and counts lost and late samples
+
+    param resync_after: seconds without an accepted frame after which any
+                        seq starts a new stream
+    '''
+
+    def __init__(self, resync_after=1.0):
+        self.resync_after = resync_after
+        self.next_seq = None
+        self._accepted = 0.0 # time.monotonic() of the last accepted frame
+        self.frames = 0
+        self.samples = 0
+        self.invalid = 0
+        self.lost = 0    # samples never seen
+        self.late = 0    # frames older than one already seen, dropped
+        self.resyncs = 0 # sender restarts
+
+    def decode(self, data):
+        ''' the new samples of a frame, [] for invalid or late frames '''
+        try:
+            seq, samples = decode(data)
+        except (ValueError, struct.error):
+            self.invalid += 1
+            return []
+        now = time.monotonic()
+        if self.next_seq is not None:
+            # signed distance, survives the 32 bit wrap
+            delta = ((seq - self.next_seq + 0x80000000) & 0xffffffff) - 0x80000000
+            if delta < 0 and (delta < -RESYNC_GAP or now - self._accepted > self.resync_after):
+                self.resyncs += 1
+            elif delta < 0:
+                self.late += 1
+                return []
+            else:
+                self.lost += delta
+        self._accepted = now
+        self.next_seq = (seq + len(samples)) & 0xffffffff
+        self.frames += 1
+        self.samples += len(samples)
+        return samples
+
+    def stats(self):
+        expected = self.samples + self.lost
+        return {
+            'frames': self.frames,
+            'samples': self.samples,
+            'invalid': self.invalid,
+            'late': self.late,
+            'lost': self.lost,
+            'resyncs': self.resyncs,
+            'loss_rate': self.lost / expected if expected else 0.0,
+        }
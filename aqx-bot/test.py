@@ -9,6 +9,7 @@ import threading
 from time import sleep, time
 from picarx import Picarx
 from robot_hat import Music, TTS
+from telemetry import TelemetryEncoder
 
 # Force UTF-8
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
@@ -20,9 +21,10 @@ ROS2_UDP_IP = "192.168.1.102"  # Replace with your ROS 2 PC's IP
 ROS2_UDP_PORT = 5005
 CONTROL_PORT = 9001
 SOUND_PORT = 9100
+BINARY = False  # True sends telemetry.py frames like sensor_streamer.py, False the old JSON messages
 
 # Initialize modules
-px = Picarx()
+px = Picarx(thread_safe=True) # shared by the sensor, sound and control threads
 music = Music()
 tts = TTS()
 tts.lang("en-US")
@@ -87,14 +89,18 @@ def sound_listener():
 # Sensor Data Streaming
 def sensor_stream():
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    encoder = TelemetryEncoder() # binary frames, see telemetry.py; no IMU / UWB here
     while not stop_flag.is_set():
         try:
             dist = px.ultrasonic.read() if hasattr(px, "ultrasonic") else -1.0
-            data = {
-                "ultrasonic_distance": dist,
-                "timestamp": time.time()
-            }
-            msg = json.dumps(data).encode('utf-8')
+            if BINARY:
+                msg = encoder.add(dist, (0, 0, 0), (0, 0, 0), (0, 0, 0), (0, 0, 0))
+            else:
+                data = {
+                    "ultrasonic_distance": dist,
+                    "timestamp": time()
+                }
+                msg = json.dumps(data).encode('utf-8')
             sock.sendto(msg, (ROS2_UDP_IP, ROS2_UDP_PORT))
             sleep(0.1)
         except Exception as e:
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+'''
+Latest-wins UDP receive
+
+Joystick style commands are states, not events: only the newest one
+matters. DatagramDrain waits for the socket to become readable, then
+empties it without blocking and hands back only the newest datagram.
+Datagrams that waited in the socket buffer longer than max_age are
+discarded.
+
+The age comes from the kernel receive timestamp (SO_TIMESTAMPNS), so it
+includes the time the datagram sat in the buffer while we were busy. Where
+the kernel does not provide it, the age is measured from the drain and
+only coalescing applies.
+
+    drain = DatagramDrain(sock, max_age=0.2)
+    while True:
+        try:
+            packet = drain.receive(timeout=1.0)
+        except socket.timeout:
+            ...                     # nothing at all for a second
+        if packet is None:
+            continue                # everything was stale
+        data, addr, age = packet
+'''
+import time
+import select
+import socket
+import struct
+
+# linux value, older pythons do not export the constant
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+TIMESPEC = struct.Struct('@qq')
+
+
+class DatagramDrain(object):
+    ''' newest-datagram reader for a bound UDP socket
+
+    param sock: bound datagram socket, it is switched to non-blocking
+    param max_age: seconds, older datagrams are dropped, None keeps all
+    param bufsize: largest datagram
+    '''
+
+    def __init__(self, sock, max_age=0.2, bufsize=1024):
+        self.sock = sock
+        self.max_age = max_age
+        self.bufsize = bufsize
+        sock.setblocking(False)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            self.kernel_timestamps = True
+        except (OSError, AttributeError):
+            self.kernel_timestamps = False
+        self._ancbufsize = socket.CMSG_SPACE(TIMESPEC.size) if self.kernel_timestamps else 0
+        self.received = 0  # datagrams read
+        self.coalesced = 0 # dropped because a newer one was in the same drain
+        self.stale = 0     # dropped for being older than max_age
+        self.delivered = 0
+
+    def _read(self):
+        ''' one datagram as (data, addr, receive time), None when the socket is empty '''
+        try:
+            if self._ancbufsize:
+                data, ancdata, _, addr = self.sock.recvmsg(self.bufsize, self._ancbufsize)
+                for level, kind, payload in ancdata:
+                    if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                        sec, nsec = TIMESPEC.unpack(payload[:TIMESPEC.size])
+                        return data, addr, sec + nsec * 1e-9
+                return data, addr, time.time()
+            data, addr = self.sock.recvfrom(self.bufsize)
+            return data, addr, time.time()
+        except (BlockingIOError, InterruptedError):
+            return None
+
+    def drain(self):
+        ''' read everything queued, return the datagrams oldest first '''
+        packets = []
+        while True:
+            packet = self._read()
+            if packet is None:
+                return packets
+            packets.append(packet)
+
+    def receive(self, timeout=None, accept=None):
+        ''' wait up to timeout seconds for datagrams and return the newest
+
+        param accept: accept(data, receive time) called for every datagram
+                      oldest first, returns what to deliver or None to drop it
+        return: (data or accepted value, addr, age in seconds), None if all
+                were stale or dropped
+        raise: socket.timeout when nothing arrived
+        '''
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            raise socket.timeout("no datagram in %s s" % timeout)
+        packets = self.drain()
+        if not packets:
+            return None
+        self.received += len(packets)
+        if accept is not None:
+            packets = [(accept(data, received), addr, received) for data, addr, received in packets]
+            packets = [packet for packet in packets if packet[0] is not None]
+            if not packets:
+                return None
+        self.coalesced += len(packets) - 1
+        data, addr, received = packets[-1]
+        age = max(0.0, time.time() - received)
+        if self.max_age is not None and age > self.max_age:
+            self.stale += 1
+            return None
+        self.delivered += 1
+        return data, addr, age
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'delivered': self.delivered,
+            'coalesced': self.coalesced,
+            'stale': self.stale,
+            'kernel_timestamps': self.kernel_timestamps,
+        }
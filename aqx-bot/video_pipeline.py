@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+'''
+Staged capture / convert / encode pipeline
+
+Capture, colour conversion and JPEG encoding each get their own thread(s),
+so the frame rate is set by the slowest stage instead of the sum of all
+three, and encoding, the slowest, runs on several workers at once. cv2 and
+simplejpeg release the GIL while they work, so threads use all cores
+without copying 900 kB frames between processes.
+
+    capture -> [queue] -> convert -> [queue] -> encode x workers -> reorder -> get()
+
+The queues are short and drop the oldest frame when full: a stage that
+falls behind works on recent frames instead of building up latency.
+Encoders finish out of order; the reorder step hands frames out in
+capture order and skips the sequence numbers that were dropped on the way.
+
+    pipeline = FramePipeline(picam2.capture_array, encode_jpeg,
+                             convert=rgb_to_bgr, workers=3)
+    broadcaster = Broadcaster(pipeline.get)      # see frame_broadcast.py
+    pipeline.stats()     # per stage time, drops, end to end latency
+
+The pipeline only captures while someone calls get(), it pauses a second
+after the last call.
+'''
+import time
+import threading
+from collections import deque
+from picarx.instrument import LatencyHistogram
+
+IDLE_AFTER = 1.0 # seconds without get() before capture pauses
+
+
+class DropQueue(object):
+    ''' bounded queue, put() on a full queue drops the oldest item
+
+    param on_drop: called with every dropped item
+    '''
+
+    def __init__(self, maxsize, on_drop=None):
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        self._items = deque()
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                dropped = self._items.popleft()
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(dropped)
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        ''' the oldest item, None on timeout or once closed '''
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self.closed, timeout):
+                return None
+            if self.closed:
+                return None
+            return self._items.popleft()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class Stage(object):
+    ''' timing of one pipeline stage '''
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.errors = 0
+        self.time = LatencyHistogram() # ns per frame
+
+    def record(self, started):
+        self.frames += 1
+        self.time.record(int((time.perf_counter() - started) * 1e9))
+
+    def stats(self):
+        t = self.time.summary()
+        return {
+            'frames': self.frames,
+            'errors': self.errors,
+            'p50_ms': t['p50_us'] / 1e3,
+            'p99_ms': t['p99_us'] / 1e3,
+        }
+
+
+class Reorder(object):
+    ''' releases encoded frames in sequence order
+
+    A frame waits for the ones before it until they arrive or are skipped.
+    Holding more than limit frames gives up on the missing ones.
+    '''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.expected = 1
+        self._pending = {}  # seq: (data, capture time)
+        self._skipped = set()
+        self._out = deque()
+        self._cond = threading.Condition()
+        self.reordered = 0  # frames that finished before an earlier one
+        self.given_up = 0
+
+    def push(self, seq, data, t):
+        with self._cond:
+            if seq < self.expected:
+                return
+            if seq > self.expected:
+                self.reordered += 1
+            self._pending[seq] = (data, t)
+            self._release()
+
+    def skip(self, seq):
+        ''' seq will never arrive (dropped or failed) '''
+        with self._cond:
+            if seq >= self.expected:
+                self._skipped.add(seq)
+                self._release()
+
+    def _release(self):
+        while True:
+            if self.expected in self._pending:
+                self._out.append((self.expected,) + self._pending.pop(self.expected))
+            elif self.expected in self._skipped:
+                self._skipped.discard(self.expected)
+            elif len(self._pending) > self.limit:
+                self.given_up += 1
+            else:
+                break
+            self.expected += 1
+        # only the newest released frame matters to get()
+        while len(self._out) > 1:
+            self._out.popleft()
+        if self._out:
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._out, timeout):
+                return None
+            return self._out.popleft()
+
+
+class FramePipeline(object):
+    ''' capture, optional convert and encode stages on their own threads
+
+    param capture: capture() returns a frame, blocking until one is ready
+    param encode: encode(frame) returns bytes, None to drop the frame
+    param convert: convert(frame) returns the frame the encoder wants, None skips the stage
+    param workers: encode threads
+    param depth: queue length in front of each stage
+    '''
+
+    def __init__(self, capture, encode, convert=None, workers=3, depth=2):
+        self.capture = capture
+        self.encode = encode
+        self.convert = convert
+        self.workers = workers
+        self.reorder = Reorder(limit=workers * 2)
+        skip = lambda item: self.reorder.skip(item[0])
+        self.encode_queue = DropQueue(max(depth, workers), on_drop=skip)
+        self.convert_queue = DropQueue(depth, on_drop=skip) if convert is not None else None
+        self.stages = [Stage('capture')] + ([Stage('convert')] if convert is not None else []) + [Stage('encode')]
+        self.latency = LatencyHistogram() # ns from capture to get()
+        self._seq = 0
+        self._last_get = 0.0
+        self._demand = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+
+    def _capture_loop(self):
+        stage = self._stage('capture')
+        queue = self.convert_queue or self.encode_queue
+        while not self._stop.is_set():
+            if time.monotonic() - self._last_get > IDLE_AFTER:
+                self._demand.clear()
+                self._demand.wait(0.5)
+                continue
+            st = time.perf_counter()
+            try:
+                frame = self.capture()
+            except Exception as e:
+                stage.errors += 1
+                print("pipeline capture: %s" % e)
+                time.sleep(0.1)
+                continue
+            stage.record(st)
+            self._seq += 1
+            queue.put((self._seq, frame, time.monotonic()))
+
+    def _convert_loop(self):
+        stage = self._stage('convert')
+        while not self._stop.is_set():
+            item = self.convert_queue.get(0.5)
+            if item is None:
+                continue
+            seq, frame, t = item
+            st = time.perf_counter()
+            try:
+                frame = self.convert(frame)
+            except Exception as e:
+                stage.errors += 1
+                print("pipeline convert: %s" % e)
+                self.reorder.skip(seq)
+                continue
+            stage.record(st)
+            self.encode_queue.put((seq, frame, t))
+
+    def _encode_loop(self):
+        stage = self._stage('encode')
+        while not self._stop.is_set():
+            item = self.encode_queue.get(0.5)
+            if item is None:
+                continue
+            seq, frame, t = item
+            st = time.perf_counter()
+            try:
+                data = self.encode(frame)
+            except Exception as e:
+                stage.errors += 1
+                print("pipeline encode: %s" % e)
+                data = None
+            if data is None:
+                self.reorder.skip(seq)
+                continue
+            stage.record(st)
+            self.reorder.push(seq, data, t)
+
+    def start(self):
+        targets = [self._capture_loop] + ([self._convert_loop] if self.convert is not None else [])
+        targets += [self._encode_loop] * self.workers
+        for i, target in enumerate(targets):
+            thread = threading.Thread(target=target, name='pipeline-%d' % i, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def get(self, timeout=5.0):
+        ''' the newest encoded frame in capture order, blocks until there is one
+
+        raise: TimeoutError when no frame came within timeout
+        '''
+        return self.get_timed(timeout)[0]
+
+    def get_timed(self, timeout=5.0):
+        ''' like get(), returns (frame, time.monotonic() of its capture) '''
+        self._last_get = time.monotonic()
+        self._demand.set()
+        out = self.reorder.get(timeout)
+        if out is None:
+            raise TimeoutError("no frame from the pipeline in %s s" % timeout)
+        _, data, t = out
+        self.latency.record(int((time.monotonic() - t) * 1e9))
+        return data, t
+
+    def stop(self):
+        self._stop.set()
+        self._demand.set()
+        for queue in (self.convert_queue, self.encode_queue):
+            if queue is not None:
+                queue.close()
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self):
+        latency = self.latency.summary()
+        stats = {stage.name: stage.stats() for stage in self.stages}
+        if self.convert_queue is not None:
+            stats['convert']['dropped'] = self.convert_queue.dropped
+        stats['encode']['dropped'] = self.encode_queue.dropped
+        stats['encode']['workers'] = self.workers
+        stats['reordered'] = self.reorder.reordered
+        stats['latency_p50_ms'] = latency['p50_us'] / 1e3
+        stats['latency_p99_ms'] = latency['p99_us'] / 1e3
+        return stats
@@ -1,34 +1,66 @@
 from picamera2 import Picamera2
-import cv2
-from flask import Flask, Response
+from frame_broadcast import Broadcaster
+from video_pipeline import FramePipeline
+from capture_formats import video_configuration, ladder_encoder
+from adaptive_stream import LadderEncoder, AdaptiveViewer, LADDER
+from mjpeg_server import MJPEGServer
 
-app = Flask(__name__)
+# 'asyncio': mjpeg_server.py, every client on one event loop; 'flask': the
+# development server, a thread and a generator per client
+SERVER = 'asyncio'
+
+# 'yuv420': planes straight into the JPEG encoder, 'bgr': cv2 byte order,
+# 'xbgr': the old default, converted with cv2.cvtColor (see capture_formats.py)
+CAPTURE_PATH = 'yuv420'
 
 picam2 = Picamera2()
-picam2.configure(picam2.create_video_configuration(main={"size": (640, 480)}))
+picam2.configure(video_configuration(picam2, CAPTURE_PATH, (640, 480)))
 
 # Set auto white balance to a warmer mode (like 'sunlight')
 picam2.set_controls({"AwbMode": 2})  # 0=off, 1=auto, 2=sunlight, 3=cloudy, 4=shade, 5=tungsten, 6=fluorescent
 
 picam2.start()
 
-def generate_frames():
-    while True:
-        frame = picam2.capture_array()
-        # Convert RGB (picamera2) to BGR (OpenCV) for correct colors
-        frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        ret, jpeg = cv2.imencode('.jpg', frame_bgr)
-        if not ret:
-            continue
-        frame_bytes = jpeg.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-
-@app.route('/video_feed')
-def video_feed():
-    return Response(generate_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+ENCODE_WORKERS = 3 # one core stays free for capture and the server
+TARGET_LATENCY = 0.25 # seconds from capture to the frame leaving the socket, per viewer
+QUALITY_LADDER = LADDER # (quality, scale step, fps) rungs the viewers move between, best first
+
+# convert is None unless CAPTURE_PATH is 'xbgr'
+convert_frame, encode_jpeg = ladder_encoder(CAPTURE_PATH)
+# each frame is encoded once for every rung some viewer is on
+ladder = LadderEncoder(encode_jpeg, QUALITY_LADDER)
+
+# capture, convert and encode on their own threads, encoding on several
+pipeline = FramePipeline(picam2.capture_array, ladder, convert=convert_frame,
+                         workers=ENCODE_WORKERS).start()
+# one pipeline for all viewers, it idles while nobody watches
+broadcaster = Broadcaster(pipeline.get_timed, timed=True).start()
+
+def generate_frames(client_socket):
+    # newest frame each time this viewer is ready, at the quality its link keeps up with
+    with AdaptiveViewer(broadcaster, ladder, socket=client_socket, target=TARGET_LATENCY) as viewer:
+        for frame_bytes in viewer.frames():
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+
+def run_flask():
+    from flask import Flask, Response, request
+    app = Flask(__name__)
+
+    @app.route('/video_feed')
+    def video_feed():
+        # the werkzeug server exposes the connection, its send queue tells the controller about backlog
+        return Response(generate_frames(request.environ.get('werkzeug.socket')),
+                        mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    app.run(host='0.0.0.0', port=5000)
 
 if __name__ == '__main__':
     print("Open http://<your_pi_ip>:5000/video_feed")
-    app.run(host='0.0.0.0', port=5000)
+    if SERVER == 'flask':
+        run_flask()
+    else:
+        print("Also /snapshot and /stats")
+        server = MJPEGServer(broadcaster, ladder, target=TARGET_LATENCY,
+                             stats={'pipeline': pipeline.stats})
+        server.run('0.0.0.0', 5000)
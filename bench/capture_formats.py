@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+'''
+Capture paths of the video streamer: bytes allocated and ms per frame
+
+For each format of aqx-bot/capture_formats.py a synthetic camera hands out
+640x480 frames the way Picamera2.capture_array() does (a copy of the
+camera buffer), then the path's convert and encode run on it. Allocation
+is the tracemalloc peak while one frame goes through, numpy arrays
+included. Uses cv2 / simplejpeg when installed; otherwise numpy stands in
+for cvtColor (same allocation) and zlib for the JPEG encoder.
+
+    python3 bench/capture_formats.py [-n FRAMES] [--size 640x480]
+'''
+import os
+import sys
+import time
+import zlib
+import argparse
+import tracemalloc
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'aqx-bot')]
+from capture_formats import FORMATS, encoder, yuv420_planes
+
+
+class SyntheticSource(object):
+    ''' capture() copies a fixed buffer laid out like Picamera2's format '''
+
+    def __init__(self, path, width, height):
+        rng = np.random.default_rng(1)
+        if path == 'yuv420':
+            shape = (height * 3 // 2, width)
+        else:
+            shape = (height, width, 4 if path == 'xbgr' else 3)
+        # smooth content, so compressed sizes look like a camera's
+        ramp = np.add.outer(np.arange(shape[0]), np.arange(shape[1])).astype(np.uint8)
+        self.buffer = np.empty(shape, dtype=np.uint8)
+        if len(shape) == 3:
+            self.buffer[:] = ramp[:, :, None]
+        else:
+            self.buffer[:] = ramp
+        self.buffer ^= rng.integers(0, 8, size=shape, dtype=np.uint8)
+
+    def capture(self):
+        return self.buffer.copy()
+
+
+def stand_in(path):
+    ''' (convert, encode) with the allocation pattern of the real path '''
+    if path == 'yuv420':
+        return None, lambda frame: b''.join(zlib.compress(p, 1) for p in yuv420_planes(frame))
+    convert = None
+    if path == 'xbgr':
+        # like cvtColor(RGB2BGR) on 4 channels: a new 3 channel frame
+        convert = lambda frame: np.ascontiguousarray(frame[:, :, 2::-1])
+    return convert, lambda frame: zlib.compress(frame, 1)
+
+
+def run(path, frames, width, height):
+    try:
+        convert, encode = encoder(path)
+        codec = 'simplejpeg' if path == 'yuv420' else 'cv2'
+    except ImportError:
+        convert, encode = stand_in(path)
+        codec = 'stand-in'
+    source = SyntheticSource(path, width, height)
+    # allocation of one frame going through
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    frame = source.capture()
+    captured = tracemalloc.get_traced_memory()[0] - base
+    converted = convert(frame) if convert is not None else frame
+    conversion = tracemalloc.get_traced_memory()[0] - base - captured
+    encoded = encode(converted)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    del frame, converted, encoded
+    tracemalloc.stop()
+
+    times = {'capture': 0.0, 'convert': 0.0, 'encode': 0.0}
+    for _ in range(frames):
+        t0 = time.perf_counter()
+        frame = source.capture()
+        t1 = time.perf_counter()
+        if convert is not None:
+            frame = convert(frame)
+        t2 = time.perf_counter()
+        encode(frame)
+        t3 = time.perf_counter()
+        times['capture'] += t1 - t0
+        times['convert'] += t2 - t1
+        times['encode'] += t3 - t2
+    result = {name: total / frames * 1e3 for name, total in times.items()}
+    result.update(path=path, format=FORMATS[path], codec=codec, captured=captured, conversion=conversion, peak=peak)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-n', '--frames', type=int, default=200)
+    parser.add_argument('--size', default='640x480', help='WIDTHxHEIGHT')
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.split('x'))
+    print('%-7s %-9s %-9s %11s %11s %9s %11s %11s %10s %9s' % (
+        'path', 'format', 'codec', 'capture kB', 'convert kB', 'peak kB', 'capture ms',
+        'convert ms', 'encode ms', 'total ms'))
+    for path in FORMATS:
+        r = run(path, args.frames, width, height)
+        print('%-7s %-9s %-9s %11.0f %11.0f %9.0f %11.3f %11.3f %10.3f %9.3f' % (
+            r['path'], r['format'], r['codec'], r['captured'] / 1e3, r['conversion'] / 1e3, r['peak'] / 1e3,
+            r['capture'], r['convert'], r['encode'], r['capture'] + r['convert'] + r['encode']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+'''
+Picarx shared by several threads, on the simulated backend
+
+Three threads like aqx-bot/test.py: a control thread steering and driving
+at 50 Hz, a sensor thread reading the ultrasonic back to back and a
+gesture thread moving the camera servos. Compares
+
+- global lock: every call wrapped in one lock, the usual quick fix
+- thread_safe: Picarx(thread_safe=True), I2C through the bus arbiter
+
+and reports the latency of the control calls.
+
+    python3 bench/concurrency.py [-s SECONDS]
+'''
+import os
+import sys
+import time
+import threading
+import argparse
+from contextlib import nullcontext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from picarx import Picarx
+
+
+def run(mode, seconds):
+    px = Picarx(backend='sim', thread_safe=(mode == 'thread_safe'))
+    px.backend.distance = 50.0
+    lock = threading.Lock() if mode == 'global lock' else nullcontext()
+    stop = threading.Event()
+    latencies = []
+    reads = [0]
+    gestures = [0]
+
+    def control():
+        i = 0
+        deadline = time.monotonic()
+        while not stop.is_set():
+            st = time.perf_counter()
+            with lock:
+                px.set_dir_servo_angle(i % 20 - 10)
+                px.forward(30 + i % 2 * 10)
+            latencies.append(time.perf_counter() - st)
+            i += 1
+            deadline += 0.02
+            time.sleep(max(0, deadline - time.monotonic()))
+
+    def sensor():
+        while not stop.is_set():
+            with lock:
+                px.get_distance()
+            reads[0] += 1
+
+    def gesture():
+        i = 0
+        while not stop.is_set():
+            with lock:
+                px.set_cam_pan_angle(i % 40 - 20)
+                px.set_cam_tilt_angle(i % 20 - 10)
+            gestures[0] += 1
+            i += 1
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=f) for f in (control, sensor, gesture)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    n = len(latencies)
+    result = {
+        'mode': mode,
+        'control_p50_ms': latencies[n // 2] * 1e3,
+        'control_p99_ms': latencies[int(n * 0.99)] * 1e3,
+        'distance_reads_per_s': reads[0] / seconds,
+        'gestures_per_s': gestures[0] / seconds,
+        'merged': px.arbiter.merged if px.arbiter else 0,
+    }
+    px.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-s', '--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+    print('%-12s %14s %14s %14s %12s %8s' % ('mode', 'control p50', 'control p99',
+                                             'distance/s', 'gestures/s', 'merged'))
+    for mode in ('global lock', 'thread_safe'):
+        r = run(mode, args.seconds)
+        print('%-12s %11.2f ms %11.2f ms %14.1f %12.1f %8d' % (
+            r['mode'], r['control_p50_ms'], r['control_p99_ms'],
+            r['distance_reads_per_s'], r['gestures_per_s'], r['merged']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+'''
+Control-loop cost of Picarx on the simulated backend
+
+    python3 bench/control_loop.py
+    python3 bench/control_loop.py --json > baseline.json
+    python3 bench/control_loop.py --check baseline.json
+
+--check fails when a call issues more bus writes than the baseline, or gets
+slower than the baseline by more than --tolerance.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from picarx import Picarx
+
+
+def measure(px, name, func, count):
+    bus = px.backend.bus
+    times = []
+    bus.clear()
+    for i in range(count):
+        st = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - st)
+    times.sort()
+    return {
+        'call': name,
+        'count': count,
+        'mean_us': sum(times) / count * 1e6,
+        'p50_us': times[count // 2] * 1e6,
+        'p99_us': times[int(count * 0.99)] * 1e6,
+        'writes_per_call': len(bus.writes) / count,
+        'i2c_writes_per_call': len(bus.i2c_writes()) / count,
+        'i2c_transactions_per_call': bus.transaction_count / count,
+        'reads_per_call': bus.read_count / count,
+    }
+
+def joystick(px, i):
+    ''' one joystick update the way motion_server.py applies it '''
+    px.set_dir_servo_angle(i % 2 * 20 - 10)
+    px.forward(30 if i % 2 else 60)
+
+def run(count):
+    px = Picarx(backend='sim')
+    px.backend.adc_values = [1200, 300, 1200]
+    cases = [
+        ('forward', lambda i: px.forward(30 if i % 2 else 60)),
+        ('forward (same value)', lambda i: px.forward(30)),
+        ('set_dir_servo_angle', lambda i: px.set_dir_servo_angle(i % 30 - 15)),
+        ('get_grayscale_data', lambda i: px.get_grayscale_data()),
+        ('set_dir_servo_angle+forward', lambda i: joystick(px, i)),
+        ('drive', lambda i: px.drive(30 if i % 2 else 60, i % 2 * 20 - 10)),
+    ]
+    return [measure(px, name, func, count) for name, func in cases]
+
+def show(results):
+    print('%-28s %10s %10s %10s %8s %8s %8s %8s' % ('call', 'mean(us)', 'p50(us)', 'p99(us)', 'writes', 'i2c', 'i2c txn', 'reads'))
+    for r in results:
+        print('%-28s %10.1f %10.1f %10.1f %8.2f %8.2f %8.2f %8.2f' % (
+            r['call'], r['mean_us'], r['p50_us'], r['p99_us'], r['writes_per_call'],
+            r['i2c_writes_per_call'], r['i2c_transactions_per_call'], r['reads_per_call']))
+
+def check(results, baseline, tolerance):
+    failed = False
+    base = {r['call']: r for r in baseline}
+    for r in results:
+        b = base.get(r['call'])
+        if b is None:
+            continue
+        if r['writes_per_call'] > b['writes_per_call']:
+            print('FAIL %s: %.2f writes per call, baseline %.2f' % (r['call'], r['writes_per_call'], b['writes_per_call']))
+            failed = True
+        if r['p50_us'] > b['p50_us'] * (1 + tolerance):
+            print('FAIL %s: p50 %.1f us, baseline %.1f us' % (r['call'], r['p50_us'], b['p50_us']))
+            failed = True
+    return not failed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, default=500)
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    parser.add_argument('--check', metavar='BASELINE', help='compare with a --json baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = run(args.count)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        show(results)
+    if args.check:
+        with open(args.check) as f:
+            baseline = json.load(f)
+        if not check(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+'''
+MJPEG serving: connected clients vs server CPU, threads and frame rate
+
+Starts the server in a subprocess, fed by a Broadcaster publishing 30 kB
+frames at 30 fps (no camera, no encoding, only the serving is measured),
+connects N streaming clients and reads for a few seconds.
+
+- asyncio: aqx-bot/mjpeg_server.py, one event loop
+- flask:   video_streamer.py's Flask path, a thread and a generator per
+           client (skipped when Flask is not installed)
+
+    python3 bench/mjpeg_server.py [-s SECONDS] [-c 1 10 50 100]
+'''
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'aqx-bot')]
+
+FRAME_SIZE = 30000
+FPS = 30
+MARKER = b'--frame\r\n'
+
+
+def broadcaster():
+    from frame_broadcast import Broadcaster
+    frame = bytes(FRAME_SIZE)
+    state = {'next': time.monotonic()}
+
+    def capture():
+        state['next'] = max(state['next'] + 1.0 / FPS, time.monotonic())
+        time.sleep(max(0, state['next'] - time.monotonic()))
+        return frame
+    return Broadcaster(capture).start()
+
+
+def serve(kind, port):
+    b = broadcaster()
+    if kind == 'asyncio':
+        from mjpeg_server import MJPEGServer
+        MJPEGServer(b).run('127.0.0.1', port)
+        return
+    import logging
+    from flask import Flask, Response
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = Flask(__name__)
+
+    def generate_frames():
+        with b.subscribe() as subscriber:
+            for frame_bytes in subscriber.frames():
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+
+    @app.route('/video_feed')
+    def video_feed():
+        return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    app.run(host='127.0.0.1', port=port, threaded=True)
+
+
+def proc_stats(pid):
+    ''' (cpu seconds, threads, rss kB) of a process from /proc '''
+    with open('/proc/%d/stat' % pid) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    threads = rss = 0
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('Threads:'):
+                threads = int(line.split()[1])
+            elif line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+    return cpu, threads, rss
+
+
+async def client(port, counts, i, stop):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'GET /video_feed HTTP/1.1\r\nHost: bench\r\n\r\n')
+    await writer.drain()
+    tail = b''
+    try:
+        while not stop.is_set():
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            data = tail + chunk
+            counts[i] += data.count(MARKER)
+            tail = data[-(len(MARKER) - 1):]
+    finally:
+        writer.close()
+
+
+async def measure(port, pid, clients, seconds):
+    counts = [0] * clients
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(client(port, counts, i, stop)) for i in range(clients)]
+    await asyncio.sleep(1.0) # connect and warm up
+    frames, (cpu, _, _) = sum(counts), proc_stats(pid)
+    st = time.monotonic()
+    await asyncio.sleep(seconds)
+    wall = time.monotonic() - st
+    frames = sum(counts) - frames
+    cpu_end, threads, rss = proc_stats(pid)
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        'fps_per_client': frames / wall / clients,
+        'cpu_percent': (cpu_end - cpu) / wall * 100,
+        'threads': threads,
+        'rss_mb': rss / 1e3,
+    }
+
+
+def wait_listening(port, timeout=10.0):
+    import socket
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-s', '--seconds', type=float, default=3.0)
+    parser.add_argument('-c', '--clients', type=int, nargs='+', default=[1, 10, 50, 100])
+    parser.add_argument('--serve', choices=('asyncio', 'flask'), help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=5077)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    kinds = ['asyncio']
+    try:
+        import flask # noqa: F401
+        kinds.append('flask')
+    except ImportError:
+        print('flask is not installed, only the asyncio server is measured')
+    print('%-8s %8s %15s %8s %8s %8s' % ('server', 'clients', 'fps per client', 'cpu %', 'threads', 'rss MB'))
+    for kind in kinds:
+        for clients in args.clients:
+            proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', kind,
+                                     '--port', str(args.port)])
+            try:
+                if not wait_listening(args.port):
+                    raise RuntimeError('%s server did not start' % kind)
+                r = asyncio.run(measure(args.port, proc.pid, clients, args.seconds))
+                print('%-8s %8d %15.1f %8.1f %8d %8.1f' % (kind, clients, r['fps_per_client'],
+                                                          r['cpu_percent'], r['threads'], r['rss_mb']))
+            finally:
+                proc.terminate()
+                proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+'''
+Picarx construction time on the simulated backend
+
+    python3 bench/startup.py
+
+normal          Picarx(): MCU reset + 0.2 s settle, every subsystem created,
+                servos driven to their calibration angles
+fast (cold)     Picarx(fast_start=True) on a board nobody reset yet
+fast (warm)     Picarx(fast_start=True) after another Picarx reset the board,
+                as the 2nd and 3rd aqx-bot service would see it
+'''
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from picarx import Picarx
+from picarx.sim import SimBackend
+
+
+def measure(count, fast_start, warm):
+    construct = []
+    first_use = []
+    writes = []
+    for _ in range(count):
+        backend = SimBackend()
+        if warm:
+            backend.mark_mcu_initialised()
+        st = time.perf_counter()
+        px = Picarx(backend=backend, fast_start=fast_start)
+        construct.append(time.perf_counter() - st)
+        writes.append(len(backend.bus.writes))
+        st = time.perf_counter()
+        px.get_distance()
+        first_use.append(time.perf_counter() - st)
+    mid = count // 2
+    return sorted(construct)[mid], sorted(first_use)[mid], sorted(writes)[mid]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, default=10)
+    args = parser.parse_args()
+
+    print('%-14s %16s %22s %14s' % ('mode', 'construct (ms)', 'first get_distance (ms)', 'init writes'))
+    for name, fast_start, warm in (('normal', False, False), ('fast (cold)', True, False), ('fast (warm)', True, True)):
+        construct, first_use, writes = measure(args.count, fast_start, warm)
+        print('%-14s %16.2f %22.2f %14d' % (name, construct * 1e3, first_use * 1e3, writes))
+
+if __name__ == "__main__":
+    main()
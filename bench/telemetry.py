@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+'''
+Sensor telemetry encodings: bytes on the wire and CPU per sample
+
+Compares the JSON message sensor_streamer.py used to send with the binary
+frames of aqx-bot/telemetry.py, one sample per frame and batched.
+
+    python3 bench/telemetry.py [-n SAMPLES]
+'''
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'aqx-bot'))
+from telemetry import TelemetryEncoder, TelemetryDecoder
+
+UWB = (1.23, 4.56, 0.78)
+GYRO, ACCEL, MAG = (0.0, 0.0, 0.0), (0.0, 0.0, 9.8), (0.1, 0.1, 0.1)
+UDP_IP_OVERHEAD = 28 # IPv4 + UDP headers per datagram
+
+
+def run_json(n):
+    datagrams = []
+    st = time.perf_counter()
+    for i in range(n):
+        data = {
+            "ultrasonic_distance": 20.0 + i % 50 * 0.37,
+            "uwb_location": {'x': UWB[0], 'y': UWB[1], 'z': UWB[2]},
+            "imu": {"gyro": list(GYRO), "accel": list(ACCEL), "mag": list(MAG)},
+        }
+        datagrams.append(json.dumps(data).encode('utf-8'))
+    encode = time.perf_counter() - st
+    st = time.perf_counter()
+    for datagram in datagrams:
+        json.loads(datagram)
+    decode = time.perf_counter() - st
+    return datagrams, encode, decode
+
+
+def run_binary(n, batch):
+    encoder = TelemetryEncoder(batch)
+    datagrams = []
+    st = time.perf_counter()
+    for i in range(n):
+        frame = encoder.add(20.0 + i % 50 * 0.37, UWB, GYRO, ACCEL, MAG)
+        if frame is not None:
+            datagrams.append(frame)
+    frame = encoder.flush()
+    if frame is not None:
+        datagrams.append(frame)
+    encode = time.perf_counter() - st
+    decoder = TelemetryDecoder()
+    st = time.perf_counter()
+    for datagram in datagrams:
+        decoder.decode(datagram)
+    decode = time.perf_counter() - st
+    assert decoder.samples == n and decoder.lost == 0
+    return datagrams, encode, decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-n', '--samples', type=int, default=100000)
+    args = parser.parse_args()
+    n = args.samples
+    print('%-16s %12s %14s %16s %14s %14s' % ('encoding', 'bytes/sample', 'wire B/sample',
+                                               'wire kB/s @100Hz', 'encode us', 'decode us'))
+    runs = [('json', run_json(n))] + [('binary batch %d' % b, run_binary(n, b)) for b in (1, 10)]
+    for name, (datagrams, encode, decode) in runs:
+        payload = sum(len(d) for d in datagrams) / n
+        wire = payload + UDP_IP_OVERHEAD * len(datagrams) / n
+        print('%-16s %12.1f %14.1f %16.2f %14.2f %14.2f' % (
+            name, payload, wire, wire * 100 / 1e3, encode / n * 1e6, decode / n * 1e6))
+
+
+if __name__ == '__main__':
+    main()
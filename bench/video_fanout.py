@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+'''
+MJPEG fan-out: encodes and CPU per viewer count, with a synthetic camera
+
+Per-client is the old video_streamer.py, every viewer captures and encodes
+on its own; broadcast is aqx-bot/frame_broadcast.py, one producer and a
+shared latest-frame slot. The camera is a 640x480 frame source paced at
+30 fps. Frames are encoded with simplejpeg or cv2 when installed, else
+zlib stands in as a CPU-bound codec (the ratios hold, the absolute numbers
+do not).
+
+    python3 bench/video_fanout.py [-s SECONDS] [-v 1 2 4 8]
+'''
+import os
+import sys
+import time
+import zlib
+import threading
+import argparse
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'aqx-bot')]
+from frame_broadcast import Broadcaster
+
+WIDTH, HEIGHT, FPS = 640, 480, 30
+
+
+def jpeg_encoder():
+    ''' (name, encode(rgb frame) -> bytes) of the best codec installed '''
+    try:
+        import simplejpeg
+        return 'simplejpeg', lambda frame: simplejpeg.encode_jpeg(frame, quality=85, colorspace='RGB')
+    except ImportError:
+        pass
+    try:
+        import cv2
+        return 'cv2', lambda frame: cv2.imencode('.jpg', frame)[1].tobytes()
+    except ImportError:
+        pass
+    return 'zlib (stand-in)', lambda frame: zlib.compress(frame.data, 1)
+
+
+class SyntheticCamera(object):
+    ''' capture() returns a moving gradient at most fps times a second '''
+
+    def __init__(self, fps=FPS, width=WIDTH, height=HEIGHT):
+        self.period = 1.0 / fps
+        x = np.arange(width, dtype=np.uint16)
+        y = np.arange(height, dtype=np.uint16)[:, None]
+        self.base = ((x + y) & 0xff).astype(np.uint8)
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+        self.count = 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def capture(self):
+        with self._lock:
+            self._next = max(self._next + self.period, time.monotonic())
+            delay = self._next - time.monotonic()
+            count = self.count = self.count + 1
+        if delay > 0:
+            time.sleep(delay)
+        frame = np.empty_like(self.frame)
+        for c in range(3):
+            np.add(self.base, (count * (c + 1)) & 0xff, out=frame[:, :, c], casting='unsafe')
+        return frame
+
+
+def per_client(viewers, seconds, encode):
+    camera = SyntheticCamera()
+    stop = threading.Event()
+    sent = [0] * viewers
+
+    def viewer(i):
+        while not stop.is_set():
+            encode(camera.capture())
+            sent[i] += 1
+
+    return _measure(viewer, viewers, seconds, stop, sent, lambda: sum(sent))
+
+
+def broadcast(viewers, seconds, encode):
+    camera = SyntheticCamera()
+    broadcaster = Broadcaster(camera.capture, encode).start()
+    stop = threading.Event()
+    sent = [0] * viewers
+
+    def viewer(i):
+        with broadcaster.subscribe() as subscriber:
+            while not stop.is_set():
+                if subscriber.next(0.5) is not None:
+                    sent[i] += 1
+
+    try:
+        return _measure(viewer, viewers, seconds, stop, sent, lambda: broadcaster.encoded)
+    finally:
+        broadcaster.stop()
+
+
+def _measure(viewer, viewers, seconds, stop, sent, encodes):
+    threads = [threading.Thread(target=viewer, args=(i,)) for i in range(viewers)]
+    for t in threads:
+        t.start()
+    time.sleep(0.5) # warm up
+    cpu, wall, enc, frames = time.process_time(), time.monotonic(), encodes(), sum(sent)
+    time.sleep(seconds)
+    cpu, wall = time.process_time() - cpu, time.monotonic() - wall
+    enc, frames = encodes() - enc, sum(sent) - frames
+    stop.set()
+    for t in threads:
+        t.join()
+    return {
+        'encodes_per_s': enc / wall,
+        'fps_per_viewer': frames / wall / viewers,
+        'cpu_percent': cpu / wall * 100,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-s', '--seconds', type=float, default=3.0)
+    parser.add_argument('-v', '--viewers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    codec, encode = jpeg_encoder()
+    print('codec: %s, %dx%d at %d fps' % (codec, WIDTH, HEIGHT, FPS))
+    print('%-10s %7s %12s %15s %8s' % ('mode', 'viewers', 'encodes/s', 'fps per viewer', 'cpu %'))
+    for viewers in args.viewers:
+        for name, run in (('per-client', per_client), ('broadcast', broadcast)):
+            r = run(viewers, args.seconds, encode)
+            print('%-10s %7d %12.1f %15.1f %8.1f' % (name, viewers, r['encodes_per_s'],
+                                                     r['fps_per_viewer'], r['cpu_percent']))
+
+
+if __name__ == '__main__':
+    main()
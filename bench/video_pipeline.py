@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+'''
+Serial vs staged video path, with a synthetic camera
+
+Serial is capture, RGB->BGR and encode one after the other in one thread,
+the way video_streamer.py used to; staged is aqx-bot/video_pipeline.py
+with 1 to N encode workers. The camera is not paced here, so the frame
+rate shows what the processing sustains. Codec as in video_fanout.py.
+
+    python3 bench/video_pipeline.py [-s SECONDS] [-w 1 2 3]
+'''
+import os
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'aqx-bot')]
+from video_fanout import SyntheticCamera, jpeg_encoder
+from video_pipeline import FramePipeline
+
+
+def rgb_to_bgr(frame):
+    return frame[:, :, ::-1].copy()
+
+
+def serial(seconds, encode):
+    camera = SyntheticCamera(fps=1000)
+    frames = 0
+    cpu, st = time.process_time(), time.monotonic()
+    while time.monotonic() - st < seconds:
+        encode(rgb_to_bgr(camera.capture()))
+        frames += 1
+    wall = time.monotonic() - st
+    return frames / wall, (time.process_time() - cpu) / wall * 100, None
+
+
+def staged(seconds, encode, workers):
+    camera = SyntheticCamera(fps=1000)
+    pipeline = FramePipeline(camera.capture, encode, convert=rgb_to_bgr, workers=workers).start()
+    try:
+        pipeline.get()
+        frames = 0
+        cpu, st = time.process_time(), time.monotonic()
+        while time.monotonic() - st < seconds:
+            pipeline.get()
+            frames += 1
+        wall = time.monotonic() - st
+        return frames / wall, (time.process_time() - cpu) / wall * 100, pipeline.stats()
+    finally:
+        pipeline.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-s', '--seconds', type=float, default=3.0)
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 2, 3])
+    args = parser.parse_args()
+    codec, encode = jpeg_encoder()
+    print('codec: %s, %d cores' % (codec, os.cpu_count()))
+    print('%-10s %6s %8s %12s %12s %12s %10s' % ('mode', 'fps', 'cpu %', 'capture ms',
+                                                 'convert ms', 'encode ms', 'latency ms'))
+    fps, cpu, _ = serial(args.seconds, encode)
+    print('%-10s %6.1f %8.1f' % ('serial', fps, cpu))
+    for workers in args.workers:
+        fps, cpu, stats = staged(args.seconds, encode, workers)
+        print('%-10s %6.1f %8.1f %12.2f %12.2f %12.2f %10.2f' % (
+            'staged x%d' % workers, fps, cpu, stats['capture']['p50_ms'], stats['convert']['p50_ms'],
+            stats['encode']['p50_ms'], stats['latency_p50_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,54 @@
 from picarx import Picarx
+from picarx.loop import ControlLoop
 from time import sleep
 from vilib import Vilib
 
 
 px = Picarx()
+speed = 50
+dir_angle = 0
+x_angle = 0
+y_angle = 0
 
 def clamp_number(num,a,b):
   return max(min(num, max(a, b)), min(a, b))
 
+def chase():
+    global dir_angle, x_angle, y_angle
+    if Vilib.detect_obj_parameter['color_n']!=0:
+        coordinate_x = Vilib.detect_obj_parameter['color_x']
+        coordinate_y = Vilib.detect_obj_parameter['color_y']
+        
+        # change the pan-tilt angle for track the object
+        x_angle +=(coordinate_x*10/640)-5
+        x_angle = clamp_number(x_angle,-35,35)
+        px.set_cam_pan_angle(x_angle)
+
+        y_angle -=(coordinate_y*10/480)-5
+        y_angle = clamp_number(y_angle,-35,35)
+        px.set_cam_tilt_angle(y_angle)
+
+        # move
+        # The movement direction will change slower than the pan/tilt direction 
+        # change to avoid confusion when the picture changes at high speed.
+        if dir_angle > x_angle:
+            dir_angle -= 1
+        elif dir_angle < x_angle:
+            dir_angle += 1
+        px.set_dir_servo_angle(x_angle)
+        px.forward(speed)
+
+    else :
+        px.forward(0)
+
 def main():
     Vilib.camera_start()
     Vilib.display()
     Vilib.color_detect("red")
-    speed = 50
-    dir_angle=0
-    x_angle =0
-    y_angle =0
-    while True:
-        if Vilib.detect_obj_parameter['color_n']!=0:
-            coordinate_x = Vilib.detect_obj_parameter['color_x']
-            coordinate_y = Vilib.detect_obj_parameter['color_y']
-            
-            # change the pan-tilt angle for track the object
-            x_angle +=(coordinate_x*10/640)-5
-            x_angle = clamp_number(x_angle,-35,35)
-            px.set_cam_pan_angle(x_angle)
-
-            y_angle -=(coordinate_y*10/480)-5
-            y_angle = clamp_number(y_angle,-35,35)
-            px.set_cam_tilt_angle(y_angle)
-
-            # move
-            # The movement direction will change slower than the pan/tilt direction 
-            # change to avoid confusion when the picture changes at high speed.
-            if dir_angle > x_angle:
-                dir_angle -= 1
-            elif dir_angle < x_angle:
-                dir_angle += 1
-            px.set_dir_servo_angle(x_angle)
-            px.forward(speed)
-            sleep(0.05)
-
-        else :
-            px.forward(0)
-            sleep(0.05)
+    # 20 Hz against a fixed deadline, no drift from the work done each tick
+    loop = ControlLoop()
+    loop.add(chase, hz=20)
+    loop.run()
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 from sunfounder_controller import SunFounderController
 from picarx import Picarx
+from picarx.loop import ControlLoop
 from robot_hat import utils, Music
 from vilib import Vilib
 import os
@@ -17,6 +18,8 @@ sc.start()
 
 # init picarx
 px = Picarx()
+# read the ultrasonic in the background, get_distance() won't block the loop
+px.start_distance_sampler(hz=20)
 speed = 0
 
 current_line_state = None
@@ -29,6 +32,7 @@ SafeDistance = 40   # > 40 safe
 DangerDistance = 20 # > 20 && < 40 turn around, < 20 backward
 
 DETECT_COLOR = 'red' # red, green, blue, yellow , orange, purple
+speak = None
 
 # init music player
 User = os.popen('echo ${SUDO_USER:-$LOGNAME}').readline().strip()
@@ -103,103 +107,107 @@ def line_track():
     else:
         outHandle()
 
-def main():
-    global speed
+def control():
+    global speed, speak
+    # --- send data ---
+    sc.set("A", speed)
+
+    grayscale_data = px.get_grayscale_data()
+    sc.set("D", grayscale_data )
+
+    distance = px.get_distance()
+    sc.set("F", distance)
+
+    # --- control ---
+
+    # # horn
+    if sc.get('M') == True:
+        horn()
+
+    # speaker
+    if sc.get('J') != None:
+        speak=sc.get('J')
+        print(f'speaker: {speak}')
+    if speak in ["forward"]:
+        px.forward(speed)
+    elif speak in ["backward"]:
+        px.backward(speed)
+    elif speak in ["left"]:
+        px.set_dir_servo_angle(-30)
+        px.forward(60)
+        sleep(1.2)
+        px.set_dir_servo_angle(0)
+        px.forward(speed)
+    elif speak in ["right", "white", "rice"]:
+        px.set_dir_servo_angle(30)
+        px.forward(60)
+        sleep(1.2)
+        px.set_dir_servo_angle(0)
+        px.forward(speed)
+    elif speak in ["stop"]:
+        px.stop()
 
+    # line_track and avoid_obstacles
+    line_track_switch = sc.get('I')
+    avoid_obstacles_switch = sc.get('E')
+    if line_track_switch == True:
+        speed = LINE_TRACK_SPEED
+        line_track()
+    elif avoid_obstacles_switch == True:
+        speed = AVOID_OBSTACLES_SPEED
+        avoid_obstacles()
+
+    # joystick moving
+    if line_track_switch != True and avoid_obstacles_switch != True:
+        Joystick_K_Val = sc.get('K')
+        if Joystick_K_Val != None:
+            dir_angle = utils.mapping(Joystick_K_Val[0], -100, 100, -30, 30)
+            speed = Joystick_K_Val[1]
+            px.set_dir_servo_angle(dir_angle)
+            if speed > 0:
+                px.forward(speed)
+            elif speed < 0:
+                speed = -speed
+                px.backward(speed)
+            else:
+                px.stop()
+
+    # camera servos control
+    Joystick_Q_Val = sc.get('Q')
+    if Joystick_Q_Val != None:
+        pan = min(90, max(-90, Joystick_Q_Val[0]))
+        tilt = min(65, max(-35, Joystick_Q_Val[1]))
+        px.set_cam_pan_angle(pan)
+        px.set_cam_tilt_angle(tilt)
+
+    # image recognition
+    if sc.get('N') == True:
+        Vilib.color_detect(DETECT_COLOR)
+    else:
+        Vilib.color_detect("close")
+
+    if sc.get('O') == True:
+        Vilib.face_detect_switch(True)  
+    else:
+        Vilib.face_detect_switch(False)  
+
+    if sc.get('P') == True:
+        Vilib.object_detect_switch(True) 
+    else:
+        Vilib.object_detect_switch(False)
+
+
+def main():
     ip = utils.get_ip()
     print('ip : %s'%ip)
     sc.set('video','http://'+ip+':9000/mjpg')
 
     Vilib.camera_start(vflip=False,hflip=False)
     Vilib.display(local=False, web=True)
-    speak = None
-    while True:
-        # --- send data ---
-        sc.set("A", speed)
-
-        grayscale_data = px.get_grayscale_data()
-        sc.set("D", grayscale_data )
-
-        distance = px.get_distance()
-        sc.set("F", distance)
-
-        # --- control ---
-
-        # # horn
-        if sc.get('M') == True:
-            horn()
-
-        # speaker
-        if sc.get('J') != None:
-            speak=sc.get('J')
-            print(f'speaker: {speak}')
-        if speak in ["forward"]:
-            px.forward(speed)
-        elif speak in ["backward"]:
-            px.backward(speed)
-        elif speak in ["left"]:
-            px.set_dir_servo_angle(-30)
-            px.forward(60)
-            sleep(1.2)
-            px.set_dir_servo_angle(0)
-            px.forward(speed)
-        elif speak in ["right", "white", "rice"]:
-            px.set_dir_servo_angle(30)
-            px.forward(60)
-            sleep(1.2)
-            px.set_dir_servo_angle(0)
-            px.forward(speed)
-        elif speak in ["stop"]:
-            px.stop()
-
-        # line_track and avoid_obstacles
-        line_track_switch = sc.get('I')
-        avoid_obstacles_switch = sc.get('E')
-        if line_track_switch == True:
-            speed = LINE_TRACK_SPEED
-            line_track()
-        elif avoid_obstacles_switch == True:
-            speed = AVOID_OBSTACLES_SPEED
-            avoid_obstacles()
-    
-        # joystick moving
-        if line_track_switch != True and avoid_obstacles_switch != True:
-            Joystick_K_Val = sc.get('K')
-            if Joystick_K_Val != None:
-                dir_angle = utils.mapping(Joystick_K_Val[0], -100, 100, -30, 30)
-                speed = Joystick_K_Val[1]
-                px.set_dir_servo_angle(dir_angle)
-                if speed > 0:
-                    px.forward(speed)
-                elif speed < 0:
-                    speed = -speed
-                    px.backward(speed)
-                else:
-                    px.stop()
-
-        # camera servos control
-        Joystick_Q_Val = sc.get('Q')
-        if Joystick_Q_Val != None:
-            pan = min(90, max(-90, Joystick_Q_Val[0]))
-            tilt = min(65, max(-35, Joystick_Q_Val[1]))
-            px.set_cam_pan_angle(pan)
-            px.set_cam_tilt_angle(tilt)
-
-        # image recognition
-        if sc.get('N') == True:
-            Vilib.color_detect(DETECT_COLOR)
-        else:
-            Vilib.color_detect("close")
-
-        if sc.get('O') == True:
-            Vilib.face_detect_switch(True)  
-        else:
-            Vilib.face_detect_switch(False)  
-
-        if sc.get('P') == True:
-            Vilib.object_detect_switch(True) 
-        else:
-            Vilib.object_detect_switch(False)
+    # 50 Hz against a fixed deadline instead of spinning a core
+    loop = ControlLoop()
+    loop.add(control, hz=50)
+    loop.run()
 
 
 if __name__ == "__main__":
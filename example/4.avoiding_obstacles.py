@@ -10,13 +10,17 @@ def main():
     try:
         px = Picarx()
         # px = Picarx(ultrasonic_pins=['D2','D3']) # tring, echo
+        # read the ultrasonic in the background, get_distance() won't block
+        px.start_distance_sampler(hz=20)
        
         while True:
-            distance = round(px.ultrasonic.read(), 2)
+            distance = round(px.get_distance(), 2)
             print("distance: ",distance)
             if distance >= SafeDistance:
                 px.set_dir_servo_angle(0)
                 px.forward(POWER)
+                # get_distance() doesn't wait any more, check at the sampler rate
+                time.sleep(0.05)
             elif distance >= DangerDistance:
                 px.set_dir_servo_angle(30)
                 px.forward(POWER)
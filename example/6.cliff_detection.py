@@ -23,6 +23,9 @@ px = Picarx()
 # px = Picarx(grayscale_pins=['A0', 'A1', 'A2'])
 # manual modify reference value
 px.set_cliff_reference([200, 200, 200])
+# sample the grayscale module at 200 Hz in the background, get_grayscale_data()
+# then returns the median of the last 5 samples without reading the ADC
+px.start_grayscale_engine(hz=200, smoothing='median', window=5)
 
 current_state = None
 px_power = 10
@@ -48,6 +51,8 @@ if __name__=='__main__':
                     tts.say("danger")
                     sleep(0.1)
             last_state = state
+            # get_grayscale_data() doesn't wait for the ADC any more, check at the engine rate
+            sleep(1/200)
 
     finally:
         px.stop()
@@ -1,37 +1,38 @@
 from picarx import Picarx
+from picarx.loop import ControlLoop
 from time import sleep
 from vilib import Vilib
 
 px = Picarx()
+x_angle = 0
+y_angle = 0
 
 def clamp_number(num,a,b):
   return max(min(num, max(a, b)), min(a, b))
 
+def track_face():
+    global x_angle, y_angle
+    if Vilib.detect_obj_parameter['human_n']!=0:
+        coordinate_x = Vilib.detect_obj_parameter['human_x']
+        coordinate_y = Vilib.detect_obj_parameter['human_y']
+        
+        # change the pan-tilt angle for track the object
+        x_angle +=(coordinate_x*10/640)-5
+        x_angle = clamp_number(x_angle,-35,35)
+        px.set_cam_pan_angle(x_angle)
+
+        y_angle -=(coordinate_y*10/480)-5
+        y_angle = clamp_number(y_angle,-35,35)
+        px.set_cam_tilt_angle(y_angle)
+
 def main():
     Vilib.camera_start()
     Vilib.display()
     Vilib.face_detect_switch(True)
-    x_angle =0
-    y_angle =0
-    while True:
-        if Vilib.detect_obj_parameter['human_n']!=0:
-            coordinate_x = Vilib.detect_obj_parameter['human_x']
-            coordinate_y = Vilib.detect_obj_parameter['human_y']
-            
-            # change the pan-tilt angle for track the object
-            x_angle +=(coordinate_x*10/640)-5
-            x_angle = clamp_number(x_angle,-35,35)
-            px.set_cam_pan_angle(x_angle)
-
-            y_angle -=(coordinate_y*10/480)-5
-            y_angle = clamp_number(y_angle,-35,35)
-            px.set_cam_tilt_angle(y_angle)
-
-            sleep(0.05)
-
-        else :
-            pass
-            sleep(0.05)
+    # 20 Hz against a fixed deadline, no drift from the work done each tick
+    loop = ControlLoop()
+    loop.add(track_face, hz=20)
+    loop.run()
 
 
 if __name__ == "__main__":
@@ -8,6 +8,7 @@ import readline # optimize keyboard input, only need to import
 import speech_recognition as sr
 
 from picarx import Picarx
+from picarx.keyframes import ActionPlayer
 from robot_hat import Music, Pin
 
 import time
@@ -53,7 +54,8 @@ SOUND_EFFECT_ACTIONS = ["honking", "start engine"]
 # car init 
 # =================================================================
 try:
-    my_car = Picarx()
+    my_car = Picarx(thread_safe=True) # used by the action and main threads
+    action_player = ActionPlayer(my_car)
     time.sleep(1)
 except Exception as e:
     raise RuntimeError(e)
@@ -190,18 +192,24 @@ def action_handler():
         elif _state == 'think':
             if last_action_status != 'think':
                 last_action_status = 'think'
-                # think(my_car)
-                keep_think(my_car)
+                action_player.play(keep_think_timeline)
         elif _state == 'actions':
             last_action_status = 'actions'
             with action_lock:
                 _actions = actions_to_be_done
+            # queued back to back on the player, preempting the think pose
+            playbacks = []
             for _action in _actions:
-                try:
-                    actions_dict[_action](my_car)
-                except Exception as e:
-                    print(f'action error: {e}')
-                time.sleep(0.5)
+                if _action in action_timelines:
+                    playbacks.append(action_player.play(action_timelines[_action], priority=1))
+                else:
+                    print(f'action error: {_action}')
+            # they run back to back, give up on what has not ended well after that
+            deadline = time.time() + sum(p.timeline.duration for p in playbacks) + 1.0
+            for playback in playbacks:
+                if not playback.wait(max(0, deadline - time.time())):
+                    print(f'action timeout: {playback.timeline.name}')
+                    playback.cancel()
 
             with action_lock:
                 action_status = 'actions_done'
@@ -381,5 +389,6 @@ if __name__ == "__main__":
     finally:
         if with_img:
             Vilib.camera_close()
+        action_player.close()
         my_car.reset()
 
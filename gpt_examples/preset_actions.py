@@ -1,18 +1,24 @@
 
 from time import sleep
-import random
-from math import sin, cos, pi
+from picarx.keyframes import compile_action, compile_actions, on_car
+
+# Gestures are keyframe scripts: they are run once at import against a
+# recorder that looks like Picarx plus car.sleep(), and compiled into
+# timelines (see picarx/keyframes.py). Play them with an ActionPlayer:
+#   player = ActionPlayer(my_car)
+#   player.play(action_timelines["nod"]).wait()
+# actions_dict[name](car) still plays a gesture directly on a Picarx, blocking.
 
 def wave_hands(car):
     car.reset()
     car.set_cam_tilt_angle(20)
     for _ in range(2):
         car.set_dir_servo_angle(-25)
-        sleep(.1)
+        car.sleep(.1)
         # car.set_dir_servo_angle(0)
-        # sleep(.1)
+        # car.sleep(.1)
         car.set_dir_servo_angle(25)
-        sleep(.1)
+        car.sleep(.1)
     car.set_dir_servo_angle(0)
 
 def resist(car):
@@ -21,10 +27,10 @@ def resist(car):
     for _ in range(3):
         car.set_dir_servo_angle(-15)
         car.set_cam_pan_angle(15)
-        sleep(.1)
+        car.sleep(.1)
         car.set_dir_servo_angle(15)
         car.set_cam_pan_angle(-15)
-        sleep(.1)
+        car.sleep(.1)
     car.stop()
     car.set_dir_servo_angle(0)
     car.set_cam_pan_angle(0)
@@ -34,9 +40,9 @@ def act_cute(car):
     car.set_cam_tilt_angle(-20)
     for i in range(15):
         car.forward(5)
-        sleep(0.02)
+        car.sleep(0.02)
         car.backward(5)
-        sleep(0.02)
+        car.sleep(0.02)
     car.set_cam_tilt_angle(0)
     car.stop()
 
@@ -44,66 +50,59 @@ def rub_hands(car):
     car.reset()
     for i in range(5):
         car.set_dir_servo_angle(-6)
-        sleep(.5)
+        car.sleep(.5)
         car.set_dir_servo_angle(6)
-        sleep(.5)
+        car.sleep(.5)
     car.reset()
 
 def think(car):
     car.reset()
 
-    for i in range(11):
-        car.set_cam_pan_angle(i*3)
-        car.set_cam_tilt_angle(-i*2)
-        car.set_dir_servo_angle(i*2)
-        sleep(.05)
-    sleep(1)
+    # interpolated in the background, 0.55 s like the old 11 steps of 0.05 s
+    car.move_servos(.55, easing='linear', pan=30, tilt=-20, dir=20).wait()
+    car.sleep(1)
     car.set_cam_pan_angle(15)
     car.set_cam_tilt_angle(-10)
     car.set_dir_servo_angle(10)
-    sleep(.1)
+    car.sleep(.1)
     car.reset()
 
 def keep_think(car):
     car.reset()
-    for i in range(11):
-        car.set_cam_pan_angle(i*3)
-        car.set_cam_tilt_angle(-i*2)
-        car.set_dir_servo_angle(i*2)
-        sleep(.05)
+    car.move_servos(.55, easing='linear', pan=30, tilt=-20, dir=20).wait()
 
 def shake_head(car):
     car.stop()
     car.set_cam_pan_angle(0)
     car.set_cam_pan_angle(60)
-    sleep(.2)
+    car.sleep(.2)
     car.set_cam_pan_angle(-50)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_pan_angle(40)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_pan_angle(-30)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_pan_angle(20)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_pan_angle(-10)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_pan_angle(10)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_pan_angle(-5)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_pan_angle(0)
 
 def nod(car):
     car.reset()
     car.set_cam_tilt_angle(0)
     car.set_cam_tilt_angle(5)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(-30)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(5)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(-30)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(0)
 
 
@@ -111,53 +110,53 @@ def depressed(car):
     # car.reset()
     # car.set_cam_tilt_angle(0)
     # car.set_cam_tilt_angle(20)
-    # sleep(.22)
+    # car.sleep(.22)
     # car.set_cam_tilt_angle(-30)
-    # sleep(.1)
+    # car.sleep(.1)
     # car.set_cam_tilt_angle(15)
-    # sleep(.1)
+    # car.sleep(.1)
     # car.set_cam_tilt_angle(-20)
-    # sleep(.1)
+    # car.sleep(.1)
     # car.set_cam_tilt_angle(10)
-    # sleep(.1)
+    # car.sleep(.1)
     # car.set_cam_tilt_angle(-10)
-    # sleep(.1)
+    # car.sleep(.1)
     # car.set_cam_tilt_angle(5)
-    # sleep(.1)
+    # car.sleep(.1)
     # car.set_cam_tilt_angle(-5)
-    # sleep(.1)
+    # car.sleep(.1)
     # car.set_cam_tilt_angle(2)
-    # sleep(.1)
+    # car.sleep(.1)
     # car.set_cam_tilt_angle(0)
 
     car.reset()
     car.set_cam_tilt_angle(0)
     car.set_cam_tilt_angle(20)
-    sleep(.22)
+    car.sleep(.22)
     car.set_cam_tilt_angle(-22)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(10)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(-22)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(0)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(-22)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(-10)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(-22)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(-15)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(-22)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(-19)
-    sleep(.1)
+    car.sleep(.1)
     car.set_cam_tilt_angle(-22)
-    sleep(.1)
+    car.sleep(.1)
 
-    sleep(1.5)
+    car.sleep(1.5)
     car.reset()
 
 def twist_body(car):
@@ -167,23 +166,23 @@ def twist_body(car):
         car.set_motor_speed(2, 20)
         car.set_cam_pan_angle(-20)
         car.set_dir_servo_angle(-10)
-        sleep(.1)
+        car.sleep(.1)
         car.set_motor_speed(1, 0)
         car.set_motor_speed(2, 0)
         car.set_cam_pan_angle(0)
         car.set_dir_servo_angle(0)
-        sleep(.1)
+        car.sleep(.1)
         car.set_motor_speed(1, -20)
         car.set_motor_speed(2, -20)
         car.set_cam_pan_angle(20)
         car.set_dir_servo_angle(10)
-        sleep(.1)
+        car.sleep(.1)
         car.set_motor_speed(1, 0)
         car.set_motor_speed(2, 0)
         car.set_cam_pan_angle(0)
         car.set_dir_servo_angle(0)
 
-        sleep(.1)
+        car.sleep(.1)
 
 
 def celebrate(car):
@@ -192,29 +191,29 @@ def celebrate(car):
 
     car.set_dir_servo_angle(30)
     car.set_cam_pan_angle(60)
-    sleep(.3)
+    car.sleep(.3)
     car.set_dir_servo_angle(10)
     car.set_cam_pan_angle(30)
-    sleep(.1)
+    car.sleep(.1)
     car.set_dir_servo_angle(30)
     car.set_cam_pan_angle(60)
-    sleep(.3)
+    car.sleep(.3)
     car.set_dir_servo_angle(0)
     car.set_cam_pan_angle(0)
-    sleep(.2)
+    car.sleep(.2)
 
     car.set_dir_servo_angle(-30)
     car.set_cam_pan_angle(-60)
-    sleep(.3)
+    car.sleep(.3)
     car.set_dir_servo_angle(-10)
     car.set_cam_pan_angle(-30)
-    sleep(.1)
+    car.sleep(.1)
     car.set_dir_servo_angle(-30)
     car.set_cam_pan_angle(-60)
-    sleep(.3)
+    car.sleep(.3)
     car.set_dir_servo_angle(0)
     car.set_cam_pan_angle(0)
-    sleep(.2)
+    car.sleep(.2)
 
 def honking(music):
     import utils
@@ -227,7 +226,7 @@ def start_engine(music):
     music.sound_play_threading("../sounds/car-start-engine.wav", 50)
 
 
-actions_dict = {
+gestures = {
     "shake head":shake_head, 
     "nod": nod,
     "wave hands": wave_hands,
@@ -240,6 +239,10 @@ actions_dict = {
     "depressed": depressed,
 }
 
+action_timelines = compile_actions(gestures)
+actions_dict = {name: on_car(script) for name, script in gestures.items()}
+keep_think_timeline = compile_action(keep_think)
+
 sounds_dict = {
     "honking": honking,
     "start engine": start_engine,
@@ -248,6 +251,7 @@ sounds_dict = {
 
 if __name__ == "__main__":
     from picarx import Picarx
+    from picarx.keyframes import ActionPlayer
     from robot_hat import Music
     import os
 
@@ -257,6 +261,7 @@ if __name__ == "__main__":
 
     my_car = Picarx()
     my_car.reset()
+    player = ActionPlayer(my_car)
 
     music = Music()
 
@@ -284,7 +289,7 @@ if __name__ == "__main__":
                     sounds_dict[sounds[last_key-_actions_num]](music)
                 else:
                     print(actions[last_key])
-                    actions_dict[actions[last_key]](my_car)
+                    player.play(action_timelines[actions[last_key]]).wait()
             else:
                 key = int(key)
                 if key > (_actions_num + _sounds_num - 1):
@@ -296,7 +301,7 @@ if __name__ == "__main__":
                 else:
                     last_key = key
                     print(actions[key])
-                    actions_dict[actions[key]](my_car)
+                    player.play(action_timelines[actions[key]]).wait()
 
             # sleep(2)
             # shake_head(my_car)
@@ -315,6 +320,7 @@ if __name__ == "__main__":
     except Exception as e:
         print(f'Error:\n {e}')
     finally:
+        player.close()
         my_car.reset()
         sleep(.1)
 
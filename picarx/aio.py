@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+'''
+asyncio facade for Picarx
+
+Every call is submitted to one executor thread that owns the bus, so
+commands run in the order they were made, even when they come from
+different tasks, and the event loop never blocks on I2C or the ultrasonic.
+
+    async def main():
+        async with AsyncPicarx() as car:
+            await car.set_dir_servo_angle(10)
+            await car.forward_for(30, 1.5)          # stops after 1.5 s
+            await car.move_servos(0.5, pan=30)      # interpolated, see trajectory
+            async for distance in car.distance_stream(hz=20):
+                if distance < 20:
+                    break
+
+    asyncio.run(main())
+
+The commands return futures as soon as they are called, await them when
+the result or the completion matters.
+'''
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Picarx methods exposed as awaitable commands
+COMMANDS = [
+    'set_motor_speed', 'set_power', 'forward', 'backward', 'drive', 'stop',
+    'set_dir_servo_angle', 'set_cam_pan_angle', 'set_cam_tilt_angle', 'reset',
+    'get_distance', 'get_grayscale_data', 'get_line_status', 'get_cliff_status',
+    'set_grayscale_reference', 'set_cliff_reference',
+]
+
+
+class AsyncPicarx(object):
+    ''' awaitable Picarx
+
+    param car: Picarx to wrap, one is created from picarx_kwargs if None
+    param picarx_kwargs: Picarx() arguments, e.g. backend='sim'
+    '''
+
+    def __init__(self, car=None, **picarx_kwargs):
+        if car is None:
+            from .picarx import Picarx
+            car = Picarx(**picarx_kwargs)
+        self.car = car
+        # one worker: submission order is execution order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='picarx')
+
+    def submit(self, func, *args, **kwargs):
+        ''' run func(*args, **kwargs) on the bus thread, return an asyncio future '''
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _ticks(self, hz):
+        # absolute deadlines, a slow consumer skips ticks instead of drifting
+        period = 1.0 / hz
+        deadline = time.monotonic()
+        while True:
+            yield
+            deadline += period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                deadline = time.monotonic()
+
+    async def distance_stream(self, hz=20):
+        ''' yield the distance in cm hz times a second '''
+        async for _ in self._ticks(hz):
+            yield await self.get_distance()
+
+    async def grayscale_stream(self, hz=20):
+        ''' yield the 3 grayscale values hz times a second '''
+        async for _ in self._ticks(hz):
+            yield await self.get_grayscale_data()
+
+    async def drive_for(self, speed, steer, seconds, pan=None, tilt=None):
+        ''' drive() for seconds, then stop, also when cancelled; steer None keeps the current angle '''
+        if steer is None:
+            # the angle is read on the bus thread, after the commands queued before this one
+            await self.submit(lambda: self.car.drive(speed, self.car.dir_current_angle, pan, tilt))
+        else:
+            await self.drive(speed, steer, pan, tilt)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await self.stop()
+
+    async def forward_for(self, speed, seconds):
+        await self.drive_for(speed, None, seconds)
+
+    async def backward_for(self, speed, seconds):
+        await self.drive_for(-speed, None, seconds)
+
+    async def move_servos(self, duration, easing='ease_in_out', dir=None, pan=None, tilt=None):
+        ''' interpolated servo move, returns when it is done, see Picarx.move_servos '''
+        handle = await self.submit(self.car.move_servos, duration, easing, dir, pan, tilt)
+        await handle
+        return handle
+
+    async def close(self, reset=True):
+        ''' optionally reset() the car, then shut the bus thread down '''
+        if reset:
+            await self.reset()
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def _command(name):
+    def command(self, *args, **kwargs):
+        return self.submit(getattr(self.car, name), *args, **kwargs)
+    command.__name__ = name
+    command.__doc__ = "Picarx.%s() on the bus thread, returns an awaitable future" % name
+    return command
+
+for _name in COMMANDS:
+    setattr(AsyncPicarx, _name, _command(_name))
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+'''
+Single-writer I2C bus arbiter
+
+With Picarx(thread_safe=True) every I2C access (servo / motor writes and
+ADC reads) is queued here and executed by one writer at a time, so callers
+in different threads can never interleave inside each other's transactions.
+
+There is no bus thread to hand over to: the caller that finds the bus idle
+becomes the writer and runs the queue, including what other threads queued
+meanwhile, then hands the bus back (flat combining). An uncontended call
+costs a lock, not two thread switches.
+
+- writes a caller makes inside one Picarx method (or Picarx.transaction())
+  are queued as one batch and go out in one bus transaction
+- batches queue in order; while a batch waits for the bus, later writes to
+  the same output from any thread merge into it, the newest value wins
+- ADC reads are queued between the batches, in order
+- the ultrasonic is timed on GPIO, not I2C, and is read in the caller's
+  thread, so a 20 ms echo does not hold anybody up
+
+Callers block until their batch or read is done, like with direct writes.
+'''
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+class _Batch(object):
+    __slots__ = ('writes', 'index', 'done', 'error')
+
+    def __init__(self):
+        self.writes = []  # [output, value, force]
+        self.index = {}   # output: position in writes
+        self.done = threading.Event()
+        self.error = None
+
+    def add(self, output, value, force):
+        position = self.index.get(output)
+        if position is None:
+            self.index[output] = len(self.writes)
+            self.writes.append([output, value, force])
+            return False
+        write = self.writes[position]
+        write[1] = value
+        write[2] = write[2] or force
+        return True
+
+
+class _Call(object):
+    __slots__ = ('func', 'done', 'result', 'error')
+
+    def __init__(self, func):
+        self.func = func
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Arbitrated(object):
+    ''' proxy whose read() goes through the arbiter, for ADC objects '''
+
+    def __init__(self, arbiter, obj):
+        self._arbiter = arbiter
+        self._obj = obj
+
+    def read(self, *args):
+        return self._arbiter.call(self._obj.read, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._obj, name)
+
+
+class BusArbiter(object):
+    ''' orders all bus access of a Picarx, one writer at a time
+
+    param backend: Picarx backend, batches run in backend.transaction()
+    param apply: apply(output, value, force), writes one output right away
+    '''
+
+    def __init__(self, backend, apply):
+        self.backend = backend
+        self.apply = apply
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._writer = None # thread ident running the queue
+        self.batches = 0  # batches written
+        self.writes = 0   # writes submitted
+        self.merged = 0   # writes folded into a queued write of the same output
+        self.calls = 0
+        self.max_depth = 0
+
+    def _writing(self):
+        return self._writer == threading.get_ident()
+
+    def _submit(self, writes):
+        with self._cond:
+            tail = self._queue[-1] if self._queue else None
+            # a batch still in the queue has not started, later writes may join it
+            if isinstance(tail, _Batch):
+                batch = tail
+            else:
+                batch = _Batch()
+                self._queue.append(batch)
+                self.max_depth = max(self.max_depth, len(self._queue))
+            for output, value, force in writes:
+                if batch.add(output, value, force):
+                    self.merged += 1
+            self.writes += len(writes)
+        self._wait(batch)
+        if batch.error is not None:
+            raise batch.error
+
+    def write(self, output, value, force=False):
+        ''' queue a write, or add it to the open batch of this thread '''
+        if self._writing():
+            self.apply(output, value, force)
+            return
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append((output, value, force))
+            return
+        self._submit([(output, value, force)])
+
+    @contextmanager
+    def batch(self):
+        ''' writes of this thread inside the block go out as one batch '''
+        if self._writing() or getattr(self._local, 'pending', None) is not None:
+            yield
+            return
+        self._local.pending = pending = []
+        try:
+            yield
+        finally:
+            self._local.pending = None
+            if pending:
+                self._submit(pending)
+
+    def batching(self):
+        ''' True inside a batch() of this thread whose writes are not submitted yet '''
+        return not self._writing() and getattr(self._local, 'pending', None) is not None
+
+    def call(self, func, *args):
+        ''' run func(*args) as the bus writer in queue order, return its result '''
+        if self._writing():
+            return func(*args)
+        call = _Call(lambda: func(*args))
+        with self._cond:
+            self._queue.append(call)
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self.calls += 1
+        self._wait(call)
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def wrap(self, obj):
+        ''' obj with its read() going through the arbiter '''
+        return _Arbitrated(self, obj)
+
+    def _wait(self, item):
+        ''' until item ran, running the queue ourselves whenever the bus is free '''
+        while True:
+            with self._cond:
+                while self._writer is not None and not item.done.is_set():
+                    self._cond.wait()
+                if item.done.is_set():
+                    return
+                self._writer = threading.get_ident()
+            try:
+                self._run()
+            finally:
+                with self._cond:
+                    self._writer = None
+                    self._cond.notify_all()
+
+    def _run(self):
+        # run queued items in order until the queue is empty
+        while True:
+            with self._cond:
+                if not self._queue:
+                    return
+                item = self._queue.popleft()
+            try:
+                if isinstance(item, _Batch):
+                    with self.backend.transaction():
+                        for output, value, force in item.writes:
+                            self.apply(output, value, force)
+                    self.batches += 1
+                else:
+                    item.result = item.func()
+            except Exception as e:
+                item.error = e
+            item.done.set()
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'writes': self.writes,
+            'merged': self.merged,
+            'calls': self.calls,
+            'max_depth': self.max_depth,
+        }
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+'''
+Hardware backends for Picarx
+
+A backend provides the driver classes Picarx is built from (Pin, ADC, PWM,
+Servo, Grayscale_Module, Ultrasonic and utils), the config store
+(open_config), a transaction()
+context manager that groups the bus writes of one control update, and
+tracks whether the MCU was already reset since boot (see fast_start). The
+default backend is robot_hat; the "sim" backend runs the same code on any
+Linux box.
+
+Select a backend with Picarx(backend=...) or the PICARX_BACKEND
+environment variable.
+'''
+import os
+from contextlib import nullcontext
+from .config import Config
+
+BACKEND_ENV = 'PICARX_BACKEND'
+DEFAULT_BACKEND = 'robot_hat'
+
+# written after an MCU reset, tmpfs so it is gone after a reboot
+MCU_INIT_MARKER = '/dev/shm/picarx-mcu-init'
+BOOT_ID = '/proc/sys/kernel/random/boot_id'
+
+
+def _boot_id():
+    try:
+        with open(BOOT_ID) as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+class RobotHatBackend(object):
+    ''' Real hardware, drivers imported from robot_hat '''
+    NAME = 'robot_hat'
+
+    def __init__(self):
+        import robot_hat
+        self.Pin = robot_hat.Pin
+        self.ADC = robot_hat.ADC
+        self.PWM = robot_hat.PWM
+        self.Servo = robot_hat.Servo
+        self.Grayscale_Module = robot_hat.Grayscale_Module
+        self.Ultrasonic = robot_hat.Ultrasonic
+        self.utils = robot_hat.utils
+
+    def open_config(self, path, mode=None, owner=None):
+        return Config(path, mode, owner)
+
+    def transaction(self):
+        '''
+        Group the writes of one control update. robot_hat has no multi-
+        register write, so the writes go out back to back in order.
+        '''
+        return nullcontext()
+
+    def mcu_initialised(self):
+        ''' True if a Picarx already reset the MCU since this boot '''
+        try:
+            with open(MCU_INIT_MARKER) as f:
+                return f.read().strip() == _boot_id()
+        except OSError:
+            return False
+
+    def mark_mcu_initialised(self):
+        try:
+            with open(MCU_INIT_MARKER, 'w') as f:
+                f.write(_boot_id())
+            os.chmod(MCU_INIT_MARKER, 0o666)
+        except OSError:
+            pass
+
+
+def _sim_backend(**kwargs):
+    from .sim import SimBackend
+    return SimBackend(**kwargs)
+
+BACKENDS = {
+    'robot_hat': RobotHatBackend,
+    'sim': _sim_backend,
+}
+
+def load_backend(backend=None):
+    ''' get a backend instance
+
+    param backend: backend name, backend instance or None
+                   (None reads PICARX_BACKEND, default robot_hat)
+    '''
+    if backend is None:
+        backend = os.environ.get(BACKEND_ENV, DEFAULT_BACKEND)
+    if not isinstance(backend, str):
+        return backend
+    try:
+        factory = BACKENDS[backend]
+    except KeyError:
+        raise ValueError("unknown backend '%s', choose from %s" % (backend, list(BACKENDS)))
+    return factory()
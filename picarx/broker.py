@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+'''
+Hardware broker: one process owns the Picarx, others use shared memory
+
+Only the broker constructs a Picarx, so there is one MCU reset and one
+owner of the pins. It publishes a small shared memory segment
+(/dev/shm/picarx):
+
+- a latest-command slot per actuator (drive, camera); clients overwrite
+  it, the broker applies the newest value on its next tick
+- a sensor block (distance, grayscale) the broker refreshes
+
+Every slot and the sensor block are seqlocks: the writer makes the sequence
+number odd, writes, and makes it even again; readers retry when it was odd
+or changed underneath them. Clients read and write the mapped memory
+directly, no syscall per access.
+
+    sudo python3 -m picarx.broker          # --sim for the simulated backend
+
+    from picarx.broker import open_car
+    px = open_car()          # BrokerClient if the broker runs, else Picarx()
+    px.set_dir_servo_angle(10)
+    px.forward(30)
+    px.get_distance()
+
+Layout, little endian, 32 byte blocks: header ('PXBK', version, broker pid,
+heartbeat monotonic seconds), drive slot (speed, steer), camera slot (pan,
+tilt, NaN keeps the angle), sensor block (distance, grayscale x3). A block
+is (seq uint32, 4 pad, time float64, 4 float32).
+'''
+import os
+import math
+import time
+import struct
+import threading
+from multiprocessing import shared_memory
+
+NAME = 'picarx'
+MAGIC = b'PXBK'
+VERSION = 1
+HEADER = struct.Struct('<4sHHid')
+SEQ = struct.Struct('<I')
+DATA = struct.Struct('<d4f') # at offset 8 of a block
+BLOCK = 32
+
+DRIVE = 1   # block index of each slot, block 0 is the header
+CAMERA = 2
+SENSORS = 3
+SIZE = 4 * BLOCK
+NAN = float('nan')
+
+
+def _write_block(buf, index, t, values):
+    offset = index * BLOCK
+    seq = SEQ.unpack_from(buf, offset)[0]
+    SEQ.pack_into(buf, offset, (seq + 1) & 0xffffffff) # odd: write in progress
+    DATA.pack_into(buf, offset + 8, t, *values)
+    SEQ.pack_into(buf, offset, (seq + 2) & 0xffffffff)
+
+
+def _read_block(buf, index, tries=10000):
+    ''' (seq, time, 4 values) of a consistent snapshot, None if the writer
+    never finished (it died halfway) '''
+    offset = index * BLOCK
+    for _ in range(tries):
+        seq = SEQ.unpack_from(buf, offset)[0]
+        if seq & 1:
+            continue
+        t, *values = DATA.unpack_from(buf, offset + 8)
+        if SEQ.unpack_from(buf, offset)[0] == seq:
+            return seq, t, values
+    return None
+
+
+def _attach(name):
+    ''' open an existing segment without letting this process's resource
+    tracker unlink it at exit '''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13 has no track=
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return shm
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Broker(object):
+    ''' owns a Picarx and serves it through shared memory
+
+    param car: the Picarx
+    param name: shared memory name, /dev/shm/<name>
+    param hz: command poll rate
+    param sensor_hz: sensor block refresh rate
+    '''
+
+    def __init__(self, car, name=NAME, hz=200, sensor_hz=20):
+        from .loop import ControlLoop
+        self.car = car
+        self.name = name
+        self.shm = self._create(name)
+        self.buf = self.shm.buf
+        HEADER.pack_into(self.buf, 0, MAGIC, VERSION, 0, os.getpid(), time.monotonic())
+        self._applied = {DRIVE: SEQ.unpack_from(self.buf, DRIVE * BLOCK)[0],
+                         CAMERA: SEQ.unpack_from(self.buf, CAMERA * BLOCK)[0]}
+        self.commands = 0
+        self.loop = ControlLoop('broker')
+        self.loop.add(self.poll, hz)
+        self.loop.add(self.publish, sensor_hz)
+
+    @staticmethod
+    def _create(name):
+        try:
+            return shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+        except FileExistsError:
+            pass
+        old = _attach(name)
+        magic, _, _, pid, _ = HEADER.unpack_from(old.buf, 0)
+        if magic == MAGIC and pid != os.getpid() and _pid_alive(pid):
+            old.close()
+            raise RuntimeError("a broker is already running (pid %d)" % pid)
+        # left behind by a broker that died
+        old.close()
+        old.unlink()
+        return shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+
+    def poll(self):
+        ''' apply new commands, refresh the heartbeat '''
+        buf = self.buf
+        struct.pack_into('<d', buf, 12, time.monotonic())
+        block = _read_block(buf, DRIVE)
+        if block is not None and block[0] != self._applied[DRIVE]:
+            seq, _, (speed, steer, _, _) = block
+            self._applied[DRIVE] = seq
+            if speed == 0:
+                self.car.set_dir_servo_angle(steer)
+                self.car.stop()
+            else:
+                self.car.drive(speed, steer)
+            self.commands += 1
+        block = _read_block(buf, CAMERA)
+        if block is not None and block[0] != self._applied[CAMERA]:
+            seq, _, (pan, tilt, _, _) = block
+            self._applied[CAMERA] = seq
+            with self.car.transaction():
+                if not math.isnan(pan):
+                    self.car.set_cam_pan_angle(pan)
+                if not math.isnan(tilt):
+                    self.car.set_cam_tilt_angle(tilt)
+            self.commands += 1
+
+    def publish(self):
+        ''' refresh the sensor block '''
+        distance = self.car.get_distance()
+        grayscale = self.car.get_grayscale_data()
+        _write_block(self.buf, SENSORS, time.monotonic(), [distance] + list(grayscale))
+
+    def run(self):
+        ''' serve until stop() or KeyboardInterrupt '''
+        self.car.start_distance_sampler()
+        try:
+            self.loop.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def start(self):
+        ''' serve from a background thread '''
+        self.car.start_distance_sampler()
+        self.loop.start()
+
+    def stop(self):
+        self.loop.stop()
+
+    def close(self):
+        self.loop.stop()
+        self.car.stop_distance_sampler()
+        self.car.stop()
+        HEADER.pack_into(self.buf, 0, MAGIC, VERSION, 0, 0, 0.0)
+        self.buf = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class BrokerClient(object):
+    ''' Picarx-like handle on a broker's shared memory
+
+    Steering and speed share the drive slot, pan and tilt the camera slot;
+    this client keeps its own copy of the other value of each pair.
+    '''
+    DIR_MIN = -30
+    DIR_MAX = 30
+
+    def __init__(self, name=NAME):
+        self.shm = _attach(name)
+        self.buf = self.shm.buf
+        magic, version, _, pid, _ = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise RuntimeError("/dev/shm/%s is not a picarx broker segment" % name)
+        self.pid = pid
+        self._lock = threading.Lock() # seqlocks take one writer, threads of this process queue here
+        _, _, (speed, steer, _, _) = _read_block(self.buf, DRIVE) or (0, 0, (0, 0, 0, 0))
+        self.speed = 0 if math.isnan(speed) else speed
+        self.dir_current_angle = 0 if math.isnan(steer) else steer
+
+    def heartbeat_age(self):
+        ''' seconds since the broker last polled, large when it is gone '''
+        return time.monotonic() - struct.unpack_from('<d', self.buf, 12)[0]
+
+    @property
+    def alive(self):
+        return self.heartbeat_age() < 1.0
+
+    def drive(self, speed, steer):
+        self.speed = speed
+        self.dir_current_angle = max(self.DIR_MIN, min(self.DIR_MAX, steer))
+        with self._lock:
+            _write_block(self.buf, DRIVE, time.monotonic(), (speed, self.dir_current_angle, NAN, NAN))
+
+    def forward(self, speed):
+        self.drive(speed, self.dir_current_angle)
+
+    def backward(self, speed):
+        self.drive(-speed, self.dir_current_angle)
+
+    def stop(self):
+        self.drive(0, self.dir_current_angle)
+
+    def emergency_stop(self):
+        ''' one slot write, the broker stops the motors on its next poll '''
+        self.drive(0, self.dir_current_angle)
+
+    def set_dir_servo_angle(self, value):
+        self.drive(self.speed, value)
+
+    def set_cam(self, pan=None, tilt=None):
+        ''' aim the camera, None keeps an angle '''
+        with self._lock:
+            _write_block(self.buf, CAMERA, time.monotonic(),
+                         (NAN if pan is None else pan, NAN if tilt is None else tilt, NAN, NAN))
+
+    def set_cam_pan_angle(self, value):
+        self.set_cam(pan=value)
+
+    def set_cam_tilt_angle(self, value):
+        self.set_cam(tilt=value)
+
+    def sensors(self):
+        ''' (monotonic time of the reading, distance, [grayscale x3]) '''
+        block = _read_block(self.buf, SENSORS)
+        if block is None:
+            return 0.0, -1, [0, 0, 0]
+        _, t, values = block
+        return t, values[0], values[1:]
+
+    def get_distance(self):
+        _, distance, _ = self.sensors()
+        return round(distance, 2)
+
+    def get_grayscale_data(self):
+        _, _, grayscale = self.sensors()
+        return [int(v) for v in grayscale]
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+
+def _connect(name, timeout):
+    # a BrokerClient once a live broker shows up, None after timeout seconds
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            client = BrokerClient(name)
+        except (FileNotFoundError, ValueError, RuntimeError):
+            client = None # not started yet, or still sizing / writing its header
+        if client is not None:
+            if client.alive:
+                return client
+            client.close()
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(0.1)
+
+
+def wait_for_broker(name=NAME, timeout=10.0):
+    ''' True once a broker serves /dev/shm/name with a fresh heartbeat, False after timeout '''
+    client = _connect(name, timeout)
+    if client is None:
+        return False
+    client.close()
+    return True
+
+
+def open_car(name=NAME, wait=0.0, **picarx_kwargs):
+    ''' a BrokerClient if a broker is running, else a Picarx(**picarx_kwargs)
+
+    param wait: seconds to give a broker that is still starting before falling back
+    '''
+    client = _connect(name, wait)
+    if client is not None:
+        return client
+    from .picarx import Picarx
+    return Picarx(**picarx_kwargs)
+
+
+def main():
+    import signal
+    import argparse
+    parser = argparse.ArgumentParser(prog='python3 -m picarx.broker', description=__doc__.split('\n')[1])
+    parser.add_argument('--name', default=NAME, help='shared memory name')
+    parser.add_argument('--hz', type=float, default=200, help='command poll rate')
+    parser.add_argument('--sensor-hz', type=float, default=20, help='sensor refresh rate')
+    parser.add_argument('--sim', action='store_true', help='use the simulated backend')
+    args = parser.parse_args()
+
+    from .picarx import Picarx
+    broker = Broker(Picarx(backend='sim' if args.sim else None), args.name, args.hz, args.sensor_hz)
+    signal.signal(signal.SIGTERM, lambda sig, frame: broker.loop.stop())
+    print("picarx broker serving /dev/shm/%s (pid %d)" % (args.name, os.getpid()))
+    broker.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+'''
+Picar-X config and calibration store
+
+The config file is read once into typed values; reads are served from
+memory. set() only marks the store dirty, a background thread writes the
+file once no set() happened for `debounce` seconds (write a temp file,
+then rename over the old one, so a crash never leaves half a file).
+
+The file format is the robot_hat fileDB one, "name = value" per line, so
+old config files keep working and robot_hat can still read them.
+'''
+import os
+import time
+import atexit
+import shutil
+import tempfile
+import threading
+
+HEADER = "# robot-hat config and calibration value of robots\n\n"
+
+
+def _parse_list(cast):
+    def parse(value):
+        if isinstance(value, str):
+            value = value.strip().strip('[]').split(',')
+        return [cast(v.strip() if isinstance(v, str) else v) for v in value]
+    return parse
+
+# known keys and their types, other keys are kept as strings
+SCHEMA = {
+    'picarx_dir_servo': float,
+    'picarx_cam_pan_servo': float,
+    'picarx_cam_tilt_servo': float,
+    'picarx_dir_motor': _parse_list(int),
+    'line_reference': _parse_list(float),
+    'cliff_reference': _parse_list(float),
+}
+
+
+class Config(object):
+    ''' typed config with dirty tracking and debounced atomic flush
+
+    param path: config file, None keeps the config in memory only
+    param mode: file permissions, e.g. 0o777
+    param owner: user name to chown the file to when running as root
+    param debounce: seconds without set() before the file is written
+    '''
+
+    def __init__(self, path=None, mode=None, owner=None, debounce=0.5):
+        self.path = path
+        self.mode = mode
+        self.owner = owner
+        self.debounce = debounce
+        self._values = {}
+        self._dirty = set()
+        self._pending = False
+        self._last_set = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self.flush_count = 0
+        if path is not None:
+            self._load()
+            atexit.register(self.close)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            name, value = line.split('=', 1)
+            name = name.strip()
+            try:
+                self._values[name] = self._cast(name, value.strip())
+            except ValueError:
+                print("\033[33mconfig: bad value for %s in %s, ignored\033[m" % (name, self.path))
+
+    @staticmethod
+    def _cast(name, value):
+        cast = SCHEMA.get(name)
+        if cast is None:
+            return value
+        return cast(value)
+
+    def get(self, name, default_value=None):
+        value = self._values.get(name)
+        if value is None:
+            return default_value
+        if isinstance(value, list):
+            return list(value)
+        return value
+
+    def set(self, name, value):
+        value = self._cast(name, value)
+        with self._cond:
+            if self._values.get(name) == value and name not in self._dirty:
+                return
+            self._values[name] = value
+            if self.path is None:
+                return
+            self._dirty.add(name)
+            self._pending = True
+            self._last_set = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    @property
+    def dirty(self):
+        ''' names changed since the last successful flush '''
+        with self._cond:
+            return set(self._dirty)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if not self._pending:
+                        self._cond.wait()
+                        continue
+                    remaining = self._last_set + self.debounce - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            try:
+                self._save()
+            except OSError as e:
+                # keep the changes dirty, the next set() tries again
+                print("\033[33mconfig: failed to save %s: %s\033[m" % (self.path, e))
+
+    def _save(self):
+        # the lock is only held to copy the values, set() never waits for the disk;
+        # _write_lock keeps two flushes from writing their copies out of order
+        with self._write_lock:
+            with self._cond:
+                self._pending = False
+                if not self._dirty:
+                    return
+                values = dict(self._values)
+            self._write(values)
+            with self._cond:
+                # names set again while writing stay dirty
+                for name, value in values.items():
+                    if name in self._dirty and self._values.get(name) == value:
+                        self._dirty.discard(name)
+                self.flush_count += 1
+
+    def _write(self, values):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix='.picar-x.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(HEADER)
+                for name, value in values.items():
+                    f.write("%s = %s\n" % (name, value))
+                f.flush()
+                os.fsync(f.fileno())
+            if self.mode is not None:
+                os.chmod(tmp, self.mode)
+            if self.owner is not None and os.geteuid() == 0:
+                shutil.chown(tmp, user=self.owner)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def flush(self):
+        ''' write pending changes now '''
+        if self.path is None:
+            return
+        self._save()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify()
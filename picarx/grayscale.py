@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+'''
+Grayscale sampling engine
+
+Samples the three grayscale ADC channels at a fixed rate into a
+preallocated NumPy ring buffer and computes line / cliff status for whole
+windows in one vectorized step, with optional median or EMA smoothing.
+
+    px.start_grayscale_engine(hz=200, smoothing='median', window=5)
+    engine = px.grayscale_engine
+    engine.line_status()            # [0/1, 0/1, 0/1] of the smoothed values
+    engine.cliff_status()           # True if any channel sees a cliff
+    engine.cliff_status_window(20)  # one bool per sample of the last 20
+    engine.age()                    # seconds since the newest good sample
+
+Needs numpy (pip3 install numpy).
+'''
+import time
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SMOOTHING = (None, 'median', 'ema')
+
+
+class GrayscaleEngine(object):
+    ''' fixed rate grayscale sampler
+
+    param adcs: the 3 ADC objects (left, middle, right)
+    param line_reference: 1*3 list, see Picarx.set_line_reference
+    param cliff_reference: 1*3 list, see Picarx.set_cliff_reference
+    param hz: sample rate
+    param size: samples kept in the ring buffer
+    param smoothing: None, 'median' (over window samples) or 'ema'
+    param window: median window in samples
+    param alpha: ema weight of the newest sample
+    '''
+
+    def __init__(self, adcs, line_reference, cliff_reference, hz=200, size=256,
+                 smoothing=None, window=5, alpha=0.3):
+        if np is None:
+            raise ImportError("GrayscaleEngine needs numpy, install it with: pip3 install numpy")
+        if smoothing not in SMOOTHING:
+            raise ValueError("smoothing must be one of %s" % (SMOOTHING,))
+        if not 0 < window <= size:
+            raise ValueError("window must be between 1 and size")
+        self.adcs = list(adcs)
+        self.hz = hz
+        self.size = size
+        self.smoothing = smoothing
+        self.window = window
+        self.alpha = alpha
+        self.line_reference = np.array(line_reference, dtype=np.float32)
+        self.cliff_reference = np.array(cliff_reference, dtype=np.float32)
+
+        self._values = np.zeros((size, 3), dtype=np.float32)
+        self._times = np.zeros(size, dtype=np.float64)
+        self._ema = np.zeros(3, dtype=np.float32)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._first = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.overruns = 0
+        self.errors = 0
+
+    def set_references(self, line_reference=None, cliff_reference=None):
+        if line_reference is not None:
+            self.line_reference = np.array(line_reference, dtype=np.float32)
+        if cliff_reference is not None:
+            self.cliff_reference = np.array(cliff_reference, dtype=np.float32)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def count(self):
+        return self._count
+
+    def start(self, timeout=1.0):
+        ''' start sampling, wait up to timeout for the first sample '''
+        if self.running:
+            return
+        self._stop.clear()
+        self._first.clear()
+        self._thread = threading.Thread(target=self._run, name='grayscale_engine', daemon=True)
+        self._thread.start()
+        self._first.wait(timeout)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        period = 1.0 / self.hz
+        deadline = time.monotonic()
+        adc0, adc1, adc2 = self.adcs
+        while not self._stop.is_set():
+            try:
+                v0, v1, v2 = adc0.read(), adc1.read(), adc2.read()
+            except Exception as e:
+                # keep sampling, age() tells how old the last good sample is
+                self.errors += 1
+                print("grayscale_engine: read error: %s" % e)
+            else:
+                with self._lock:
+                    index = self._count % self.size
+                    row = self._values[index]
+                    row[0] = v0
+                    row[1] = v1
+                    row[2] = v2
+                    self._times[index] = time.monotonic()
+                    if self._count == 0:
+                        self._ema[:] = row
+                    else:
+                        self._ema *= 1 - self.alpha
+                        self._ema += self.alpha * row
+                    self._count += 1
+                self._first.set()
+            deadline += period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                self.overruns += 1
+                deadline = time.monotonic()
+
+    def _indices(self, n):
+        ''' ring buffer indices of the n newest samples, oldest first '''
+        n = min(n, self._count, self.size)
+        return np.arange(self._count - n, self._count) % self.size
+
+    def window_values(self, n):
+        ''' the n newest samples as an n*3 array (copy), oldest first '''
+        with self._lock:
+            return self._values[self._indices(n)]
+
+    def window_times(self, n):
+        with self._lock:
+            return self._times[self._indices(n)]
+
+    def age(self):
+        ''' seconds since the newest sample, None before the first one '''
+        with self._lock:
+            if self._count == 0:
+                return None
+            return time.monotonic() - self._times[(self._count - 1) % self.size]
+
+    def values(self):
+        ''' newest sample, smoothed as configured, as a 3 element array '''
+        with self._lock:
+            if self._count == 0:
+                return np.zeros(3, dtype=np.float32)
+            if self.smoothing == 'ema':
+                return self._ema.copy()
+            if self.smoothing == 'median':
+                return np.median(self._values[self._indices(self.window)], axis=0)
+            return self._values[(self._count - 1) % self.size].copy()
+
+    def line_status(self, values=None):
+        ''' 0 / 1 per channel like Grayscale_Module.read_status, of values or the smoothed sample
+
+        values may also be an n*3 array, the result is then n*3
+        '''
+        if values is None:
+            values = self.values()
+        return (np.asarray(values) <= self.line_reference).astype(np.int8)
+
+    def cliff_status(self, values=None):
+        ''' True if any channel is at or below its cliff reference '''
+        if values is None:
+            values = self.values()
+        return np.any(np.asarray(values) <= self.cliff_reference, axis=-1)
+
+    def line_status_window(self, n):
+        ''' n*3 line status of the n newest raw samples '''
+        return self.line_status(self.window_values(n))
+
+    def cliff_status_window(self, n):
+        ''' cliff status of each of the n newest raw samples '''
+        return self.cliff_status(self.window_values(n))
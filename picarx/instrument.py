@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+'''
+Call count and latency instrumentation
+
+Picarx.enable_instrumentation() replaces the hot-path methods on the
+instance with timing wrappers; disable_instrumentation() deletes them
+again, so the class methods are called directly and a disabled car pays
+nothing, not even a flag check.
+
+    px.enable_instrumentation()
+    ...
+    print(px.dump_instrumentation())   # json, per method p50/p95/p99/max
+    px.reset_instrumentation()
+'''
+import time
+import json
+import functools
+
+# sub-buckets per power of two, percentiles are within 1/(2*SUB) of the truth
+SUB_BITS = 3
+SUB = 1 << SUB_BITS
+
+
+def _bucket(ns):
+    bits = ns.bit_length()
+    if bits <= SUB_BITS:
+        return ns
+    return ((bits - SUB_BITS) << SUB_BITS) + ((ns >> (bits - SUB_BITS - 1)) & (SUB - 1))
+
+def _bucket_value(index):
+    ''' lower bound in ns of a bucket '''
+    if index < SUB:
+        return index
+    shift = (index >> SUB_BITS) - 1
+    return (SUB + (index & (SUB - 1))) << shift
+
+
+class LatencyHistogram(object):
+    ''' log-linear histogram of durations in nanoseconds '''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        index = _bucket(ns)
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, p):
+        ''' duration in ns below which p percent of the calls finished '''
+        if self.count == 0:
+            return 0
+        target = self.count * p / 100.0
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                # bucket midpoint
+                return min((_bucket_value(index) + _bucket_value(index + 1)) / 2, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total / 1e6,
+            'mean_us': self.total / self.count / 1e3 if self.count else 0,
+            'p50_us': self.percentile(50) / 1e3,
+            'p95_us': self.percentile(95) / 1e3,
+            'p99_us': self.percentile(99) / 1e3,
+            'max_us': self.max / 1e3,
+        }
+
+
+class Instrumentation(object):
+    ''' a latency histogram per wrapped name '''
+
+    def __init__(self):
+        self.histograms = {}
+
+    def wrap(self, name, func):
+        hist = self.histograms.setdefault(name, LatencyHistogram())
+        record = hist.record
+        clock = time.perf_counter_ns
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(clock() - start)
+        return timed
+
+    def stats(self):
+        return {name: hist.summary() for name, hist in self.histograms.items() if hist.count}
+
+    def dumps(self):
+        return json.dumps(self.stats(), indent=2)
+
+    def reset(self):
+        for hist in self.histograms.values():
+            hist.clear()
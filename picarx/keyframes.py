@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+'''
+Keyframe timelines for gestures
+
+A gesture is written as a script against Keyframes, which looks like the
+Picarx API plus sleep(). compile_action() runs the script once and turns
+it into a Timeline: precomputed (time, channel, value) frames with a known
+duration. Interpolated servo moves are expanded into frames at compile time.
+
+    def nod(car):
+        car.set_cam_tilt_angle(5)
+        car.sleep(.1)
+        car.set_cam_tilt_angle(-30)
+        car.sleep(.1)
+        car.set_cam_tilt_angle(0)
+
+    player = ActionPlayer(px)
+    player.play(compile_action(nod))
+    on_car(nod)(px)      # or run it directly, blocking, without a player
+
+ActionPlayer runs timelines from a single timer thread. Queued timelines
+start exactly when the previous one ends, and a higher priority play()
+preempts what is running.
+'''
+import time
+import threading
+from .trajectory import EASING
+
+# channels in the order they are applied within one frame, steering first
+# so forward()/backward() see the new angle
+CHANNELS = ('dir', 'pan', 'tilt', 'drive', 'left', 'right')
+MOTOR_CHANNELS = ('drive', 'left', 'right')
+
+
+class Timeline(object):
+    ''' compiled gesture
+
+    times: frame times in seconds from the start, ascending
+    frames: per time a tuple of (channel, value), value None on 'drive' means stop()
+    duration: seconds from the start until the gesture is over
+    '''
+
+    def __init__(self, times, frames, duration, name=None):
+        self.times = tuple(times)
+        self.frames = tuple(frames)
+        self.duration = duration
+        self.name = name
+        self.uses_motors = any(channel in MOTOR_CHANNELS for frame in frames for channel, _ in frame)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return '<Timeline %s: %d frames, %.2f s>' % (self.name, len(self.times), self.duration)
+
+    def run(self, car):
+        ''' play in the calling thread, blocks for duration '''
+        start = time.monotonic()
+        for at, frame in zip(self.times, self.frames):
+            delay = start + at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            apply_frame(car, frame)
+        delay = start + self.duration - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def apply_frame(car, frame):
+    ''' write one frame to a Picarx in one bus transaction '''
+    with car.transaction():
+        for channel, value in frame:
+            if channel == 'dir':
+                car.set_dir_servo_angle(value)
+            elif channel == 'pan':
+                car.set_cam_pan_angle(value)
+            elif channel == 'tilt':
+                car.set_cam_tilt_angle(value)
+            elif channel == 'drive':
+                if value is None:
+                    car.stop()
+                elif value >= 0:
+                    car.forward(value)
+                else:
+                    car.backward(-value)
+            elif channel == 'left':
+                car.set_motor_speed(1, value)
+            elif channel == 'right':
+                car.set_motor_speed(2, value)
+
+
+class _Wait(object):
+    ''' returned by Keyframes.move_servos(), wait() advances the script clock '''
+
+    def __init__(self, keyframes, duration):
+        self._keyframes = keyframes
+        self._duration = duration
+
+    def wait(self, timeout=None):
+        self._keyframes.sleep(self._duration)
+        return True
+
+
+class Keyframes(object):
+    ''' records a gesture script, see compile_action()
+
+    param rate: frames per second for interpolated moves
+    '''
+
+    def __init__(self, rate=50):
+        self.rate = rate
+        self.now = 0.0
+        self.events = [] # (time, order, channel, value)
+        self.state = {}  # last angle per servo channel, for interpolation
+
+    def _set(self, channel, value, at=None):
+        self.events.append((self.now if at is None else at, len(self.events), channel, value))
+        if channel in ('dir', 'pan', 'tilt'):
+            self.state[channel] = value
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def set_dir_servo_angle(self, value):
+        self._set('dir', value)
+
+    def set_cam_pan_angle(self, value):
+        self._set('pan', value)
+
+    def set_cam_tilt_angle(self, value):
+        self._set('tilt', value)
+
+    def forward(self, speed):
+        self._set('drive', speed)
+
+    def backward(self, speed):
+        self._set('drive', -speed)
+
+    def stop(self):
+        self._set('drive', None)
+
+    def set_motor_speed(self, motor, speed):
+        self._set('left' if motor == 1 else 'right', speed)
+
+    def reset(self):
+        self.stop()
+        self.set_dir_servo_angle(0)
+        self.set_cam_tilt_angle(0)
+        self.set_cam_pan_angle(0)
+
+    def move_servos(self, duration, easing='ease_in_out', dir=None, pan=None, tilt=None):
+        ''' interpolated move, expanded to frames; call .wait() to let it finish '''
+        ease = EASING[easing] if isinstance(easing, str) else easing
+        targets = {name: angle for name, angle in (('dir', dir), ('pan', pan), ('tilt', tilt))
+                   if angle is not None}
+        steps = max(1, int(round(duration * self.rate)))
+        for channel, end in targets.items():
+            if channel not in self.state:
+                raise ValueError("move_servos: set a start angle for '%s' first" % channel)
+            start = self.state[channel]
+            for i in range(1, steps + 1):
+                self._set(channel, start + (end - start) * ease(i / steps), at=self.now + duration * i / steps)
+        return _Wait(self, duration)
+
+    def compile(self, name=None):
+        times = []
+        frames = []
+        for at, _, channel, value in sorted(self.events):
+            at = round(at, 6)
+            if not times or times[-1] != at:
+                times.append(at)
+                frames.append({})
+            # same channel twice at one time: the later write wins
+            frames[-1].pop(channel, None)
+            frames[-1][channel] = value
+        frames = [tuple((c, frame[c]) for c in CHANNELS if c in frame) for frame in frames]
+        duration = max([self.now] + times)
+        return Timeline(times, frames, duration, name)
+
+
+def compile_action(script, name=None, rate=50):
+    ''' run a gesture script against Keyframes and return its Timeline '''
+    keyframes = Keyframes(rate)
+    script(keyframes)
+    return keyframes.compile(name or getattr(script, '__name__', None))
+
+
+def compile_actions(scripts, rate=50):
+    ''' {name: script} to {name: Timeline} '''
+    return {name: compile_action(script, name, rate) for name, script in scripts.items()}
+
+
+class _LiveCar(object):
+    # a Picarx plus the sleep() gesture scripts call, for running them directly
+    def __init__(self, car):
+        self._car = car
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def __getattr__(self, name):
+        return getattr(self._car, name)
+
+
+def on_car(script):
+    ''' script as a function of a Picarx that plays it right away, blocking,
+    without compiling: on_car(nod)(px) '''
+    def run(car):
+        return script(_LiveCar(car))
+    run.__name__ = getattr(script, '__name__', 'gesture')
+    run.__doc__ = script.__doc__
+    return run
+
+
+class Playback(object):
+    ''' one play() of a Timeline '''
+
+    def __init__(self, player, timeline, priority):
+        self._player = player
+        self.timeline = timeline
+        self.priority = priority
+        self.start = None # monotonic start time
+        self.index = 0    # next frame
+        self.cancelled = False
+        self.exception = None # the error that ended the playback, if a write failed
+        self._event = threading.Event()
+
+    @property
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def cancel(self):
+        self._player._cancel(self)
+
+
+class ActionPlayer(object):
+    ''' plays Timelines on a Picarx from one timer thread '''
+
+    def __init__(self, car):
+        self.car = car
+        self._cond = threading.Condition()
+        # held while a frame or a stop goes to the car, so a frame picked
+        # before a preemption cannot land after its stop()
+        self._write_lock = threading.Lock()
+        self._queue = []
+        self._current = None
+        self._chain_time = None # end time of the last finished timeline
+        self._thread = None
+        self._closed = False
+
+    def play(self, timeline, priority=0):
+        ''' queue a timeline, a higher priority than the running one preempts it
+
+        Queued timelines of the same priority run back to back, each starting
+        exactly when the previous one ends.
+        return: Playback, wait() or cancel() it
+        '''
+        playback = Playback(self, timeline, priority)
+        stop_motors = False
+        with self._cond:
+            current = self._current
+            if current is not None and priority > current.priority:
+                stop_motors = current.timeline.uses_motors
+                self._finish(current, cancelled=True)
+                self._current = None
+                for queued in [p for p in self._queue if p.priority < priority]:
+                    self._queue.remove(queued)
+                    self._finish(queued, cancelled=True)
+                self._chain_time = None
+            self._queue.append(playback)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='action_player', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        if stop_motors:
+            with self._write_lock:
+                self.car.stop()
+        return playback
+
+    @property
+    def busy(self):
+        return self._current is not None or bool(self._queue)
+
+    def _cancel(self, playback):
+        with self._cond:
+            if playback is self._current:
+                self._current = None
+                self._chain_time = None
+            elif playback in self._queue:
+                self._queue.remove(playback)
+            else:
+                return
+            self._finish(playback, cancelled=True)
+            self._cond.notify()
+        if playback.timeline.uses_motors:
+            with self._write_lock:
+                self.car.stop()
+
+    def cancel_all(self):
+        with self._cond:
+            playbacks = ([self._current] if self._current else []) + self._queue
+            self._current = None
+            self._queue = []
+            self._chain_time = None
+            for playback in playbacks:
+                self._finish(playback, cancelled=True)
+        if any(p.timeline.uses_motors for p in playbacks):
+            with self._write_lock:
+                self.car.stop()
+
+    @staticmethod
+    def _finish(playback, cancelled=False, error=None):
+        playback.cancelled = cancelled
+        playback.exception = error
+        playback._event.set()
+
+    def _next(self):
+        # highest priority first, fifo within a priority
+        playback = max(self._queue, key=lambda p: p.priority)
+        self._queue.remove(playback)
+        now = time.monotonic()
+        chain = self._chain_time
+        playback.start = chain if chain is not None and chain <= now else now
+        return playback
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if self._current is None:
+                    if not self._queue:
+                        self._chain_time = None
+                        self._cond.wait()
+                        continue
+                    self._current = self._next()
+                playback = self._current
+                timeline = playback.timeline
+                now = time.monotonic()
+                if playback.index >= len(timeline):
+                    end = playback.start + timeline.duration
+                    if now < end:
+                        self._cond.wait(end - now)
+                        continue
+                    self._current = None
+                    self._chain_time = end
+                    self._finish(playback)
+                    continue
+                due = playback.start + timeline.times[playback.index]
+                if now < due:
+                    self._cond.wait(due - now)
+                    continue
+                # every frame that is due, merged into one write per channel
+                merged = {}
+                while playback.index < len(timeline) and playback.start + timeline.times[playback.index] <= now:
+                    merged.update(timeline.frames[playback.index])
+                    playback.index += 1
+            with self._write_lock:
+                with self._cond:
+                    # cancelled or preempted since the frame was picked, its stop() already ran
+                    if self._current is not playback:
+                        continue
+                try:
+                    apply_frame(self.car, tuple((c, merged[c]) for c in CHANNELS if c in merged))
+                except Exception as e:
+                    # end this playback, its waiter gets the error, the queue goes on
+                    print("action_player: %s failed: %s" % (timeline.name, e))
+                    with self._cond:
+                        if self._current is playback:
+                            self._current = None
+                            self._chain_time = None
+                            self._finish(playback, error=e)
+                    if timeline.uses_motors:
+                        try:
+                            self.car.stop()
+                        except Exception as e:
+                            print("action_player: stop failed: %s" % e)
+
+    def close(self):
+        self.cancel_all()
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+'''
+Fixed-rate control loop runner
+
+Ticks callbacks at their target rate against absolute monotonic deadlines,
+so the rate does not drift with the callback's own run time. Several
+tasks with different rates share one thread; each reports overruns and
+the measured start jitter.
+
+    loop = ControlLoop()
+    loop.add(track_face, hz=20)
+    loop.add(send_telemetry, hz=10)
+    loop.run()              # or loop.start() for a background thread
+    print(loop.stats())
+'''
+import time
+import threading
+from .instrument import LatencyHistogram
+
+
+class LoopTask(object):
+    ''' one callback of a ControlLoop '''
+
+    def __init__(self, callback, hz, name=None):
+        if hz <= 0:
+            raise ValueError("hz must be > 0")
+        self.callback = callback
+        self.hz = hz
+        self.period = 1.0 / hz
+        self.name = name or getattr(callback, '__name__', 'task')
+        self.deadline = None
+        self.ticks = 0
+        self.overruns = 0 # callback still running at its next deadline
+        self.skipped = 0  # deadlines dropped after an overrun
+        self.jitter = LatencyHistogram() # ns between deadline and actual start
+        self.busy = 0.0   # seconds spent in the callback
+
+    def stats(self):
+        jitter = self.jitter.summary()
+        return {
+            'hz': self.hz,
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'load': self.busy / (self.ticks * self.period) if self.ticks else 0,
+            'jitter_mean_us': jitter['mean_us'],
+            'jitter_p50_us': jitter['p50_us'],
+            'jitter_p99_us': jitter['p99_us'],
+            'jitter_max_us': jitter['max_us'],
+        }
+
+
+class ControlLoop(object):
+    ''' run callbacks at fixed rates from one thread
+
+    param busy_wait: spin this many seconds before each deadline instead of
+                     sleeping, trades CPU for lower jitter
+    '''
+
+    def __init__(self, name='control_loop', busy_wait=0.0):
+        self.name = name
+        self.busy_wait = busy_wait
+        self.tasks = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, callback, hz, name=None):
+        ''' tick callback() hz times a second, first tick right away '''
+        task = LoopTask(callback, hz, name)
+        with self._lock:
+            self.tasks.append(task)
+        return task
+
+    def remove(self, task):
+        with self._lock:
+            self.tasks.remove(task)
+
+    def _next_task(self):
+        with self._lock:
+            if not self.tasks:
+                return None
+            now = time.monotonic()
+            for task in self.tasks:
+                if task.deadline is None:
+                    task.deadline = now
+            return min(self.tasks, key=lambda t: t.deadline)
+
+    def _wait_until(self, deadline):
+        delay = deadline - time.monotonic() - self.busy_wait
+        if delay > 0 and self._stop.wait(delay):
+            return False
+        while time.monotonic() < deadline:
+            pass
+        return True
+
+    def run(self, duration=None):
+        ''' run in the calling thread until stop(), or for duration seconds '''
+        self._stop.clear()
+        self._run(duration)
+
+    def _run(self, duration=None):
+        end = None if duration is None else time.monotonic() + duration
+        while not self._stop.is_set():
+            task = self._next_task()
+            if task is None:
+                self._stop.wait(0.01)
+                continue
+            if end is not None and task.deadline >= end:
+                self._wait_until(end)
+                break
+            if not self._wait_until(task.deadline):
+                break
+            start = time.monotonic()
+            task.jitter.record(int((start - task.deadline) * 1e9))
+            try:
+                task.callback()
+            finally:
+                done = time.monotonic()
+                task.ticks += 1
+                task.busy += done - start
+                task.deadline += task.period
+                if done > task.deadline:
+                    task.overruns += 1
+                    # drop the deadlines we missed instead of bursting to catch up
+                    missed = int((done - task.deadline) / task.period)
+                    task.skipped += missed
+                    task.deadline += missed * task.period
+
+    def start(self):
+        ''' run in a background thread '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        ''' {task name: {hz, ticks, overruns, skipped, load, jitter_*_us}} '''
+        with self._lock:
+            return {task.name: task.stats() for task in self.tasks}
@@ -1,7 +1,11 @@
-from robot_hat import Pin, ADC, PWM, Servo, fileDB
-from robot_hat import Grayscale_Module, Ultrasonic, utils
+from .backend import load_backend
+from .sampler import Sampler
 import time
 import os
+import json
+import getpass
+import threading
+from contextlib import nullcontext
 
 
 def constrain(x, min_val, max_val):
@@ -10,6 +14,15 @@ def constrain(x, min_val, max_val):
     '''
     return max(min_val, min(max_val, x))
 
+def get_login():
+    '''
+    Login name for config file ownership, os.getlogin() fails without a tty.
+    '''
+    try:
+        return os.getlogin()
+    except OSError:
+        return getpass.getuser()
+
 class Picarx(object):
     CONFIG = '/opt/picar-x/picar-x.conf'
 
@@ -32,66 +45,280 @@ class Picarx(object):
     # grayscale_pins: 3 adc channels
     # ultrasonic_pins: trig, echo2
     # config: path of config file
+    # backend: 'robot_hat', 'sim' or a backend instance, see picarx.backend
+    # write_cache: skip servo/motor writes that would not change the output
+    # fast_start: skip the MCU reset when the board is already initialised and
+    #             create each subsystem on first use, servos are not moved
+    # thread_safe: route all I2C access through one bus thread, see picarx.arbiter
     def __init__(self, 
                 servo_pins:list=['P0', 'P1', 'P2'], 
                 motor_pins:list=['D4', 'D5', 'P13', 'P12'],
                 grayscale_pins:list=['A0', 'A1', 'A2'],
                 ultrasonic_pins:list=['D2','D3'],
                 config:str=CONFIG,
+                backend=None,
+                write_cache:bool=True,
+                fast_start:bool=False,
+                thread_safe:bool=False,
                 ):
 
-        # reset robot_hat
-        utils.reset_mcu()
-        time.sleep(0.2)
+        self._init_lock = threading.RLock() # lazy subsystem creation
+        self.backend = load_backend(backend)
+        self.fast_start = fast_start
+        self._servo_pins = servo_pins
+        self._motor_pins = motor_pins
+        self._grayscale_pins = grayscale_pins
+        self._ultrasonic_pins = ultrasonic_pins
+        self._config_path = config
+
+        # --------- shadow registers ---------
+        # last value written to each output, keyed by pin/servo object
+        self.write_cache = write_cache
+        self._shadow = {}
+        self.writes_issued = 0
+        self.writes_suppressed = 0
+        self.arbiter = None
+        if thread_safe:
+            from .arbiter import BusArbiter
+            self.arbiter = BusArbiter(self.backend, self._write_now)
 
-        # --------- config_flie ---------
-        self.config_flie = fileDB(config, 777, os.getlogin())
+        self.dir_current_angle = 0
+        self.cam_pan_current_angle = 0
+        self.cam_tilt_current_angle = 0
+        self.trajectory = None
+        self.distance_sampler = None
+        self.grayscale_engine = None
+        self.instrumentation = None
+        self._instrumented = [] # (object, attribute, wrapper) wrapped on the instance
+        self.trace = None
+        self._traced = [] # (method, instance attribute it replaced, wrapper)
 
-        # --------- servos init ---------
-        self.cam_pan = Servo(servo_pins[0])
-        self.cam_tilt = Servo(servo_pins[1])   
-        self.dir_servo_pin = Servo(servo_pins[2])
+        # reset robot_hat
+        if not (fast_start and self.backend.mcu_initialised()):
+            self.backend.utils.reset_mcu()
+            time.sleep(0.2)
+            self.backend.mark_mcu_initialised()
+
+        if not fast_start:
+            self._init_config()
+            self._init_servos()
+            self._init_motors()
+            self._init_grayscale()
+            self._init_ultrasonic()
+
+        # PICARX_TRACE=path records any script, see picarx.trace
+        if os.environ.get('PICARX_TRACE'):
+            self.start_trace(os.environ['PICARX_TRACE'])
+
+    # attributes created by each subsystem initialiser, fast_start creates
+    # them on first access through __getattr__
+    _LAZY_ATTRS = {
+        '_init_config': ['config_flie'],
+        '_init_servos': ['cam_pan', 'cam_tilt', 'dir_servo_pin',
+                         'dir_cali_val', 'cam_pan_cali_val', 'cam_tilt_cali_val'],
+        '_init_motors': ['left_rear_dir_pin', 'right_rear_dir_pin', 'left_rear_pwm_pin', 'right_rear_pwm_pin',
+                         'motor_direction_pins', 'motor_speed_pins', 'cali_dir_value', 'cali_speed_value'],
+        '_init_grayscale': ['grayscale', 'grayscale_adcs', 'line_reference', 'cliff_reference'],
+        '_init_ultrasonic': ['ultrasonic'],
+    }
+    _LAZY_INIT = {attr: init for init, attrs in _LAZY_ATTRS.items() for attr in attrs}
+
+    def __getattr__(self, name):
+        # only reached when the attribute does not exist yet
+        init = self._LAZY_INIT.get(name)
+        if init is None:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+        with self._init_lock:
+            # another thread may have created it while we waited
+            if name not in self.__dict__:
+                getattr(self, init)()
+        return object.__getattribute__(self, name)
+
+    def _init_config(self):
+        self.config_flie = self.backend.open_config(self._config_path, 0o777, get_login())
+
+    def _init_servos(self):
+        Servo = self.backend.Servo
+        self.cam_pan = Servo(self._servo_pins[0])
+        self.cam_tilt = Servo(self._servo_pins[1])   
+        self.dir_servo_pin = Servo(self._servo_pins[2])
         # get calibration values
-        self.dir_cali_val = float(self.config_flie.get("picarx_dir_servo", default_value=0))
-        self.cam_pan_cali_val = float(self.config_flie.get("picarx_cam_pan_servo", default_value=0))
-        self.cam_tilt_cali_val = float(self.config_flie.get("picarx_cam_tilt_servo", default_value=0))
-        # set servos to init angle
-        self.dir_servo_pin.angle(self.dir_cali_val)
-        self.cam_pan.angle(self.cam_pan_cali_val)
-        self.cam_tilt.angle(self.cam_tilt_cali_val)
-
-        # --------- motors init ---------
-        self.left_rear_dir_pin = Pin(motor_pins[0])
-        self.right_rear_dir_pin = Pin(motor_pins[1])
-        self.left_rear_pwm_pin = PWM(motor_pins[2])
-        self.right_rear_pwm_pin = PWM(motor_pins[3])
+        self.dir_cali_val = self.config_flie.get("picarx_dir_servo", default_value=0.0)
+        self.cam_pan_cali_val = self.config_flie.get("picarx_cam_pan_servo", default_value=0.0)
+        self.cam_tilt_cali_val = self.config_flie.get("picarx_cam_tilt_servo", default_value=0.0)
+        # set servos to init angle, fast_start leaves them where they are
+        if not self.fast_start:
+            self._write(self.dir_servo_pin, self.dir_cali_val)
+            self._write(self.cam_pan, self.cam_pan_cali_val)
+            self._write(self.cam_tilt, self.cam_tilt_cali_val)
+
+    def _init_motors(self):
+        Pin, PWM = self.backend.Pin, self.backend.PWM
+        self.left_rear_dir_pin = Pin(self._motor_pins[0])
+        self.right_rear_dir_pin = Pin(self._motor_pins[1])
+        self.left_rear_pwm_pin = PWM(self._motor_pins[2])
+        self.right_rear_pwm_pin = PWM(self._motor_pins[3])
         self.motor_direction_pins = [self.left_rear_dir_pin, self.right_rear_dir_pin]
         self.motor_speed_pins = [self.left_rear_pwm_pin, self.right_rear_pwm_pin]
         # get calibration values
-        self.cali_dir_value = self.config_flie.get("picarx_dir_motor", default_value="[1, 1]")
-        self.cali_dir_value = [int(i.strip()) for i in self.cali_dir_value.strip().strip("[]").split(",")]
+        self.cali_dir_value = self.config_flie.get("picarx_dir_motor", default_value=[1, 1])
         self.cali_speed_value = [0, 0]
-        self.dir_current_angle = 0
         # init pwm
         for pin in self.motor_speed_pins:
             pin.period(self.PERIOD)
             pin.prescaler(self.PRESCALER)
 
-        # --------- grayscale module init ---------
-        adc0, adc1, adc2 = [ADC(pin) for pin in grayscale_pins]
-        self.grayscale = Grayscale_Module(adc0, adc1, adc2, reference=None)
+    def _init_grayscale(self):
+        self.grayscale_adcs = [self.backend.ADC(pin) for pin in self._grayscale_pins]
+        adc0, adc1, adc2 = self.grayscale_adcs
+        self.grayscale = self.backend.Grayscale_Module(adc0, adc1, adc2, reference=None)
         # get reference
-        self.line_reference = self.config_flie.get("line_reference", default_value=str(self.DEFAULT_LINE_REF))
-        self.line_reference = [float(i) for i in self.line_reference.strip().strip('[]').split(',')]
-        self.cliff_reference = self.config_flie.get("cliff_reference", default_value=str(self.DEFAULT_CLIFF_REF))
-        self.cliff_reference = [float(i) for i in self.cliff_reference.strip().strip('[]').split(',')]
+        self.line_reference = self.config_flie.get("line_reference", default_value=list(self.DEFAULT_LINE_REF))
+        self.cliff_reference = self.config_flie.get("cliff_reference", default_value=list(self.DEFAULT_CLIFF_REF))
         # transfer reference
         self.grayscale.reference(self.line_reference)
 
-        # --------- ultrasonic init ---------
-        trig, echo= ultrasonic_pins
-        self.ultrasonic = Ultrasonic(Pin(trig), Pin(echo, mode=Pin.IN, pull=Pin.PULL_DOWN))
-        
+    def _init_ultrasonic(self):
+        Pin = self.backend.Pin
+        trig, echo= self._ultrasonic_pins
+        self.ultrasonic = self.backend.Ultrasonic(Pin(trig), Pin(echo, mode=Pin.IN, pull=Pin.PULL_DOWN))
+
+    # methods timed by enable_instrumentation()
+    INSTRUMENTED = [
+        'set_motor_speed', 'set_power', 'forward', 'backward', 'drive', 'stop',
+        'set_dir_servo_angle', 'set_cam_pan_angle', 'set_cam_tilt_angle', 'reset',
+        'get_distance', 'get_grayscale_data', 'get_line_status', 'get_cliff_status',
+    ]
+
+    def enable_instrumentation(self, methods=None):
+        ''' count calls and record latency histograms, see picarx.instrument
+
+        The methods are replaced by timing wrappers on this instance only.
+        Sensor driver reads (ultrasonic.read, grayscale.read) are timed too
+        if those subsystems exist already.
+
+        param methods: method names, default Picarx.INSTRUMENTED
+        '''
+        from .instrument import Instrumentation
+        self.disable_instrumentation()
+        self.instrumentation = Instrumentation()
+        targets = [(self, name, name) for name in methods or self.INSTRUMENTED]
+        for driver in ('ultrasonic', 'grayscale'):
+            if driver in self.__dict__:
+                targets.append((self.__dict__[driver], 'read', driver + '.read'))
+        for obj, attr, name in targets:
+            wrapper = self.instrumentation.wrap(name, getattr(obj, attr))
+            setattr(obj, attr, wrapper)
+            self._instrumented.append((obj, attr, wrapper))
+
+    def disable_instrumentation(self):
+        ''' remove the wrappers, get_instrumentation_stats() keeps the last stats '''
+        for obj, attr, wrapper in self._instrumented:
+            # a trace started later wraps ours, leave its wrapper in place
+            if obj.__dict__.get(attr) is wrapper:
+                obj.__dict__.pop(attr, None)
+        self._instrumented = []
+
+    def get_instrumentation_stats(self):
+        ''' {method: {count, total_ms, mean_us, p50_us, p95_us, p99_us, max_us}} '''
+        if self.instrumentation is None:
+            return {}
+        return self.instrumentation.stats()
+
+    def dump_instrumentation(self, path=None):
+        ''' stats as json, also written to path if given '''
+        data = json.dumps(self.get_instrumentation_stats(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(data)
+        return data
+
+    def reset_instrumentation(self):
+        if self.instrumentation is not None:
+            self.instrumentation.reset()
+
+    def start_trace(self, path, size=4096):
+        ''' record actuator calls and sensor reads to a binary trace, see picarx.trace
+
+        Start it after enable_instrumentation(), if both are wanted.
+
+        param path: trace file, replay it with picarx.trace.replay()
+        param size: records per preallocated buffer
+        '''
+        from .trace import TraceRecorder, OPS
+        self.stop_trace()
+        self.trace = TraceRecorder(path, size)
+        for name, _, _ in OPS:
+            wrapper = self.trace.wrap(name, getattr(self, name))
+            self._traced.append((name, self.__dict__.get(name), wrapper))
+            setattr(self, name, wrapper)
+
+    def stop_trace(self):
+        ''' restore the methods and flush the trace file '''
+        for name, previous, wrapper in self._traced:
+            # wrapped again since (enable_instrumentation()), that owner restores it;
+            # our wrapper stays inside and records nothing once the trace is closed
+            if self.__dict__.get(name) is not wrapper:
+                continue
+            if previous is None:
+                self.__dict__.pop(name, None)
+            else:
+                self.__dict__[name] = previous
+        self._traced = []
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def _write(self, output, value, force=False):
+        ''' write an output through the shadow registers
+
+        param output: direction Pin (value 0/1), motor PWM (percent) or Servo (angle)
+        param value: value to write
+        param force: write even if the shadow says the output already holds value
+        '''
+        if self.arbiter is not None:
+            self.arbiter.write(output, value, force)
+        else:
+            self._write_now(output, value, force)
+
+    def _write_now(self, output, value, force=False):
+        # with thread_safe only the bus thread gets here
+        if not force and self.write_cache and self._shadow.get(output) == value:
+            self.writes_suppressed += 1
+            return
+        if isinstance(output, self.backend.Servo):
+            output.angle(value)
+        elif isinstance(output, self.backend.PWM):
+            output.pulse_width_percent(value)
+        else:
+            output.value(value)
+        self._shadow[output] = value
+        self.writes_issued += 1
+
+    def transaction(self):
+        ''' context manager, the writes inside go out together in one bus transaction '''
+        if self.arbiter is not None:
+            return self.arbiter.batch()
+        return self.backend.transaction()
+
+    def _batch(self):
+        # group a method's writes with thread_safe, changes nothing otherwise
+        if self.arbiter is not None:
+            return self.arbiter.batch()
+        return nullcontext()
+
+    def refresh(self):
+        '''
+        Re-send every cached output value, use it after something wrote to
+        the pins behind Picarx's back (or the MCU was reset).
+        '''
+        for output, value in list(self._shadow.items()):
+            self._write(output, value, force=True)
+
+    def reset_write_stats(self):
+        self.writes_issued = 0
+        self.writes_suppressed = 0
+
     def set_motor_speed(self, motor, speed):
         ''' set motor speed
         
@@ -100,6 +327,16 @@ class Picarx(object):
         param speed: speed
         type speed: int      
         '''
+        direction_pin, speed_pin, direction, speed = self._motor_outputs(motor, speed)
+        with self._batch():
+            self._write(direction_pin, direction)
+            self._write(speed_pin, speed)
+
+    def _motor_outputs(self, motor, speed):
+        ''' direction pin and pwm values for set_motor_speed(motor, speed)
+
+        return: (direction pin, speed pin, direction pin value, pwm percent)
+        '''
         speed = constrain(speed, -100, 100)
         motor -= 1
         if speed >= 0:
@@ -111,12 +348,8 @@ class Picarx(object):
         if speed != 0:
             speed = int(speed /2 ) + 50
         speed = speed - self.cali_speed_value[motor]
-        if direction < 0:
-            self.motor_direction_pins[motor].high()
-            self.motor_speed_pins[motor].pulse_width_percent(speed)
-        else:
-            self.motor_direction_pins[motor].low()
-            self.motor_speed_pins[motor].pulse_width_percent(speed)
+        return (self.motor_direction_pins[motor], self.motor_speed_pins[motor],
+                1 if direction < 0 else 0, speed)
 
     def motor_speed_calibration(self, value):
         self.cali_speed_value = value
@@ -144,37 +377,62 @@ class Picarx(object):
 
     def dir_servo_calibrate(self, value):
         self.dir_cali_val = value
-        self.config_flie.set("picarx_dir_servo", "%s"%value)
-        self.dir_servo_pin.angle(value)
+        self.config_flie.set("picarx_dir_servo", value)
+        self._write(self.dir_servo_pin, value)
 
     def set_dir_servo_angle(self, value):
         self.dir_current_angle = constrain(value, self.DIR_MIN, self.DIR_MAX)
         angle_value  = self.dir_current_angle + self.dir_cali_val
-        self.dir_servo_pin.angle(angle_value)
+        self._write(self.dir_servo_pin, angle_value)
 
     def cam_pan_servo_calibrate(self, value):
         self.cam_pan_cali_val = value
-        self.config_flie.set("picarx_cam_pan_servo", "%s"%value)
-        self.cam_pan.angle(value)
+        self.config_flie.set("picarx_cam_pan_servo", value)
+        self._write(self.cam_pan, value)
 
     def cam_tilt_servo_calibrate(self, value):
         self.cam_tilt_cali_val = value
-        self.config_flie.set("picarx_cam_tilt_servo", "%s"%value)
-        self.cam_tilt.angle(value)
+        self.config_flie.set("picarx_cam_tilt_servo", value)
+        self._write(self.cam_tilt, value)
 
     def set_cam_pan_angle(self, value):
         value = constrain(value, self.CAM_PAN_MIN, self.CAM_PAN_MAX)
-        self.cam_pan.angle(-1*(value + -1*self.cam_pan_cali_val))
+        self.cam_pan_current_angle = value
+        self._write(self.cam_pan, -1*(value + -1*self.cam_pan_cali_val))
 
     def set_cam_tilt_angle(self,value):
         value = constrain(value, self.CAM_TILT_MIN, self.CAM_TILT_MAX)
-        self.cam_tilt.angle(-1*(value + -1*self.cam_tilt_cali_val))
+        self.cam_tilt_current_angle = value
+        self._write(self.cam_tilt, -1*(value + -1*self.cam_tilt_cali_val))
+
+    def move_servos(self, duration, easing='ease_in_out', dir=None, pan=None, tilt=None):
+        ''' move servos smoothly in the background, see picarx.trajectory
+
+        param duration: seconds
+        param easing: 'linear', 'ease_in', 'ease_out', 'ease_in_out', 'step' or a function
+        param dir: direction servo target angle, None leaves it alone
+        param pan: camera pan target angle
+        param tilt: camera tilt target angle
+        return: MotionHandle, wait(), await or cancel() it
+        '''
+        if self.trajectory is None:
+            from .trajectory import TrajectoryEngine
+            self.trajectory = TrajectoryEngine(self)
+        targets = {name: angle for name, angle in (('dir', dir), ('pan', pan), ('tilt', tilt))
+                   if angle is not None}
+        return self.trajectory.move(duration, easing, **targets)
+
+    def stop_servo_motion(self):
+        ''' cancel every move_servos() move, servos stay where they are '''
+        if self.trajectory is not None:
+            self.trajectory.cancel_all()
 
     def set_power(self, speed):
         self.set_motor_speed(1, speed)
         self.set_motor_speed(2, speed)
 
-    def backward(self, speed):
+    def _backward_speeds(self, speed):
+        ''' left and right motor speed of backward(speed) at the current steering angle '''
         current_angle = self.dir_current_angle
         if current_angle != 0:
             abs_current_angle = abs(current_angle)
@@ -182,16 +440,14 @@ class Picarx(object):
                 abs_current_angle = self.DIR_MAX
             power_scale = (100 - abs_current_angle) / 100.0 
             if (current_angle / abs_current_angle) > 0:
-                self.set_motor_speed(1, -1*speed)
-                self.set_motor_speed(2, speed * power_scale)
+                return -1*speed, speed * power_scale
             else:
-                self.set_motor_speed(1, -1*speed * power_scale)
-                self.set_motor_speed(2, speed )
+                return -1*speed * power_scale, speed
         else:
-            self.set_motor_speed(1, -1*speed)
-            self.set_motor_speed(2, speed)  
+            return -1*speed, speed
 
-    def forward(self, speed):
+    def _forward_speeds(self, speed):
+        ''' left and right motor speed of forward(speed) at the current steering angle '''
         current_angle = self.dir_current_angle
         if current_angle != 0:
             abs_current_angle = abs(current_angle)
@@ -199,38 +455,195 @@ class Picarx(object):
                 abs_current_angle = self.DIR_MAX
             power_scale = (100 - abs_current_angle) / 100.0
             if (current_angle / abs_current_angle) > 0:
-                self.set_motor_speed(1, 1*speed * power_scale)
-                self.set_motor_speed(2, -speed) 
+                return 1*speed * power_scale, -speed
             else:
-                self.set_motor_speed(1, speed)
-                self.set_motor_speed(2, -1*speed * power_scale)
+                return speed, -1*speed * power_scale
         else:
-            self.set_motor_speed(1, speed)
-            self.set_motor_speed(2, -1*speed)                  
+            return speed, -1*speed
+
+    def backward(self, speed):
+        left, right = self._backward_speeds(speed)
+        with self._batch():
+            self.set_motor_speed(1, left)
+            self.set_motor_speed(2, right)
+
+    def forward(self, speed):
+        left, right = self._forward_speeds(speed)
+        with self._batch():
+            self.set_motor_speed(1, left)
+            self.set_motor_speed(2, right)
+
+    def drive(self, speed, steer, pan=None, tilt=None):
+        ''' steer, drive and optionally aim the camera in one bus transaction
+
+        The whole actuator state is computed first (including the forward/
+        backward power_scale differential), then only the changed outputs
+        are flushed together.
+
+        param speed: -100~100, positive drives forward, negative backward
+        param steer: direction servo angle
+        param pan: camera pan angle, None keeps the current one
+        param tilt: camera tilt angle, None keeps the current one
+        '''
+        self.dir_current_angle = constrain(steer, self.DIR_MIN, self.DIR_MAX)
+        if speed >= 0:
+            left, right = self._forward_speeds(speed)
+        else:
+            left, right = self._backward_speeds(-speed)
+
+        state = []
+        for motor, motor_speed in ((1, left), (2, right)):
+            direction_pin, speed_pin, direction, pwm = self._motor_outputs(motor, motor_speed)
+            state.append((direction_pin, direction))
+            state.append((speed_pin, pwm))
+        state.append((self.dir_servo_pin, self.dir_current_angle + self.dir_cali_val))
+        if pan is not None:
+            pan = constrain(pan, self.CAM_PAN_MIN, self.CAM_PAN_MAX)
+            self.cam_pan_current_angle = pan
+            state.append((self.cam_pan, -1*(pan + -1*self.cam_pan_cali_val)))
+        if tilt is not None:
+            tilt = constrain(tilt, self.CAM_TILT_MIN, self.CAM_TILT_MAX)
+            self.cam_tilt_current_angle = tilt
+            state.append((self.cam_tilt, -1*(tilt + -1*self.cam_tilt_cali_val)))
+
+        with self.transaction():
+            for output, value in state:
+                self._write(output, value)
 
     def stop(self):
         '''
-        Execute twice to make sure it stops
+        Execute twice to make sure it stops, skipped when both motors
+        were already stopped this way
+        '''
+        # with thread_safe the check runs on the bus in queue order, so a
+        # forward() another thread queued before this stop() is seen; inside
+        # a transaction() the block's own writes are not queued yet, never skip
+        if self.arbiter is not None and self.arbiter.batching():
+            stopped = self._stop_motors(False)
+        elif self.arbiter is not None:
+            stopped = self.arbiter.call(self._stop_motors, True)
+        else:
+            stopped = self._stop_motors(True)
+        if not stopped:
+            return
+        time.sleep(0.002)
+        self._stop_motors(False)
+        time.sleep(0.002)
+
+    def _stop_motors(self, skip_stopped):
+        # both motor PWMs to 0, False when skipped because the shadow says they are
+        if skip_stopped and self.write_cache and all(self._shadow.get(pin) == 0 for pin in self.motor_speed_pins):
+            self.writes_suppressed += 2
+            return False
+        self._write(self.motor_speed_pins[0], 0, force=True)
+        self._write(self.motor_speed_pins[1], 0, force=True)
+        return True
+
+    def emergency_stop(self):
+        '''
+        Both motor PWMs to 0 in one bus transaction, for watchdogs: no
+        repeat and no sleep, and never skipped by the write cache
         '''
-        for _ in range(2):
-            self.motor_speed_pins[0].pulse_width_percent(0)
-            self.motor_speed_pins[1].pulse_width_percent(0)
-            time.sleep(0.002)
+        with self.transaction():
+            self._write(self.motor_speed_pins[0], 0, force=True)
+            self._write(self.motor_speed_pins[1], 0, force=True)
 
     def get_distance(self):
+        '''
+        Distance in cm. While the distance sampler runs this is the newest
+        sample and never blocks, otherwise the ultrasonic is read inline.
+        '''
+        if self.distance_sampler is not None:
+            sample = self.distance_sampler.latest()
+            return -1 if sample is None else sample[1]
         return self.ultrasonic.read()
 
+    def start_distance_sampler(self, hz=20, size=64):
+        ''' read the ultrasonic in a background thread
+
+        Waits for the first sample. Don't call ultrasonic.read() yourself
+        while the sampler runs, use get_distance().
+
+        param hz: trigger rate, every read takes up to ~0.2 s with nothing in range
+        param size: number of samples kept for get_distance_samples()
+        '''
+        if self.distance_sampler is not None:
+            return
+        sampler = Sampler(self.ultrasonic.read, hz, size, name='distance_sampler')
+        sampler.start()
+        self.distance_sampler = sampler
+
+    def stop_distance_sampler(self):
+        if self.distance_sampler is not None:
+            self.distance_sampler.stop()
+            self.distance_sampler = None
+
+    def get_distance_samples(self, n=None):
+        ''' up to n newest (monotonic timestamp, distance) samples, oldest first '''
+        if self.distance_sampler is None:
+            raise RuntimeError("distance sampler is not running, call start_distance_sampler()")
+        return self.distance_sampler.last(n)
+
+    def get_distance_age(self):
+        ''' seconds since the newest distance sample '''
+        if self.distance_sampler is None:
+            raise RuntimeError("distance sampler is not running, call start_distance_sampler()")
+        return self.distance_sampler.age()
+
     def set_grayscale_reference(self, value):
         if isinstance(value, list) and len(value) == 3:
             self.line_reference = value
             self.grayscale.reference(self.line_reference)
             self.config_flie.set("line_reference", self.line_reference)
+            if self.grayscale_engine is not None:
+                self.grayscale_engine.set_references(line_reference=value)
         else:
             raise ValueError("grayscale reference must be a 1*3 list")
 
     def get_grayscale_data(self):
+        '''
+        Grayscale values of the 3 channels. While the grayscale engine runs
+        these are its newest (smoothed) values and the ADC is not read.
+        '''
+        if self.grayscale_engine is not None:
+            return self.grayscale_engine.values().tolist()
+        if self.arbiter is not None:
+            return list.copy(self.arbiter.call(self.grayscale.read))
         return list.copy(self.grayscale.read())
 
+    def start_grayscale_engine(self, hz=200, size=256, smoothing=None, window=5, alpha=0.3):
+        ''' sample the grayscale module in the background, see picarx.grayscale
+
+        Waits for the first sample, needs numpy.
+
+        param hz: sample rate, 3 ADC reads per sample
+        param size: samples kept in the ring buffer
+        param smoothing: None, 'median' or 'ema'
+        param window: median window in samples
+        param alpha: ema weight of the newest sample
+        '''
+        if self.grayscale_engine is not None:
+            return
+        from .grayscale import GrayscaleEngine
+        adcs = self.grayscale_adcs
+        if self.arbiter is not None:
+            adcs = [self.arbiter.wrap(adc) for adc in adcs]
+        engine = GrayscaleEngine(adcs, self.line_reference, self.cliff_reference,
+                                 hz, size, smoothing, window, alpha)
+        engine.start()
+        self.grayscale_engine = engine
+
+    def get_grayscale_age(self):
+        ''' seconds since the newest grayscale sample, read errors leave it growing '''
+        if self.grayscale_engine is None:
+            raise RuntimeError("grayscale engine is not running, call start_grayscale_engine()")
+        return self.grayscale_engine.age()
+
+    def stop_grayscale_engine(self):
+        if self.grayscale_engine is not None:
+            self.grayscale_engine.stop()
+            self.grayscale_engine = None
+
     def get_line_status(self,gm_val_list):
         return self.grayscale.read_status(gm_val_list)
 
@@ -247,6 +660,8 @@ class Picarx(object):
         if isinstance(value, list) and len(value) == 3:
             self.cliff_reference = value
             self.config_flie.set("cliff_reference", self.cliff_reference)
+            if self.grayscale_engine is not None:
+                self.grayscale_engine.set_references(cliff_reference=value)
         else:
             raise ValueError("grayscale reference must be a 1*3 list")
 
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+'''
+Background sensor sampler
+
+Calls a blocking read function at a fixed rate in its own thread and keeps
+the last results in a timestamped ring buffer, so control loops can take
+the newest value without waiting on the sensor.
+
+    sampler = Sampler(px.ultrasonic.read, hz=20)
+    sampler.start()
+    timestamp, distance = sampler.latest()
+'''
+import time
+import threading
+
+
+class Sampler(object):
+    ''' sample read() at hz into a ring buffer of size entries
+
+    param read: function taking no arguments, returns one sample
+    param hz: sample rate
+    param size: number of samples kept
+    '''
+
+    def __init__(self, read, hz=20, size=64, name='sampler'):
+        self.read = read
+        self.hz = hz
+        self.size = size
+        self.name = name
+        self._buffer = [None] * size # (monotonic timestamp, value)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._first = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.errors = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def count(self):
+        ''' samples taken since start '''
+        return self._count
+
+    def start(self, timeout=1.0):
+        ''' start sampling, wait up to timeout for the first sample '''
+        if self.running:
+            return
+        self._stop.clear()
+        self._first.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self._first.wait(timeout)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        period = 1.0 / self.hz
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                value = self.read()
+            except Exception as e:
+                self.errors += 1
+                print("%s: read error: %s" % (self.name, e))
+            else:
+                with self._lock:
+                    self._buffer[self._count % self.size] = (time.monotonic(), value)
+                    self._count += 1
+                self._first.set()
+            deadline += period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                # slower than hz, start over instead of bursting to catch up
+                deadline = time.monotonic()
+
+    def latest(self):
+        ''' (timestamp, value) of the newest sample, None before the first one '''
+        with self._lock:
+            if self._count == 0:
+                return None
+            return self._buffer[(self._count - 1) % self.size]
+
+    def last(self, n=None):
+        ''' up to n newest samples as (timestamp, value), oldest first '''
+        with self._lock:
+            available = min(self._count, self.size)
+            n = available if n is None else min(n, available)
+            return [self._buffer[i % self.size] for i in range(self._count - n, self._count)]
+
+    def age(self):
+        ''' seconds since the newest sample, None before the first one '''
+        sample = self.latest()
+        if sample is None:
+            return None
+        return time.monotonic() - sample[0]
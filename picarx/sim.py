@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+'''
+Simulated robot_hat drivers
+
+Drop-in stand-ins for the robot_hat classes used by Picarx, so the library
+can run and be timed without a car. The simulation models:
+
+- I2C write latency for every PWM / servo register write, a transaction
+  is one block write: full latency once, then 2 data bytes per register
+- ADC read latency (register select + 2 byte read)
+- ultrasonic echo timing for the distance set on the backend
+
+Every register and GPIO write is recorded on SimBus.writes.
+
+    px = Picarx(backend='sim')
+    px.backend.distance = 25.0
+    px.backend.adc_values = [1200, 300, 1200]
+    px.forward(30)
+    print(px.backend.bus.writes)
+'''
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from .config import Config
+
+# 100 kHz I2C: addr + reg + 2 data bytes, plus the smbus syscall
+I2C_WRITE_LATENCY = 0.0004
+# each further register inside a block write, 2 data bytes
+I2C_BATCH_LATENCY = 0.0002
+# register select write followed by a 2 byte read
+ADC_READ_LATENCY = 0.0008
+GPIO_LATENCY = 0.000005
+
+SOUND_SPEED = 343.3 # m/s
+
+I2C = 'i2c'
+GPIO = 'gpio'
+
+BusWrite = namedtuple('BusWrite', ['time', 'bus', 'register', 'value'])
+
+
+def spin(seconds):
+    ''' busy wait, time.sleep() is too coarse below a millisecond '''
+    if seconds <= 0:
+        return
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def mapping(x, in_min, in_max, out_min, out_max):
+    return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+
+
+class SimBus(object):
+    ''' register file shared by all simulated drivers of one backend '''
+
+    def __init__(self, write_latency=I2C_WRITE_LATENCY, read_latency=ADC_READ_LATENCY,
+                 gpio_latency=GPIO_LATENCY, batch_latency=I2C_BATCH_LATENCY):
+        self.write_latency = write_latency
+        self.read_latency = read_latency
+        self.gpio_latency = gpio_latency
+        self.batch_latency = batch_latency
+        self.registers = {}
+        self.writes = []
+        self.read_count = 0
+        self.transaction_count = 0 # i2c transactions, a block write counts once
+        self._batch_depth = 0
+        self._batch_open = False
+
+    @contextmanager
+    def transaction(self):
+        ''' i2c writes inside the block go out as one block write '''
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._batch_open = False
+
+    def write(self, bus, register, value):
+        if bus != I2C:
+            spin(self.gpio_latency)
+        elif self._batch_open:
+            spin(self.batch_latency)
+        else:
+            spin(self.write_latency)
+            self.transaction_count += 1
+            self._batch_open = self._batch_depth > 0
+        self.registers[(bus, register)] = value
+        self.writes.append(BusWrite(time.monotonic(), bus, register, value))
+
+    def read(self, bus, register):
+        if bus == I2C:
+            spin(self.read_latency)
+        self.read_count += 1
+
+    def i2c_writes(self):
+        return [w for w in self.writes if w.bus == I2C]
+
+    def clear(self):
+        ''' forget recorded writes and reads, keep register values '''
+        self.writes = []
+        self.read_count = 0
+        self.transaction_count = 0
+
+    def reset(self):
+        self.registers.clear()
+        self.clear()
+
+
+class SimPin(object):
+    OUT = 0x01
+    IN = 0x02
+    PULL_UP = 0x11
+    PULL_DOWN = 0x12
+    PULL_NONE = None
+
+    _backend = None
+
+    def __init__(self, pin, mode=None, pull=None):
+        self._pin = pin
+        self._mode = mode
+        self._pull = pull
+        self._value = 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+        self._backend.bus.write(GPIO, self._pin, self._value)
+        return self._value
+
+    def on(self):
+        return self.value(1)
+
+    def off(self):
+        return self.value(0)
+
+    def high(self):
+        return self.on()
+
+    def low(self):
+        return self.off()
+
+
+class SimPWM(object):
+    REG_CHN = 0x20
+    REG_PSC = 0x40
+    REG_ARR = 0x44
+
+    _backend = None
+
+    def __init__(self, channel, address=None):
+        if isinstance(channel, str):
+            channel = int(channel[1:])
+        self.channel = channel
+        self.timer_index = channel // 4
+        self._pulse_width = 0
+        self._pulse_width_percent = 0
+
+    def _timer(self):
+        return self._backend.timers.setdefault(self.timer_index, {'arr': 4095, 'psc': 0})
+
+    def period(self, arr=None):
+        if arr is None:
+            return self._timer()['arr']
+        arr = int(arr)
+        self._timer()['arr'] = arr
+        self._backend.bus.write(I2C, self.REG_ARR + self.timer_index, arr)
+
+    def prescaler(self, prescaler=None):
+        if prescaler is None:
+            return self._timer()['psc']
+        prescaler = int(prescaler)
+        self._timer()['psc'] = prescaler
+        self._backend.bus.write(I2C, self.REG_PSC + self.timer_index, prescaler - 1)
+
+    def pulse_width(self, pulse_width=None):
+        if pulse_width is None:
+            return self._pulse_width
+        self._pulse_width = int(pulse_width)
+        self._backend.bus.write(I2C, self.REG_CHN + self.channel, self._pulse_width)
+
+    def pulse_width_percent(self, pulse_width_percent=None):
+        if pulse_width_percent is None:
+            return self._pulse_width_percent
+        self._pulse_width_percent = pulse_width_percent
+        self.pulse_width(pulse_width_percent / 100.0 * self._timer()['arr'])
+
+
+class SimServo(SimPWM):
+    MAX_PW = 2500
+    MIN_PW = 500
+    FREQ = 50
+    PERIOD = 4095
+    CLOCK = 72000000
+
+    def __init__(self, channel, address=None):
+        super().__init__(channel, address)
+        self.period(self.PERIOD)
+        self.prescaler(self.CLOCK / self.FREQ / self.PERIOD)
+
+    def angle(self, angle):
+        if not isinstance(angle, (int, float)):
+            raise ValueError("Angle value should be int or float value, not %s" % type(angle))
+        angle = max(-90, min(90, angle))
+        self.pulse_width_time(mapping(angle, -90, 90, self.MIN_PW, self.MAX_PW))
+
+    def pulse_width_time(self, pulse_width_time):
+        pulse_width_time = max(self.MIN_PW, min(self.MAX_PW, pulse_width_time))
+        self.pulse_width(int(pulse_width_time / 20000 * self.PERIOD))
+
+
+class SimADC(object):
+    REG_ADC = 0x10
+
+    _backend = None
+
+    def __init__(self, chn, address=None):
+        if isinstance(chn, str):
+            chn = int(chn[1:])
+        self.chn = chn
+
+    def read(self):
+        self._backend.bus.read(I2C, self.REG_ADC | (7 - self.chn))
+        return int(self._backend.adc_values[self.chn])
+
+    def read_voltage(self):
+        return self.read() * 3.3 / 4095
+
+
+class SimGrayscale_Module(object):
+    LEFT = 0
+    MIDDLE = 1
+    RIGHT = 2
+
+    def __init__(self, pin0, pin1, pin2, reference=None):
+        self.pins = (pin0, pin1, pin2)
+        self._reference = reference
+
+    def reference(self, ref=None):
+        if ref is not None:
+            if not (isinstance(ref, list) and len(ref) == 3):
+                raise ValueError("Reference value must be a 1*3 list.")
+            self._reference = ref
+        return self._reference
+
+    def read_status(self, datas=None):
+        if self._reference is None:
+            raise ValueError("Reference value is not set")
+        if datas is None:
+            datas = self.read()
+        return [0 if data > self._reference[i] else 1 for i, data in enumerate(datas)]
+
+    def read(self, channel=None):
+        if channel is None:
+            return [pin.read() for pin in self.pins]
+        return self.pins[channel].read()
+
+
+class SimUltrasonic(object):
+    ''' echo timing follows the backend distance, None means nothing in range '''
+    TRIGGER_SETTLE = 0.001
+    TRIGGER_PULSE = 0.00001
+    ECHO_DELAY = 0.0005 # 8 cycle 40 kHz burst before the echo pin rises
+
+    _backend = None
+
+    def __init__(self, trig, echo, timeout=0.02):
+        self.trig = trig
+        self.echo = echo
+        self.timeout = timeout
+
+    def _read(self):
+        self.trig.off()
+        spin(self.TRIGGER_SETTLE)
+        self.trig.on()
+        spin(self.TRIGGER_PULSE)
+        self.trig.off()
+        distance = self._backend.distance
+        if distance is None:
+            spin(self.timeout)
+            return -1
+        during = distance * 2 / 100 / SOUND_SPEED
+        if self.ECHO_DELAY + during > self.timeout:
+            spin(self.timeout)
+            return -1
+        spin(self.ECHO_DELAY + during)
+        return round(during * SOUND_SPEED / 2 * 100, 2)
+
+    def read(self, times=10):
+        for _ in range(times):
+            a = self._read()
+            if a != -1:
+                return a
+        return -1
+
+
+class SimUtils(object):
+    RESET_TIME = 0.02
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def reset_mcu(self):
+        bus = self._backend.bus
+        bus.write(GPIO, 'MCURST', 0)
+        spin(self.RESET_TIME / 2)
+        bus.write(GPIO, 'MCURST', 1)
+        spin(self.RESET_TIME / 2)
+        self._backend.timers.clear()
+        bus.registers = {k: v for k, v in bus.registers.items() if k[0] != I2C}
+
+
+class SimBackend(object):
+    ''' simulated robot_hat, driver classes are bound to this instance '''
+    NAME = 'sim'
+
+    def __init__(self, write_latency=I2C_WRITE_LATENCY, read_latency=ADC_READ_LATENCY,
+                 gpio_latency=GPIO_LATENCY, batch_latency=I2C_BATCH_LATENCY):
+        self.bus = SimBus(write_latency, read_latency, gpio_latency, batch_latency)
+        self.timers = {}
+        self.configs = {}
+        # world state read by the sensors
+        self.distance = 100.0
+        self.adc_values = [1500, 1500, 1500, 0, 0, 0, 0, 0]
+        self.mcu_ready = False
+
+        bound = {'_backend': self}
+        self.Pin = type('Pin', (SimPin,), bound)
+        self.ADC = type('ADC', (SimADC,), bound)
+        self.PWM = type('PWM', (SimPWM,), bound)
+        self.Servo = type('Servo', (SimServo,), bound)
+        self.Grayscale_Module = SimGrayscale_Module
+        self.Ultrasonic = type('Ultrasonic', (SimUltrasonic,), bound)
+        self.utils = SimUtils(self)
+
+    def open_config(self, path, mode=None, owner=None):
+        ''' in-memory config, one per path for the life of the backend '''
+        return self.configs.setdefault(path, Config(None))
+
+    def transaction(self):
+        return self.bus.transaction()
+
+    def mcu_initialised(self):
+        return self.mcu_ready
+
+    def mark_mcu_initialised(self):
+        self.mcu_ready = True
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+'''
+Actuator / sensor trace recorder and replay
+
+Picarx.start_trace() records every actuator call and every sensor read
+result into a compact binary file. Records are packed into preallocated
+buffers and written to disk by a background thread, so the caller never
+waits for the file.
+
+    px.start_trace('session.pxtr')
+    ...
+    px.stop_trace()         # or set PICARX_TRACE=path to record any script
+
+    # later, on the car or on the simulator
+    px = Picarx(backend='sim')
+    print(replay('session.pxtr', px, speed=None))   # None: as fast as possible
+
+On the sim backend replay also feeds the recorded sensor values into the
+simulated sensors, so the session is reproduced exactly.
+
+    python3 -m picarx.trace dump session.pxtr
+    python3 -m picarx.trace replay session.pxtr [--fast] [--real]
+
+File format, little endian: a header (magic 'PXTR', version, record size,
+wall clock and monotonic start time), then fixed size records of
+(seconds since start float64, op uint8, 3 pad, 4 float32 values).
+Unused values and None arguments are NaN.
+'''
+import os
+import math
+import atexit
+import time
+import inspect
+import queue
+import struct
+import threading
+from .instrument import LatencyHistogram
+
+MAGIC = b'PXTR'
+VERSION = 1
+HEADER = struct.Struct('<4sHHdd')
+RECORD = struct.Struct('<dB3x4f')
+NAN = float('nan')
+
+ACTUATOR = 'actuator'
+SENSOR = 'sensor'
+
+# op code: (method, kind, number of values), never renumber, only append
+OPS = [
+    ('set_motor_speed', ACTUATOR, 2),
+    ('set_power', ACTUATOR, 1),
+    ('forward', ACTUATOR, 1),
+    ('backward', ACTUATOR, 1),
+    ('drive', ACTUATOR, 4),
+    ('stop', ACTUATOR, 0),
+    ('set_dir_servo_angle', ACTUATOR, 1),
+    ('set_cam_pan_angle', ACTUATOR, 1),
+    ('set_cam_tilt_angle', ACTUATOR, 1),
+    ('reset', ACTUATOR, 0),
+    ('get_distance', SENSOR, 1),
+    ('get_grayscale_data', SENSOR, 3),
+]
+OP_CODES = {name: code for code, (name, _, _) in enumerate(OPS)}
+
+
+def _floats(values, n):
+    out = [NAN] * 4
+    for i in range(min(n, len(values))):
+        if values[i] is not None:
+            out[i] = values[i]
+    return out
+
+
+class TraceRecorder(object):
+    ''' binary trace writer with preallocated buffers and a flush thread
+
+    param path: trace file
+    param size: records per buffer
+    param buffers: buffers in the pool; when all are waiting for the disk,
+                   new records are counted in dropped instead of blocking
+    '''
+
+    def __init__(self, path, size=4096, buffers=4):
+        self.path = path
+        self.size = size
+        self._file = open(path, 'wb')
+        self.start = time.monotonic()
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, time.time(), self.start))
+        self._free = queue.Queue()
+        for _ in range(buffers - 1):
+            self._free.put(bytearray(size * RECORD.size))
+        self._full = queue.Queue()
+        self._buffer = bytearray(size * RECORD.size)
+        self._index = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.records = 0
+        self.dropped = 0
+        self.closed = False
+        self._thread = threading.Thread(target=self._flush, name='trace_flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, op, values, t=None):
+        ''' append one record, values are up to 4 numbers or None
+
+        param t: monotonic time of the call, default now
+        '''
+        t = (time.monotonic() if t is None else t) - self.start
+        with self._lock:
+            if self.closed:
+                return
+            if self._index == self.size:
+                try:
+                    buffer = self._free.get_nowait()
+                except queue.Empty:
+                    self.dropped += 1
+                    return
+                self._full.put((self._buffer, self._index))
+                self._buffer = buffer
+                self._index = 0
+            RECORD.pack_into(self._buffer, self._index * RECORD.size, t, op, *values)
+            self._index += 1
+            self.records += 1
+
+    def wrap(self, name, func):
+        ''' wrapper recording calls of a Picarx method, nested calls are not recorded '''
+        op = OP_CODES[name]
+        _, kind, n = OPS[op]
+        local = self._local
+        record = self.record
+        signature = inspect.signature(func)
+
+        def traced(*args, **kwargs):
+            depth = getattr(local, 'depth', 0)
+            local.depth = depth + 1
+            called = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                local.depth = depth
+            if depth == 0:
+                if kind == SENSOR:
+                    record(op, _floats(result if isinstance(result, (list, tuple)) else [result], n), called)
+                else:
+                    if kwargs:
+                        bound = signature.bind(*args, **kwargs)
+                        bound.apply_defaults()
+                        args = list(bound.arguments.values())
+                    record(op, _floats(args, n), called)
+            return result
+        traced.__name__ = name
+        return traced
+
+    def _flush(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                return
+            buffer, count = item
+            self._file.write(memoryview(buffer)[:count * RECORD.size])
+            self._free.put(buffer)
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._full.put((self._buffer, self._index))
+        self._full.put(None)
+        self._thread.join()
+        self._file.close()
+
+
+def read_trace(path):
+    ''' header dict and a list of (seconds, method, values) records '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError("%s: not a trace file" % path)
+    magic, version, record_size, wall_start, start = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("%s: not a trace file" % path)
+    if version != VERSION or record_size != RECORD.size:
+        raise ValueError("%s: unsupported trace version %d" % (path, version))
+    header = {'version': version, 'wall_start': wall_start, 'start': start}
+    records = []
+    for t, op, *values in RECORD.iter_unpack(memoryview(data)[HEADER.size:]):
+        name, _, n = OPS[op]
+        records.append((t, name, [None if math.isnan(v) else v for v in values[:n]]))
+    return header, records
+
+
+def replay(path, car, speed=1.0):
+    ''' play a trace back on a Picarx
+
+    Actuator calls are repeated with their recorded arguments, sensor reads
+    are repeated too (the bus traffic is part of the session). On the sim
+    backend the recorded sensor values are fed to the simulated sensors first.
+
+    param speed: 1.0 for real time, 2.0 twice as fast, None as fast as possible
+    return: stats dict, lateness is how far calls started after their recorded time
+    '''
+    _, records = read_trace(path)
+    backend = car.backend
+    sim = hasattr(backend, 'adc_values') and hasattr(backend, 'distance')
+    late = LatencyHistogram()
+    counts = {}
+    mismatches = 0
+    start = time.monotonic()
+    for t, name, values in records:
+        if speed:
+            due = start + t / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            late.record(max(0, int((time.monotonic() - due) * 1e9)))
+        counts[name] = counts.get(name, 0) + 1
+        _, kind, _ = OPS[OP_CODES[name]]
+        if kind == ACTUATOR:
+            if name == 'set_motor_speed':
+                values[0] = int(values[0])
+            getattr(car, name)(*values)
+            continue
+        if sim:
+            if name == 'get_distance':
+                backend.distance = None if values[0] == -1 else values[0]
+            else:
+                for adc, value in zip(car.grayscale_adcs, values):
+                    backend.adc_values[adc.chn] = value
+        result = getattr(car, name)()
+        if not isinstance(result, list):
+            result = [result]
+        if any(abs(a - b) > 0.01 for a, b in zip(result, values) if a is not None and b is not None):
+            mismatches += 1
+    elapsed = time.monotonic() - start
+    lateness = late.summary()
+    return {
+        'records': len(records),
+        'calls': counts,
+        'sensor_mismatches': mismatches,
+        'duration_s': records[-1][0] if records else 0.0,
+        'elapsed_s': elapsed,
+        'late_p50_us': lateness['p50_us'],
+        'late_p99_us': lateness['p99_us'],
+        'late_max_us': lateness['max_us'],
+    }
+
+
+def main():
+    import json
+    import argparse
+    parser = argparse.ArgumentParser(prog='python3 -m picarx.trace', description=__doc__.split('\n')[1])
+    parser.add_argument('command', choices=('dump', 'replay'))
+    parser.add_argument('path')
+    parser.add_argument('--fast', action='store_true', help='replay as fast as possible')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor')
+    parser.add_argument('--real', action='store_true', help='replay on the car instead of the simulator')
+    args = parser.parse_args()
+
+    if args.command == 'dump':
+        header, records = read_trace(args.path)
+        print('# started %s, %d records' % (time.ctime(header['wall_start']), len(records)))
+        for t, name, values in records:
+            print('%10.6f %s(%s)' % (t, name, ', '.join(str(v) for v in values)))
+        return 0
+
+    from .picarx import Picarx
+    # a PICARX_TRACE recorder on the replay car would truncate the trace being replayed
+    os.environ.pop('PICARX_TRACE', None)
+    car = Picarx(backend=None if args.real else 'sim')
+    try:
+        stats = replay(args.path, car, None if args.fast else args.speed)
+    finally:
+        car.stop()
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
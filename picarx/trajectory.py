@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+'''
+Non-blocking servo trajectory engine
+
+Moves the direction, camera pan and camera tilt servos to target angles
+over a duration with an easing curve. One background thread interpolates
+every active move at a fixed rate and writes each servo at most once per
+tick, all in one bus transaction.
+
+    handle = px.move_servos(0.5, pan=30, tilt=-20, easing='ease_in_out')
+    ...                   # the caller is free meanwhile
+    handle.wait()         # or: await handle, or handle.cancel()
+'''
+import math
+import time
+import threading
+
+EASING = {
+    'linear': lambda x: x,
+    'ease_in': lambda x: x * x,
+    'ease_out': lambda x: x * (2 - x),
+    'ease_in_out': lambda x: 0.5 - 0.5 * math.cos(math.pi * x),
+    'step': lambda x: 1.0 if x >= 1 else 0.0,
+}
+
+# servo name: (Picarx setter, Picarx attribute holding its current angle)
+SERVOS = {
+    'dir': ('set_dir_servo_angle', 'dir_current_angle'),
+    'pan': ('set_cam_pan_angle', 'cam_pan_current_angle'),
+    'tilt': ('set_cam_tilt_angle', 'cam_tilt_current_angle'),
+}
+
+
+class MotionHandle(object):
+    ''' result of TrajectoryEngine.move(), wait() or await it, or cancel() '''
+
+    def __init__(self, engine, servos):
+        self._engine = engine
+        self._pending = set(servos)
+        self._event = threading.Event()
+        self._callbacks = []
+        self.cancelled = False
+        self.exception = None # the error that ended the move, if a servo write failed
+        if not self._pending:
+            self._event.set()
+
+    @property
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        ''' block until the move finished, was cancelled or failed, False on timeout '''
+        return self._event.wait(timeout)
+
+    def cancel(self):
+        ''' stop the move where it is now '''
+        self._engine._cancel(self)
+
+    def add_done_callback(self, callback):
+        ''' callback(handle) from the engine thread, or right away if done '''
+        with self._engine._cond:
+            if not self.done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _finish(self, servo, cancelled=False, error=None):
+        # called with the engine lock held
+        self._pending.discard(servo)
+        if cancelled:
+            self.cancelled = True
+        if error is not None and not self._event.is_set():
+            self.exception = error
+        if not self._pending and not self._event.is_set():
+            self._event.set()
+            for callback in self._callbacks:
+                callback(self)
+            self._callbacks = []
+
+    def __await__(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(_future):
+            if _future.done():
+                return
+            if self.exception is not None:
+                _future.set_exception(self.exception)
+            else:
+                _future.set_result(self)
+        self.add_done_callback(lambda handle: loop.call_soon_threadsafe(resolve, future))
+        return future.__await__()
+
+
+class _Segment(object):
+    __slots__ = ('handle', 'start', 'end', 'began', 'duration', 'ease')
+
+    def __init__(self, handle, start, end, began, duration, ease):
+        self.handle = handle
+        self.start = start
+        self.end = end
+        self.began = began
+        self.duration = duration
+        self.ease = ease
+
+
+class TrajectoryEngine(object):
+    ''' interpolates servo moves for a Picarx in one thread
+
+    param car: Picarx
+    param hz: update rate of the servos
+    '''
+
+    def __init__(self, car, hz=50):
+        self.car = car
+        self.hz = hz
+        self.period = 1.0 / hz
+        self._segments = {} # servo name: _Segment
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self.ticks = 0
+        self.writes = 0
+
+    def move(self, duration, easing='ease_in_out', **targets):
+        ''' move servos to target angles over duration seconds
+
+        param duration: seconds, 0 jumps on the next tick
+        param easing: name in EASING or a function mapping 0..1 to 0..1
+        param targets: dir=, pan=, tilt= angles
+        return: MotionHandle
+        '''
+        ease = EASING[easing] if isinstance(easing, str) else easing
+        for servo in targets:
+            if servo not in SERVOS:
+                raise ValueError("unknown servo '%s', choose from %s" % (servo, list(SERVOS)))
+        with self._cond:
+            handle = MotionHandle(self, targets)
+            now = time.monotonic()
+            for servo, angle in targets.items():
+                # a new move takes the servo over from where it is right now
+                old = self._segments.get(servo)
+                if old is not None:
+                    old.handle._finish(servo, cancelled=True)
+                start = getattr(self.car, SERVOS[servo][1])
+                self._segments[servo] = _Segment(handle, start, angle, now, duration, ease)
+            self._ensure_thread()
+            self._cond.notify()
+        return handle
+
+    def _cancel(self, handle):
+        with self._cond:
+            for servo, segment in list(self._segments.items()):
+                if segment.handle is handle:
+                    del self._segments[servo]
+                    handle._finish(servo, cancelled=True)
+
+    def cancel_all(self):
+        with self._cond:
+            for servo, segment in list(self._segments.items()):
+                segment.handle._finish(servo, cancelled=True)
+            self._segments.clear()
+
+    @property
+    def busy(self):
+        return bool(self._segments)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='trajectory', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        deadline = time.monotonic()
+        while True:
+            with self._cond:
+                while not self._segments and not self._closed:
+                    self._cond.wait()
+                    deadline = time.monotonic()
+                if self._closed:
+                    return
+                now = time.monotonic()
+                angles = {}
+                finished = []
+                ticked = list(self._segments.items())
+                for servo, segment in ticked:
+                    if segment.duration <= 0:
+                        progress = 1.0
+                    else:
+                        progress = min(1.0, (now - segment.began) / segment.duration)
+                    angles[servo] = segment.start + (segment.end - segment.start) * segment.ease(progress)
+                    if progress >= 1.0:
+                        del self._segments[servo]
+                        finished.append((servo, segment.handle))
+            # one write per servo per tick, all in one transaction
+            try:
+                with self.car.transaction():
+                    for servo, angle in angles.items():
+                        getattr(self.car, SERVOS[servo][0])(angle)
+            except Exception as e:
+                # give up on the moves of this tick, their waiters get the error
+                print("trajectory: servo write failed: %s" % e)
+                with self._cond:
+                    for servo, segment in ticked:
+                        if self._segments.get(servo) is segment:
+                            del self._segments[servo]
+                        segment.handle._finish(servo, error=e)
+                finished = []
+                angles = {}
+            if finished:
+                with self._cond:
+                    for servo, handle in finished:
+                        handle._finish(servo)
+            self.ticks += 1
+            self.writes += len(angles)
+            deadline += self.period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+
+    def close(self):
+        self.cancel_all()
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+'''
+Timer wheel and deadman watchdog
+
+A Deadman holds a lease that the owner keeps refreshing, e.g. on every
+valid motion command. When the lease runs out without a refresh the expire
+callback runs once, typically stopping the motors, and the deadman stays
+disarmed until the next refresh.
+
+The expiry runs on a TimerWheel thread of its own, so it does not depend on
+the thread doing the refreshing: a receive loop stuck in a print or a bus
+call still gets its motors stopped on time. Refreshing only stores a new
+deadline, it does not touch the wheel; when the timer fires early because
+of a refresh it re-arms itself for the remainder.
+
+    wheel = TimerWheel(tick=0.005)
+    deadman = Deadman(0.15, px.emergency_stop, wheel)
+    ...
+    deadman.refresh()       # on every valid command
+'''
+import math
+import time
+import threading
+from .instrument import LatencyHistogram
+
+
+class Timer(object):
+    ''' a scheduled callback of a TimerWheel, cancel() to drop it '''
+    __slots__ = ('callback', 'rounds', 'cancelled')
+
+    def __init__(self, callback, rounds):
+        self.callback = callback
+        self.rounds = rounds # full turns of the wheel still to wait
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel(object):
+    ''' hashed timer wheel ticked by a daemon thread
+
+    Scheduling and cancelling are O(1); each tick only looks at one slot.
+    Timers fire on the first tick at or after their delay, so they are late
+    by up to one tick.
+
+    param tick: seconds per slot
+    param slots: slots in the wheel, delays beyond tick * slots take extra turns
+    '''
+
+    def __init__(self, tick=0.005, slots=256, name='timer_wheel'):
+        if tick <= 0:
+            raise ValueError("tick must be > 0")
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.name = name
+        self._position = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.fired = 0
+        self.errors = 0
+        self.lateness = LatencyHistogram() # ns between the tick's due time and running it
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def schedule(self, delay, callback):
+        ''' run callback() from the wheel thread after delay seconds, returns its Timer '''
+        ticks = max(1, int(math.ceil(delay / self.tick)))
+        rounds, offset = divmod(ticks - 1, len(self.slots))
+        timer = Timer(callback, rounds)
+        with self._lock:
+            self.slots[(self._position + 1 + offset) % len(self.slots)].append(timer)
+        return timer
+
+    def _advance(self):
+        # move to the next slot, return the timers due there
+        due = []
+        with self._lock:
+            self._position = (self._position + 1) % len(self.slots)
+            slot = self.slots[self._position]
+            waiting = []
+            for timer in slot:
+                if timer.cancelled:
+                    continue
+                if timer.rounds:
+                    timer.rounds -= 1
+                    waiting.append(timer)
+                else:
+                    due.append(timer)
+            self.slots[self._position] = waiting
+        return due
+
+    def _run(self):
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            deadline += self.tick
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            # a late tick catches up slot by slot, nothing is skipped
+            self.lateness.record(max(0, int((time.monotonic() - deadline) * 1e9)))
+            for timer in self._advance():
+                self.fired += 1
+                try:
+                    timer.callback()
+                except Exception as e:
+                    self.errors += 1
+                    print("%s: timer callback failed: %s" % (self.name, e))
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def stats(self):
+        lateness = self.lateness.summary()
+        return {
+            'tick_ms': self.tick * 1e3,
+            'fired': self.fired,
+            'errors': self.errors,
+            'late_p50_us': lateness['p50_us'],
+            'late_p99_us': lateness['p99_us'],
+            'late_max_us': lateness['max_us'],
+        }
+
+
+class Deadman(object):
+    ''' calls on_expire() once when refresh() was not called for lease seconds
+
+    param lease: seconds a refresh keeps the deadman happy
+    param on_expire: called from the wheel thread, keep it short (one bus write)
+    param wheel: TimerWheel to run on, a private one if None
+    '''
+
+    def __init__(self, lease, on_expire, wheel=None):
+        if lease <= 0:
+            raise ValueError("lease must be > 0")
+        self.lease = lease
+        self.on_expire = on_expire
+        self.wheel = wheel if wheel is not None else TimerWheel(tick=min(0.005, lease / 10))
+        self._lock = threading.Lock()
+        self._deadline = None
+        self._timer = None
+        self.refreshes = 0
+        self.expiries = 0
+        self.expire_delay = LatencyHistogram() # ns from the lease end to on_expire returning
+
+    @property
+    def armed(self):
+        return self._timer is not None
+
+    def refresh(self):
+        ''' extend the lease, arms the deadman if it was not '''
+        with self._lock:
+            self._deadline = time.monotonic() + self.lease
+            self.refreshes += 1
+            if self._timer is None:
+                self._timer = self.wheel.schedule(self.lease, self._check)
+
+    def disarm(self):
+        ''' stop watching without calling on_expire, e.g. on a clean shutdown '''
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _check(self):
+        with self._lock:
+            if self._timer is None:
+                return
+            remaining = self._deadline - time.monotonic()
+            if remaining > 0:
+                # refreshed since the timer was set
+                self._timer = self.wheel.schedule(remaining, self._check)
+                return
+            self._timer = None
+            deadline = self._deadline
+            self.expiries += 1
+        self.on_expire()
+        self.expire_delay.record(max(0, int((time.monotonic() - deadline) * 1e9)))
+
+    def stats(self):
+        delay = self.expire_delay.summary()
+        return {
+            'lease_ms': self.lease * 1e3,
+            'refreshes': self.refreshes,
+            'expiries': self.expiries,
+            'expire_p50_ms': delay['p50_us'] / 1e3,
+            'expire_max_ms': delay['max_us'] / 1e3,
+        }